@@ -63,7 +63,7 @@ from m5.util.fdthelper import *
 
 from gem5.isas import ISA
 
-addToPath("../../")
+addToPath("../")
 
 from common import (
     CacheConfig,
@@ -353,6 +353,21 @@ parser = argparse.ArgumentParser()
 Options.addCommonOptions(parser)
 Options.addFSOptions(parser)
 
+##add this for the RL driver: a console port per parallel instance and periodic stats dumps
+parser.add_argument(
+    "--terminal-port",
+    type=int,
+    default=3462,
+    help="TCP port of the pc.com_1 terminal (one per concurrent instance)",
+)
+parser.add_argument(
+    "--stats-dump-period",
+    type=int,
+    default=0,
+    help="dump stats every this many ticks (0: off), read by the RL convergence monitor",
+)
+##end add
+
 # Add the ruby specific and protocol specific args
 if "--ruby" in sys.argv:
     Ruby.define_options(parser)
@@ -602,7 +617,7 @@ if args.wait_gdb:
         #except Exception as e:
             #print("Error during network initialization or packet counting:", e)
 ## end add
-terminal = Terminal(port=3462)
+terminal = Terminal(port=args.terminal_port)
 
 # Attach the terminal to the com_1 device of the pc
 test_sys.pc.com_1.device = terminal 
@@ -621,6 +636,24 @@ Simulation.setWorkCountOptions(test_sys, args)
 
    #print("Simulation complete. Packet counting results written to", network.packet_count_file)
    
+##add this: gem5's HDF5 writer (--stats-file=h5://...) skips histograms such as
+##delayVCHist, so keep the text stats as well; parse_stats_h5 reads those from it
+if m5.options.stats_file.startswith("h5://"):
+    m5.stats.addStatVisitor("stats.txt")
+##end add
+
+##add this: periodic dumps can only be scheduled once Simulation.run has
+##instantiated (or restored) the system, so hook them onto m5.instantiate
+if args.stats_dump_period > 0:
+    _instantiate = m5.instantiate
+
+    def _instantiate_with_periodic_dumps(*instantiate_args, **instantiate_kwargs):
+        _instantiate(*instantiate_args, **instantiate_kwargs)
+        m5.stats.periodicStatDump(args.stats_dump_period)
+
+    m5.instantiate = _instantiate_with_periodic_dumps
+##end add
+
 print("simulation.run codes in fs.py start")  
 #m5.debug.setDebugFlag('RubyNetwork')
 # Enable the Ruby network debug flag
@@ -631,6 +664,14 @@ print("simulation.run codes in fs.py start")
 #m5.options.debug_file = 'ruby_network.log'
 Simulation.run(args, root, test_sys, FutureClass, post_run_callback=None)
 
+##add this: tell the RL driver that the simulation loop is over (icn_gym_drl_2.wait_for_stats).
+##gem5 writes the final stats dump while exiting right after this, so the driver
+##treats "sentinel present and gem5 exited" as "stats.txt complete"
+_sentinel = os.path.join(m5.options.outdir, "stats_dumped")
+with open(_sentinel + ".tmp", "w") as f:
+    f.write(f"{m5.curTick()}\n")
+os.replace(_sentinel + ".tmp", _sentinel)
+
 
 ##end add_3
 
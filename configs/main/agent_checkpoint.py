@@ -0,0 +1,29 @@
+##this file is to write and read checkpoints of the whole RL agent, so a training run can resume after a crash
+import random
+
+import numpy as np
+import torch
+
+from atomic_file import atomic_write
+
+
+def rng_state():
+    """The state of the Python, NumPy and torch random generators."""
+    return {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+
+
+def save_checkpoint(path, state):
+    """Write the dict `state` to `path` with torch.save; a crash while saving leaves the previous checkpoint whole."""
+    with atomic_write(path) as f:
+        torch.save(state, f)
+
+
+def load_checkpoint(path):
+    """The dict saved at `path`; it holds pickled agent objects, so only load checkpoints you wrote."""
+    return torch.load(path, weights_only=False)
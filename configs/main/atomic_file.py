@@ -0,0 +1,26 @@
+##this file is to write files that a crash leaves either whole or as they were before, never half-written
+import os
+import threading
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """Open a temporary file next to `path` for writing, to take the place of `path` once written.
+
+    When the block ends, the file is flushed and fsynced to disk, then
+    renamed over `path`. If the block raises, the temporary file is removed
+    and `path` is untouched. The temporary name is unique to the process and
+    thread, so concurrent writers of `path` do not clobber each other's file.
+    """
+    tmp_path = f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
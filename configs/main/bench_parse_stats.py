@@ -0,0 +1,390 @@
+##this file is to measure the stats.txt parsers (compressed and parallel reading too) on a synthetic gem5 stats file of realistic shape
+import argparse
+import gzip
+import os
+import random
+import shutil
+import time
+
+from extract_network_stats import decompressed_lines, parse_stats, parse_stats_lines, parse_stats_parallel
+
+# Stats of other SimObjects per core and dump; a real gem5 FS dump holds
+# thousands of lines the RL driver never looks at
+FILLER_PER_CORE = 300
+
+
+def _line(name, value):
+    return f"{name:<70} {value:>16} # (Unspecified)\n"
+
+
+def write_stats_file(path, target_mb, num_cores, seed=0):
+    """Write dumps of a gem5-like stats.txt until it is about `target_mb` MB; returns the dump count."""
+    r = random.Random(seed)
+    target = target_mb * 2**20
+    dumps = 0
+    with open(path, 'w') as f:
+        while f.tell() < target:
+            dumps += 1
+            f.write("\n---------- Begin Simulation Statistics ----------\n")
+            f.write(_line("simTicks", r.randint(10**9, 10**12)))
+            for core in range(num_cores):
+                for i in range(FILLER_PER_CORE):
+                    f.write(_line(f"system.cpu{core}.filler.stat{i}", r.randint(0, 10**6)))
+            for name in ("packets_injected", "packets_received", "flits_injected", "flits_received"):
+                f.write(_line(f"system.ruby.network.{name}::total", r.randint(1, 10**6)))
+                for vnet in range(3):
+                    f.write(_line(f"system.ruby.network.{name}::{vnet}", r.randint(1, 10**6)))
+            f.write(_line("system.ruby.network.ext_in_link_utilization", r.randint(1, 10**6)))
+            f.write(_line("system.ruby.network.int_link_utilization", r.randint(1, 10**6)))
+            for name in ("average_packet_queueing_latency", "average_packet_network_latency",
+                         "average_packet_latency", "average_flit_queueing_latency",
+                         "average_flit_network_latency", "average_flit_latency", "average_hops",
+                         "avg_link_utilization"):
+                f.write(_line(f"system.ruby.network.{name}", f"{r.uniform(1, 5000):.6f}"))
+            for vnet in range(3):
+                prefix = f"system.ruby.delayVCHist.vnet_{vnet}"
+                f.write(_line(f"{prefix}::samples", r.randint(1, 1000)))
+                f.write(_line(f"{prefix}::mean", f"{r.uniform(1, 50):.6f}"))
+                for bucket in range(0, 32, 4):
+                    f.write(_line(f"{prefix}::{bucket}-{bucket + 3}", r.randint(0, 100)))
+                f.write(_line(f"{prefix}::total", r.randint(1, 1000)))
+            for core in range(num_cores):
+                prefix = f"system.ruby.l1_cntrl{core}.L1Dcache"
+                f.write(_line(f"{prefix}.demand_hits", r.randint(0, 10**6)))
+                f.write(_line(f"{prefix}.total_cache_level_messages", r.randint(0, 10**5)))
+                f.write(_line(f"{prefix}.NoCwriteHitCounter", r.randint(0, 10**4)))
+                f.write(_line(f"{prefix}.totalNoCWriteHitDuration", r.randint(0, 10**7)))
+                f.write(_line(f"{prefix}.NoCreadMissCounter", r.randint(0, 10**4)))
+                f.write(_line(f"{prefix}.totalNoCReadMissDuration", r.choice([0, r.randint(1, 10**7)])))
+            f.write("\n---------- End Simulation Statistics   ----------\n")
+    return dumps
+
+
+def parse_stats_lines_substring(lines, num_cores):
+    """The original parser of extract_network_stats: substring tests against every metric and every core on each line.
+
+    Kept here as the reference that parse_stats_lines is measured against.
+    """
+    # Initialize variables to accumulate sums and count the number of dumps
+    sums = {
+        "packets_injected": 0.0,
+        "packets_received": 0.0,
+        "flits_injected": 0.0,
+        "flits_received": 0.0,
+        "external_link_utilization": 0.0,
+        "internal_link_utilization": 0.0,
+        "total_cache_level_messages": 0.0,
+        "total_NoCWriteHitDuration": 0.0,
+        "total_NoCReadMissDuration": 0.0,
+        "cache_level_messages" : 0,
+        "average_packet_delay":0.0,
+        "vnet_0_delay": 0.0,
+        "vnet_0_samples": 0,
+        "vnet_0_total_delay": 0.0,
+        "vnet_1_delay": 0.0,
+        "vnet_1_samples": 0,
+        "vnet_1_total_delay": 0.0,
+        "vnet_2_delay": 0.0,
+        "vnet_2_samples": 0,
+        "vnet_2_total_delay": 0.0
+        #"total_energy": 0.0,
+        #"total_power": 0.0
+        #"total_writehit_counter":0,
+        #"total_readmiss_counter":0
+        #"network_delay":0.0
+        
+    }
+    latencies = {
+        "average_packet_queueing_latency": 0.0,
+        "average_packet_network_latency": 0.0,
+        "average_packet_latency": 0.0,
+        "average_flit_queueing_latency": 0.0,
+        "average_flit_network_latency": 0.0,
+        "average_flit_latency": 0.0,
+        "average_hops": 0.0,
+        "average_link_utilization": 0.0,
+        "average_network_delay":0.0
+    }
+    
+    
+    dump_count = 0  # To track the number of dumps
+
+    total_writehit_counter = 0
+    total_readmiss_counter = 0
+
+    # Temporary variables to hold the counters
+    writehit_counters = {}
+    readmiss_counters = {}
+
+
+    
+
+    for line in lines:
+        if "Begin Simulation Statistics" in line:
+            dump_count += 1  # Increment the dump count
+        
+        # Sum the values for each metric
+        if "system.ruby.network.packets_injected::total" in line:
+            sums["packets_injected"] += float(line.split()[1])
+        elif "system.ruby.network.packets_received::total" in line:
+            sums["packets_received"] += float(line.split()[1])
+        elif "system.ruby.network.flits_injected::total" in line:
+            sums["flits_injected"] += float(line.split()[1])
+        elif "system.ruby.network.flits_received::total" in line:
+            sums["flits_received"] += float(line.split()[1])
+        elif "system.ruby.network.ext_in_link_utilization" in line:
+            sums["external_link_utilization"] += float(line.split()[1])
+        elif "system.ruby.network.int_link_utilization" in line:
+            sums["internal_link_utilization"] += float(line.split()[1])
+        elif "L1Dcache.total_cache_level_messages" in line:
+            sums["cache_level_messages"] +=int(line.split()[1])
+        
+                
+
+            
+        #calculate the network delay
+        '''
+        elif ("system.ruby.delayVCHist.vnet_0::mean" in line or "system.ruby.delayVCHist.vnet_1::mean" in line or "system.ruby.delayVCHist.vnet_2::mean" in line):
+            latencies["average_network_delay"] += float(line.split()[1])  
+        '''
+        if "system.ruby.delayVCHist.vnet_0::mean" in line:
+            sums["vnet_0_delay"] = float(line.split()[1])
+        elif "system.ruby.delayVCHist.vnet_0::total " in line:
+            sums["vnet_0_samples"] = int(line.split()[1])
+            sums["vnet_0_total_delay"] = sums["vnet_0_delay"] * sums["vnet_0_samples"]
+
+        elif "system.ruby.delayVCHist.vnet_1::mean" in line:
+            sums["vnet_1_delay"] = float(line.split()[1])
+        elif "system.ruby.delayVCHist.vnet_1::total " in line:
+            sums["vnet_1_samples"] = int(line.split()[1])
+            sums["vnet_1_total_delay"] = sums["vnet_1_delay"] * sums["vnet_1_samples"]
+
+        elif "system.ruby.delayVCHist.vnet_2::mean" in line:
+            sums["vnet_2_delay"] = float(line.split()[1])
+        elif "system.ruby.delayVCHist.vnet_2::total " in line:
+            sums["vnet_2_samples"] = int(line.split()[1])
+            sums["vnet_2_total_delay"] = sums["vnet_2_delay"] * sums["vnet_2_samples"]
+            
+            
+                                
+        elif "system.ruby.network.average_packet_queueing_latency" in line:
+            latencies["average_packet_queueing_latency"] += float(line.split()[1])
+        elif "system.ruby.network.average_packet_network_latency" in line:
+            latencies["average_packet_network_latency"] += float(line.split()[1])
+        elif "system.ruby.network.average_packet_latency" in line:
+            latencies["average_packet_latency"] += float(line.split()[1])
+            
+        elif "system.ruby.network.average_flit_queueing_latency" in line:
+            latencies["average_flit_queueing_latency"] += float(line.split()[1])
+        elif "system.ruby.network.average_flit_network_latency" in line:
+            latencies["average_flit_network_latency"] += float(line.split()[1])
+        elif "system.ruby.network.average_flit_latency" in line:
+            latencies["average_flit_latency"] += float(line.split()[1])
+        elif "system.ruby.network.average_hops" in line:
+            latencies["average_hops"] += float(line.split()[1])
+        elif "system.ruby.network.avg_link_utilization" in line:
+            latencies["average_link_utilization"] += float(line.split()[1])
+
+            
+            
+        #for i in range(num_cores):  # Assuming 4 cores, you can adjust this as needed
+            #if f"system.ruby.l1_cntrl{i}" in line:
+                #if "L1Dcache.totalNoCWriteHitDuration" in line:
+                    #duration = float(line.split()[1])
+                    #if duration > 0:
+                        #sums["total_NoCWriteHitDuration"] += duration
+                        # Fetch the next lines to find the corresponding counter
+
+                        #next_line = next(f)
+                        #if f"system.ruby.l1_cntrl{i}" in next_line and "L1Dcache.NoCwriteHitCounter" in next_line:
+                        #if "L1Dcache.NoCwriteHitCounter" in next_line:
+                            #sums["total_writehit_counter"] += int(next_line.split()[1])
+                            #sums["total_writehit_counter"] += int(line.split()[1])
+                            #total_writehit_counter += int(next_line.split()[1])
+                        
+
+                    #print(f"Core {i}: WriteHit Duration = {duration}, Counter = {sums['total_writehit_counter']}")
+
+                
+                #elif "L1Dcache.totalNoCReadMissDuration" in line:
+                    #duration = float(line.split()[1])
+                    #if duration > 0:
+                        #sums["total_NoCReadMissDuration"] += duration
+                        
+                        #print(f"Core {i}: WriteMiss Duration = {duration}")
+                        # Fetch the next lines to find the corresponding counter
+
+                        #next_line = next(f)
+                        #if f"system.ruby.l1_cntrl{i}" in next_line and "L1Dcache.NoCreadMissCounter" in next_line:
+                        #if f"system.ruby.l1_cntrl{i}" in line and "L1Dcache.NoCreadMissCounter" in line:
+                            #sums["total_readmiss_counter"] += int(next_line.split()[1])
+                            #sums["total_readmiss_counter"] += int(line.split()[1])
+                            #total_readmiss_counter += int(line.split()[1])
+
+
+                        #print(f"Core {i}: WriteHit Duration = {duration}, Counter = {sums['total_writehit_counter']}")
+
+        for i in range(num_cores):
+            if f"system.ruby.l1_cntrl{i}" in line:
+                if "L1Dcache.NoCwriteHitCounter" in line:
+                    writehit_counters[i] = int(line.split()[1])
+                elif "L1Dcache.NoCreadMissCounter" in line:
+                    readmiss_counters[i] = int(line.split()[1])
+
+
+                # Process durations
+                elif "L1Dcache.totalNoCWriteHitDuration" in line:
+                    duration = float(line.split()[1])
+                    if duration > 0 and i in writehit_counters:
+                        sums["total_NoCWriteHitDuration"] += duration
+                        total_writehit_counter += writehit_counters[i]
+                elif "L1Dcache.totalNoCReadMissDuration" in line:
+                    duration = float(line.split()[1])
+                    if duration > 0 and i in readmiss_counters:
+                        sums["total_NoCReadMissDuration"] += duration
+                        total_readmiss_counter += readmiss_counters[i]
+                        
+                        
+
+
+    # Calculate the average for each latency metric using the total dump count
+    sums["average_packet_delay"] = (sums["vnet_0_total_delay"] + sums["vnet_1_total_delay"] + sums["vnet_2_total_delay"]) #/sums["packets_received"]
+    averages = {}
+    for key in latencies:
+       averages[key] = latencies[key] / dump_count if dump_count > 0 else 0
+    '''
+        if key == "average_network_delay":
+            averages[key] = latencies[key] / (3 * dump_count) if dump_count > 0 else 0
+        else:
+    '''
+        
+
+    # Adjust average network delay calculation by dividing by (3 * dump_count)
+    #averages["average_network_delay"] /= (3 * dump_count) 
+    
+    
+    # Add the sums directly for metrics that don't need averaging
+    averages.update({
+        "packets_injected": sums["packets_injected"],
+        "packets_received": sums["packets_received"],
+        "flits_injected": sums["flits_injected"],
+        "flits_received": sums["flits_received"],
+        "external_link_utilization": sums["external_link_utilization"],
+        "internal_link_utilization": sums["internal_link_utilization"],
+        "total_cache_level_messages": sums["cache_level_messages"],
+        #"total_NoCWriteHitDuration": sums["total_NoCWriteHitDuration"],
+        #"total_NoCWriteMissDuration": sums["total_NoCWriteMissDuration"],
+        #"total_NoCReadMissDuration": sums["total_NoCReadMissDuration"]
+        "total_average_write_hit_time": (round(sums["total_NoCWriteHitDuration"]/total_writehit_counter,2) if total_writehit_counter > 0 else 0),
+        "total_average_readmiss_time": (round(sums["total_NoCReadMissDuration"]/total_readmiss_counter,2) if total_readmiss_counter > 0 else 0),
+        "average_packet_delay": sums["average_packet_delay"],
+        #"total_energy (pJ)": sums["total_energy"],
+        #"average_power (mW)": sums["total_power"] / (num_cores * 2) if num_cores > 0 else 0,
+    })
+
+    return averages
+
+
+def time_parser(parser, path, num_cores, repeat, opener=open):
+    """Best wall time of `repeat` runs of `parser` over the lines of `opener(path)`, and its result."""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        with opener(path) as f:
+            result = parser(f, num_cores)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class _Path:
+    """Hand the path itself to parsers that open the file on their own."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        return self.path
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _Lines:
+    """decompressed_lines as a context manager, like the file objects of the other openers."""
+
+    def __init__(self, path):
+        self.lines = decompressed_lines(path)
+
+    def __enter__(self):
+        return self.lines
+
+    def __exit__(self, *exc):
+        self.lines.close()
+
+
+def bench_compressed(path, num_cores, repeat):
+    """Parse `path` as text, as gzip inflated on the parsing thread, and as gzip inflated by a background thread."""
+    gz_path = path + ".gz"
+    with open(path, 'rb') as src, gzip.open(gz_path, 'wb') as dst:  # zlib's default level, like gem5's gzstream
+        shutil.copyfileobj(src, dst)
+    size_mb = os.path.getsize(path) / 2**20
+    gz_mb = os.path.getsize(gz_path) / 2**20
+    text_time, text_result = time_parser(parse_stats_lines, path, num_cores, repeat)
+    inline_time, inline_result = time_parser(parse_stats_lines, gz_path, num_cores, repeat,
+                                             opener=lambda p: gzip.open(p, 'rt'))
+    threaded_time, threaded_result = time_parser(parse_stats_lines, gz_path, num_cores, repeat, opener=_Lines)
+    same = "same result" if text_result == inline_result == threaded_result else "results differ"
+    print(f"  gzip {gz_mb:.1f} MB ({size_mb / gz_mb:.1f}x smaller): text {size_mb / text_time:.1f} MB/s, "
+          f"inline gzip {size_mb / inline_time:.1f} MB/s, background-thread gzip {size_mb / threaded_time:.1f} MB/s "
+          f"({inline_time / threaded_time:.2f}x over inline, {same})")
+    os.remove(gz_path)
+
+
+def bench_parallel(path, num_cores, repeat, workers):
+    """Parse `path` sequentially and with parse_stats_parallel on each worker count in `workers`."""
+    size_mb = os.path.getsize(path) / 2**20
+    serial_time, serial_result = time_parser(lambda p, n: parse_stats(p, n), path, num_cores, repeat,
+                                             opener=_Path)
+    for count in workers:
+        parallel_time, parallel_result = time_parser(lambda p, n: parse_stats_parallel(p, n, count), path,
+                                                     num_cores, repeat, opener=_Path)
+        same = "same result" if parallel_result == serial_result else "results differ"
+        print(f"  {count} workers: {size_mb / parallel_time:.1f} MB/s against {size_mb / serial_time:.1f} MB/s "
+              f"sequential ({serial_time / parallel_time:.2f}x, {same})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of parse_stats_lines against the substring parser")
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--cores", type=int, nargs="+", default=[4, 64])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default="/tmp")
+    parser.add_argument("--compressed", action="store_true", help="also time parsing the gzip-compressed file")
+    parser.add_argument("--parallel", type=int, nargs="+", metavar="WORKERS",
+                        help="also time parse_stats_parallel with these worker counts")
+    args = parser.parse_args()
+
+    for num_cores in args.cores:
+        path = os.path.join(args.workdir, f"bench_stats_{num_cores}c.txt")
+        dumps = write_stats_file(path, args.size_mb, num_cores)
+        size_mb = os.path.getsize(path) / 2**20
+        old_time, old_result = time_parser(parse_stats_lines_substring, path, num_cores, args.repeat)
+        new_time, new_result = time_parser(parse_stats_lines, path, num_cores, args.repeat)
+        # The substring parser lets l1_cntrl1 match l1_cntrl10..19, so with
+        # more than 10 cores it is the reference for speed only; it has no
+        # per-core breakdown, so only the keys both have are compared
+        same = "same result" if all(new_result[k] == v for k, v in old_result.items() if k in new_result) \
+            else "results differ"
+        print(f"{num_cores} cores, {dumps} dumps, {size_mb:.1f} MB: "
+              f"substring {size_mb / old_time:.1f} MB/s, dispatch table {size_mb / new_time:.1f} MB/s "
+              f"({old_time / new_time:.1f}x, {same})")
+        if args.compressed:
+            bench_compressed(path, num_cores, args.repeat)
+        if args.parallel:
+            bench_parallel(path, num_cores, args.repeat, args.parallel)
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+##this file is to keep post-boot gem5 checkpoints so that episodes restore instead of booting Linux
+import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+
+from atomic_file import atomic_write
+
+DEFAULT_CHECKPOINT_ROOT = "/data/guochu/gem5/checkpoints"
+DEFAULT_MAX_BYTES = 50 * 2**30  # 50 GiB on disk
+
+
+def checkpoint_key(benchmark, num_cpus, l1d_size, l2_size, mem_size):
+    """Library key of a post-boot checkpoint; any of these changes the booted system."""
+    return f"{benchmark}_{num_cpus}c_l1d{l1d_size}_l2{l2_size}_mem{mem_size}"
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class CheckpointLibrary:
+    """Size-bounded, LRU-evicted store of post-boot checkpoints.
+
+    Every key owns one directory under `root` that is used as gem5's
+    --checkpoint-dir. index.json records size, last use and how many
+    restores from each entry succeeded or failed. Entries that are checked
+    out by a running simulation are never evicted.
+    """
+
+    def __init__(self, root=DEFAULT_CHECKPOINT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+        self._in_use = defaultdict(int)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        # Forget entries whose directory was removed by hand
+        return {key: entry for key, entry in index.items() if os.path.isdir(entry["path"])}
+
+    def _save_index(self):
+        with atomic_write(self.index_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def acquire(self, key, create):
+        """Return the checkpoint directory of `key`, creating it first if needed.
+
+        `create(checkpoint_dir)` must boot gem5 once and leave a cpt.* in
+        `checkpoint_dir`; concurrent callers for the same key wait for a
+        single creation. Pair every call with `release`.
+        """
+        with self._key_locks[key]:
+            with self._lock:
+                entry = self.index.get(key)
+            if entry is None:
+                checkpoint_dir = self.path(key)
+                shutil.rmtree(checkpoint_dir, ignore_errors=True)
+                os.makedirs(checkpoint_dir)
+                start_time = time.time()
+                create(checkpoint_dir)
+                if not any(name.startswith("cpt.") for name in os.listdir(checkpoint_dir)):
+                    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+                    raise RuntimeError(f"Booting for checkpoint {key} produced no cpt.* in {checkpoint_dir}")
+                entry = {
+                    "path": checkpoint_dir,
+                    "size": _dir_size(checkpoint_dir),
+                    "created": time.time(),
+                    "boot_time": time.time() - start_time,
+                    "last_used": time.time(),
+                    "restores": 0,
+                    "restore_failures": 0,
+                    "last_restore_ok": None,
+                }
+                print(f"? Checkpoint {key} created in {entry['boot_time']:.0f} s ({entry['size'] / 2**20:.0f} MiB).")
+
+            with self._lock:
+                entry["last_used"] = time.time()
+                self.index[key] = entry
+                self._in_use[key] += 1
+                self._evict()
+                self._save_index()
+            return entry["path"]
+
+    def release(self, key, restored):
+        """Give back a checkpoint from `acquire` and record whether restoring it worked."""
+        with self._lock:
+            self._in_use[key] -= 1
+            entry = self.index.get(key)
+            if entry is None:
+                return
+            if restored:
+                entry["restores"] += 1
+            else:
+                entry["restore_failures"] += 1
+            entry["last_restore_ok"] = bool(restored)
+            self._save_index()
+
+    def _evict(self):
+        """Drop least recently used entries until the library fits in max_bytes (lock held)."""
+        total = self.total_bytes()
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if self._in_use[key] > 0:
+                continue
+            entry = self.index.pop(key)
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            total -= entry["size"]
+            print(f"? Evicted checkpoint {key} ({entry['size'] / 2**20:.0f} MiB).")
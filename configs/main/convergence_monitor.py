@@ -0,0 +1,175 @@
+##this file is to stop a gem5 episode early once its reward inputs have converged or it cannot beat the best action
+import math
+import os
+import zlib
+
+from extract_network_stats import DumpAggregate
+from file_watch import FileWatcher, IN_MODIFY
+
+BEGIN_MARKER = "Begin Simulation Statistics"
+END_MARKER = "End Simulation Statistics"
+
+# Reward inputs of reward_f that settle to a value during a run; the cache
+# message count only grows, so it never converges and is left out
+CONVERGING_INPUTS = (
+    "average_packet_latency",
+    "total_average_write_hit_time",
+    "total_average_readmiss_time",
+)
+
+
+class StatsFollower:
+    """Parse the dumps gem5 appends to stats.txt, one complete block at a time.
+
+    Keeps the byte offset of what it has read, the partial last line and
+    the lines of the dump being written, so every `poll` only costs the new
+    bytes. `aggregate` folds in every completed dump (aggregate.result() is
+    parse_stats of the file so far). A stats.txt that shrinks or is
+    replaced (e.g. by a restarted run) is followed from its start again.
+    A gzip stats file (gem5's --stats-file=stats.txt.gz) is inflated as it
+    grows.
+    """
+
+    def __init__(self, stats_file, num_cores):
+        self.stats_file = stats_file
+        self.num_cores = num_cores
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.latest = None
+        self.aggregate = DumpAggregate(self.num_cores)
+        self._inode = None
+        self._partial = b""
+        self._block = None
+        self._inflate = zlib.decompressobj(wbits=31) if self.stats_file.endswith(".gz") else None
+
+    @property
+    def dumps(self):
+        return self.aggregate.dump_count
+
+    def poll(self):
+        """Return the parse_stats dict of every block completed since the last call."""
+        try:
+            with open(self.stats_file, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self._inode or stat.st_size < self.offset:
+                    self.reset()
+                    self._inode = stat.st_ino
+                if stat.st_size == self.offset:
+                    return []
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        if self._inflate is not None:
+            data = self._inflate_members(data)
+
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        finished = []
+        for line in lines:
+            line = line.decode(errors="replace")
+            if BEGIN_MARKER in line:
+                self._block = [line]
+            elif self._block is not None:
+                self._block.append(line)
+                if END_MARKER in line:
+                    self.latest = self.aggregate.add(self._block)
+                    finished.append(self.latest)
+                    self._block = None
+        return finished
+
+    def _inflate_members(self, data):
+        out = self._inflate.decompress(data)
+        while self._inflate.eof and self._inflate.unused_data:  # next gzip member
+            rest = self._inflate.unused_data
+            self._inflate = zlib.decompressobj(wbits=31)
+            out += self._inflate.decompress(rest)
+        return out
+
+    def follow(self, alive, timeout=1.0):
+        """Yield the dict of every dump as it is completed, until alive() is false and nothing is left."""
+        directory = os.path.dirname(os.path.abspath(self.stats_file))
+        with FileWatcher(directory, FileWatcher.DEFAULT_MASK | IN_MODIFY) as watcher:
+            while True:
+                running = alive()
+                yield from self.poll()
+                if not running:
+                    return
+                watcher.wait(timeout)
+
+
+def _half_width(values, z):
+    """Half width of the normal-approximation confidence interval of the mean of `values`."""
+    n = len(values)
+    if n < 2:
+        return math.inf
+    mean = sum(values) / n
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return z * math.sqrt(variance / n)
+
+
+class ConvergenceMonitor:
+    """Decide from periodic stats dumps whether a run can be cut short.
+
+    A run is stopped as "converged" when, over the last `window` dumps,
+    the confidence interval of every CONVERGING_INPUTS value is within
+    `rel_tol` of its mean. It is stopped as "worse_than_incumbent" when even
+    the upper confidence bound of its reward is below `incumbent`, the best
+    reward seen so far. Each dump only covers its own interval (gem5 resets
+    the stats after a periodic dump), so the reward is that of `totals`,
+    the parse_stats of all dumps so far (the message-count term of reward_f
+    only grows, so the current reward is already optimistic about it).
+    """
+
+    def __init__(self, reward_f, incumbent=None, rel_tol=0.02, window=8, min_dumps=4, z=1.96):
+        self.reward_f = reward_f
+        self.incumbent = incumbent
+        self.rel_tol = rel_tol
+        self.window = window
+        self.min_dumps = min_dumps
+        self.z = z
+        self.reset()
+
+    def reset(self):
+        """Forget all dumps, e.g. when the run is started again."""
+        self.history = {key: [] for key in CONVERGING_INPUTS}
+        self.rewards = []
+        self.totals = None
+        self.reason = None
+
+    @property
+    def dumps(self):
+        return len(self.rewards)
+
+    def update(self, dicts, totals=None):
+        """Feed the stats of one dump and of all dumps so far (`totals`, default `dicts`); returns the stop reason or None to keep running."""
+        self.totals = dicts if totals is None else totals
+        for key in CONVERGING_INPUTS:
+            self.history[key].append(float(dicts[key]))
+        self.rewards.append(self.reward_f(self.totals))
+        if self.reason is not None or self.dumps < self.min_dumps:
+            return self.reason
+
+        converged = True
+        for key in CONVERGING_INPUTS:
+            recent = self.history[key][-self.window:]
+            mean = sum(recent) / len(recent)
+            if _half_width(recent, self.z) > self.rel_tol * max(abs(mean), 1e-9):
+                converged = False
+                break
+        if converged:
+            self.reason = "converged"
+        elif self.incumbent is not None:
+            recent = self.rewards[-self.window:]
+            if self.rewards[-1] + _half_width(recent, self.z) < self.incumbent:
+                self.reason = "worse_than_incumbent"
+        return self.reason
+
+    def tag(self, dicts):
+        """Mark `dicts` with how the run ended so training can weight it."""
+        dicts["early_stop"] = self.reason or ""
+        dicts["dumps_observed"] = self.dumps
+        return dicts
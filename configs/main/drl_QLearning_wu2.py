@@ -1,34 +1,69 @@
 ##in ./configs/common/options.py, we can use --l1d_size, --l2_size to change the cache size
 
 
-import random
+import argparse
+import copy
 import os
-from collections import defaultdict, deque
+import multiprocessing
+from collections import defaultdict
 import numpy as np
-import matplotlib as mpl
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
 import csv
 from icn_gym_drl_2 import *
+from gem5_pool import Gem5Pool
+from gym_env import make_env
+from gem5_scheduler import Gem5Scheduler
+from standin_backend import SyntheticBackend
+from checkpoint_library import CheckpointLibrary
+from result_cache import ResultCache
+from convergence_monitor import ConvergenceMonitor
+from stats_schema import metric_keys
+from replay_buffer import ReplayBuffer
+from state_normalizer import RunningNormalizer
+from q_table import QTable
+from agent_checkpoint import save_checkpoint, load_checkpoint, rng_state, set_rng_state
 
 import time
-import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
 ##add this for weight-update
 from weight_update import WeightPredictor
 
 import torch
-import torch.nn as nn
 import torch.optim as optim
 from Qnetwork_drl import QNetwork  # Import the Q-network
 # Global Parameters
 actions = ["Mesh_westfirst", "Pt2Pt", "Crossbar", "Torus", "FatTree", "FlattenedButterfly"]  # Action space,in fact it is mesh topology
 a_size = len(actions)  # Number of actions
-Q = defaultdict(lambda: np.zeros(a_size))  # Q-Table (will be replaced by the Q-network)
 dicts = defaultdict(list)
 total_episodes = 3  # Number of episodes
+num_parallel = 1  # Number of sub-environments stepped at once, each its own gem5 instance (see gym_env.py)
+use_async = False  # Overlap simulation, parsing and training with simulate_rl_async (num_parallel runs in flight)
+use_checkpoints = False  # Restore a post-boot checkpoint in every episode instead of booting Linux
+use_result_cache = False  # Answer already simulated (topology, weights) pairs from result_cache.py
+use_early_stopping = False  # Stop runs whose reward inputs converged or that cannot beat best_reward (convergence_monitor.py)
+early_stop_weight = 0.5  # Learning-rate factor for transitions from runs that were stopped early
+best_reward = None  # Best reward seen so far, the incumbent of the early-stopping monitor
+use_standin = False  # Synthesize stats.txt instead of running gem5, to time or test the RL loop itself (standin_backend.py)
+backend = SyntheticBackend() if use_standin else None
+output_root = '/home/guochu/gem5/output/RL_routing_2_paper'  # Tables, figures, models etc. go in sub-directories of it (--output-root)
+sim_outdir = DEFAULT_OUTDIR  # Where gem5 (or the stand-in) writes each run (--sim-outdir)
+use_core_features = False  # Add each core's write-hit and read-miss time (parse_stats per-core breakdown) to the state
+use_replay = False  # Train the Q-network on minibatches of past transitions (replay_buffer.py), kept across runs
+replay_capacity = 10000  # Transitions kept in the replay memory
+replay_batch_size = 32
+replay_updates_per_step = 4  # Gradient steps on replayed minibatches per collected transition
+use_target_network = False  # Bootstrap from a lagged copy of the Q-network with Double-DQN targets
+target_sync_every = 100  # Copy the Q-network into the target network every this many updates; 0 for soft updates
+target_tau = 0.01  # Fraction of the Q-network blended into the target network per update when target_sync_every is 0
+q_table_capacity = 50000  # States kept in the Q-table (q_table.py); the least recently used one makes room
+q_table_resolution = 0.25  # Cell size of the discretized (normalized) state that keys the Q-table
+q_table_eviction = "lru"  # Which state a full Q-table drops: "lru" (least recently used) or "visits" (least visited)
+checkpoint_every = 1  # Save the whole agent every this many episodes (agent_checkpoint.py), for --resume; 0 for never
 
 epsilon = 1.0  # Exploration rate
 eps_min = 0.01
@@ -41,25 +76,26 @@ CPU_delay_history = []
 cache_messages_history = []
 packet_delay_history = []
 rew_history = []  # Reward history
+histories = (time_history, latency_history, CPU_delay_history, cache_messages_history, packet_delay_history, rew_history)
 
 
 # Initialize the neural network
 num_cores = 4  # Example value; change based on your system
-input_size = 8  # Example; adjust based on the number of states in your RL
+input_size = 8 + (2 * num_cores if use_core_features else 0)  # Example; adjust based on the number of states in your RL
 output_dim = a_size  # Number of possible actions
+Q = QTable(a_size, input_size, q_table_capacity, q_table_resolution, q_table_eviction)  # Q-Table (will be replaced by the Q-network)
 q_network = QNetwork(input_size, output_dim)  # Instantiate the Q-network
 optimizer = optim.Adam(q_network.parameters(), lr=0.001)
-criterion = nn.MSELoss()  # Define the loss function
+target_network = copy.deepcopy(q_network).requires_grad_(False) if use_target_network else None
+q_updates = 0  # Gradient steps of the Q-network so far
 
 model = WeightPredictor(input_size, num_cores)
 optimizer2 = optim.Adam(model.parameters(), lr=0.001)
-#criterion = nn.MSELoss()  # Define the loss function if needed for training
+weight_dim = max(layer.out_features for name, layer in model.named_children() if name.startswith("fc3_"))  # most link weights of a topology
+replay = ReplayBuffer(replay_capacity, input_size, weight_dim) if use_replay else None
 
 '''preprocess data and normalize'''
-# Initialize global running statistics
-running_means = None
-running_stds = None
-count = 0
+normalizer = RunningNormalizer(input_size)  # Running mean and variance of the states
 
 # Function to update Q-values (Not used directly with the Q-network)
 def update_Q(Qsa, Qsa_next, reward, alpha=0.01, gamma=1.0):
@@ -98,72 +134,40 @@ def reward_f(d):
              round(scale_cache_level, 2) )  # Minimize latency
 
 # Preprocessing and normalization functions
-def update_running_stats(state_tensor):
-    global running_means, running_stds, count
-
-    if running_means is None or running_stds is None:
-        running_means = state_tensor.clone()
-        running_stds = torch.zeros_like(state_tensor)
-        count = 1
-    else:
-        count += 1
-        new_means = running_means + (state_tensor - running_means) / count
-        running_stds = running_stds + (state_tensor - running_means) * (state_tensor - new_means)
-        running_means = new_means
-
-def log_transform(value):
-    value_tensor = torch.tensor(value, dtype=torch.float32)
-    return torch.log(value_tensor + 1e-5)  # Adding a small constant to avoid log(0)
+LOG_FEATURES = ['packets_injected', 'packets_received', 'total_cache_level_messages',
+                'total_average_write_hit_time', 'total_average_readmiss_time']
+
+def state_features(dicts):
+    """The raw state vector of the stats `dicts` (float64, before normalization)."""
+    raw = [dicts['average_packet_delay'], dicts['average_packet_latency'], dicts['average_link_utilization']]
+    logged = [dicts[key] for key in LOG_FEATURES]
+    if use_core_features:
+        # Results cached before the per-core breakdown existed have none
+        no_cores = [0.0] * num_cores
+        logged += list(dicts.get('core_average_write_hit_time', no_cores))
+        logged += list(dicts.get('core_average_readmiss_time', no_cores))
+    # Adding a small constant to avoid log(0)
+    return np.concatenate((np.asarray(raw, dtype=np.float64), np.log(np.asarray(logged, dtype=np.float64) + 1e-5)))
+
+def preprocess_states(features):
+    """Fold one state_features vector or an (N, d) batch of them into the normalizer and return them normalized."""
+    normalizer.update(features)
+    return torch.from_numpy(normalizer.normalize(features).astype(np.float32))
 
 def preprocess_state(dicts):
-    global running_means, running_stds, count
-
-    state_values = [
-        torch.tensor(dicts['average_packet_delay'], dtype=torch.float32),
-
-        torch.tensor(dicts['average_packet_latency'], dtype=torch.float32),
-
-        torch.tensor(dicts['average_link_utilization'], dtype=torch.float32),
-        log_transform(dicts['packets_injected']),
-        log_transform(dicts['packets_received']),
-        log_transform(dicts['total_cache_level_messages']),
-        log_transform(dicts['total_average_write_hit_time']),
-        log_transform(dicts['total_average_readmiss_time'])
-    ]
-    
-    state_tensor = torch.stack(state_values)
-    update_running_stats(state_tensor)
-    
-    if count > 1:
-        normalized_state_tensor = (state_tensor - running_means) / (torch.sqrt(running_stds / (count - 1)) + 1e-5)
-    else:
-        normalized_state_tensor = state_tensor
+    return preprocess_states(state_features(dicts))
 
-    return normalized_state_tensor
+# A fresh early-stopping monitor per gem5 run, or None when early stopping is off
+def new_monitor():
+    if not use_early_stopping:
+        return None
+    return ConvergenceMonitor(reward_f, incumbent=best_reward)
 
 def save_stats_to_csv(all_stats, total_episodes):
-    # Define the columns to be saved in the CSV
-    csv_columns = [
-        'average_packet_delay', 
-        'average_packet_network_latency', 
-        'average_packet_latency', 
-        'average_packet_queueing_latency', 
-        'average_flit_network_latency', 
-        'average_flit_latency', 
-        'average_flit_queueing_latency', 
-        'average_link_utilization', 
-        'packets_injected', 
-        'packets_received', 
-        'flits_injected', 
-        'flits_received', 
-        'external_link_utilization', 
-        'internal_link_utilization', 
-        'total_cache_level_messages', 
-        'total_average_write_hit_time', 
-        'total_average_readmiss_time'
-    ]
+    # The columns are the scalar parse_stats keys, as declared in stats_schema.py
+    csv_columns = metric_keys()
     
-    csv_file = f'/home/guochu/gem5/output/RL_routing_2_paper/Tables/4_ferret_mem_768MB_{total_episodes}.csv'
+    csv_file = os.path.join(table_save_dir, f'4_ferret_mem_768MB_{total_episodes}.csv')
     
     try:
         with open(csv_file, 'w', newline='') as csvfile:
@@ -187,7 +191,7 @@ def plot_and_save_statistics(latency_history, CPU_delay_history, cache_level_mes
     plt.ylabel('Latency')
     plt.title('Average Packet Latency')
     plt.legend()
-    plt.savefig(f'/home/guochu/gem5/output/RL_routing_2_paper/Figures/4_ferret_mem_768MB_{total_episodes}_latency.png', bbox_inches='tight')
+    plt.savefig(os.path.join(figure_dir, f'4_ferret_mem_768MB_{total_episodes}_latency.png'), bbox_inches='tight')
     plt.close()
     
     plt.figure(figsize=(8, 6))
@@ -196,7 +200,7 @@ def plot_and_save_statistics(latency_history, CPU_delay_history, cache_level_mes
     plt.ylabel('CPU delay')
     plt.title('Average CPU delay')
     plt.legend()
-    plt.savefig(f'/home/guochu/gem5/output/RL_routing_2_paper/Figures/4_ferret_mem_768MB_{total_episodes}_CPU_delay.png', bbox_inches='tight')
+    plt.savefig(os.path.join(figure_dir, f'4_ferret_mem_768MB_{total_episodes}_CPU_delay.png'), bbox_inches='tight')
     plt.close()
     
     plt.figure(figsize=(8, 6))
@@ -205,7 +209,7 @@ def plot_and_save_statistics(latency_history, CPU_delay_history, cache_level_mes
     plt.ylabel('Cache Level Messages')
     plt.title('Total Cache Level Messages')
     plt.legend()
-    plt.savefig(f'/home/guochu/gem5/output/RL_routing_2_paper/Figures/4_ferret_mem_768MB_{total_episodes}_cache_level_messages.png', bbox_inches='tight')
+    plt.savefig(os.path.join(figure_dir, f'4_ferret_mem_768MB_{total_episodes}_cache_level_messages.png'), bbox_inches='tight')
     plt.close()
 
     plt.figure(figsize=(8, 6))
@@ -214,216 +218,506 @@ def plot_and_save_statistics(latency_history, CPU_delay_history, cache_level_mes
     plt.ylabel('Average packet delay')
     plt.title('Average Packet Delay')
     plt.legend()
-    plt.savefig(f'/home/guochu/gem5/output/RL_routing_2_paper/Figures/4_ferret_mem_768MB_{total_episodes}_average_network_delay.png', bbox_inches='tight')
+    plt.savefig(os.path.join(figure_dir, f'4_ferret_mem_768MB_{total_episodes}_average_network_delay.png'), bbox_inches='tight')
     plt.close()
 
 
-# Function to simulate RL
-def simulate_rl(initial_dicts, total_episodes=3):
+# Pick topologies with the epsilon-greedy policy and predict their link weights
+def select_actions(q_state, i_episode, n=1):
+    # Step 1: Predict Q-values using the Q-network
+    q_values = q_network(q_state.unsqueeze(0))  # No .detach() here
+
+    # Step 2: Select actions using epsilon-greedy policy
+    policy_s = epsilon_greedy_probs(q_values.detach().numpy().flatten(), i_episode)
+    action_indices = np.random.choice(np.arange(a_size), size=n, p=abs(policy_s))
+
+    # Step 3: Predict the weights using the WeightPredictor
+    choices = []
+    for action_index in action_indices:
+        action_index = int(action_index)
+        action_tensor = torch.tensor([action_index], dtype=torch.float32)
+        predicted_weights = model(q_state.unsqueeze(0), action_tensor)  # No .detach() here
+        #weights_str = ','.join(map(str, predicted_weights.detach().numpy().flatten()))
+        weights_str = ','.join(map(str, predicted_weights.detach().flatten().tolist()))
+        choices.append((action_index, predicted_weights, weights_str))
+    return choices
+
+# Pick one topology per sub-environment state, with one Q-network forward pass for the batch
+def select_actions_batch(states, i_episode):
+    q_values = q_network(states).detach().numpy()
+    choices = []
+    for state, q_row in zip(states, q_values):
+        policy_s = epsilon_greedy_probs(q_row, i_episode)
+        action_index = int(np.random.choice(np.arange(a_size), p=abs(policy_s)))
+        action_tensor = torch.tensor([action_index], dtype=torch.float32)
+        predicted_weights = model(state.unsqueeze(0), action_tensor)
+        weights_str = ','.join(map(str, predicted_weights.detach().flatten().tolist()))
+        choices.append((action_index, predicted_weights, weights_str))
+    return choices
+
+# Learn from one (state, action, weights) -> (reward, next state) transition;
+# `dicts` are the simulated stats behind it
+def learn_from_step(q_state, action_index, predicted_weights, reward, next_sim_state, dicts):
+    global best_reward
+
+    original_weights =  torch.tensor(predicted_weights, dtype=torch.float32, requires_grad=True)
+    if best_reward is None or reward > best_reward:
+        best_reward = reward
+    # Runs cut short by the monitor give a noisier reward, so learn less from them
+    step_weight = early_stop_weight if dicts.get("early_stop") else 1.0
+
+    # Step 6: Update the Q-value for the state-action pair
+    if replay is not None:
+        replay.add(q_state, action_index, predicted_weights, reward, next_sim_state, step_weight)
+        for _ in range(replay_updates_per_step):
+            replay_update(replay.sample(min(replay_batch_size, len(replay))))
+    else:
+        q_update(q_state.unsqueeze(0), torch.tensor([action_index]), torch.tensor([reward], dtype=torch.float32),
+                 next_sim_state.unsqueeze(0), torch.tensor([step_weight], dtype=torch.float32))
+    
+                
+    # Update the Q-table using the `update_Q` function
+    next_q_max = np.max(Q.get(next_sim_state))  # looked up first: Q[q_state] may evict its row
+    q_row = Q[q_state]
+    q_row[action_index] = update_Q(
+        q_row[action_index],
+        next_q_max,
+        reward,
+        .01 * step_weight,  # Learning rate (alpha)
+        0.80  # Discount factor (gamma)
+    )
+
+    # Train the WeightPredictor model
+    optimizer2.zero_grad()
+    loss_weight_predictor = -step_weight * reward * original_weights.mean()  # Ensure predicted_weights is a floating-point tensor
+    loss_weight_predictor.backward()
+    optimizer2.step()
+
+# One gradient step of the Q-network on a batch of transitions. The current and
+# next states go through the Q-network in one forward pass; with the target
+# network, a next state is worth the target network's value of the Q-network's
+# best action there (Double DQN), otherwise the Q-network's own maximum.
+def q_update(states, action_indices, rewards, next_states, step_weights):
+    global q_updates
+
+    n = len(states)
+    q_values = q_network(torch.cat((states, next_states)))
+    current_q_values = q_values[:n].gather(1, action_indices.unsqueeze(1)).squeeze(1)
+    with torch.no_grad():
+        next_q_values = q_values[n:].detach()
+        if target_network is not None:
+            best_actions = next_q_values.argmax(1, keepdim=True)
+            next_q_values = target_network(next_states).gather(1, best_actions).squeeze(1)
+        else:
+            next_q_values = next_q_values.max(1)[0]
+        targets = rewards + 0.99 * next_q_values  # Discount factor gamma=0.99
+
+    optimizer.zero_grad()
+    loss_q_network = (step_weights * (current_q_values - targets) ** 2).mean()
+    loss_q_network.backward()
+    optimizer.step()
+    q_updates += 1
+    sync_target_network()
+
+# Let the target network follow the Q-network: a full copy every target_sync_every
+# updates, or a soft update by target_tau after every update
+def sync_target_network():
+    if target_network is None:
+        return
+    if target_sync_every > 0:
+        if q_updates % target_sync_every == 0:
+            target_network.load_state_dict(q_network.state_dict())
+        return
+    with torch.no_grad():
+        for target_param, param in zip(target_network.parameters(), q_network.parameters()):
+            target_param.lerp_(param, target_tau)
+
+# One gradient step of the Q-network on a minibatch of replayed transitions
+def replay_update(batch):
+    q_update(torch.from_numpy(batch["states"]), torch.from_numpy(batch["actions"]),
+             torch.from_numpy(batch["rewards"]), torch.from_numpy(batch["next_states"]),
+             torch.from_numpy(batch["step_weights"]))
+
+# Observe the stats of a finished run outside an environment (simulate_rl_async) and learn from it
+def learn_from_run(q_state, action_index, predicted_weights, dicts):
+    reward = reward_f(dicts)
+    next_sim_state = preprocess_state(dicts)  # Step 5: Observe the next state
+    learn_from_step(q_state, action_index, predicted_weights, reward, next_sim_state, dicts)
+    return reward, next_sim_state
+
+# Book-keeping at the end of every episode
+def record_episode(rewardsum, dicts, all_stats, total_episodes):
     global epsilon
 
-    # Initialize the state with initial dicts
-    sim_state = preprocess_state(initial_dicts)
-    all_stats = []  # List to collect statistics for each episode
+    rew_history.append(rewardsum)
+    all_stats.append(dicts)  # Collect the statistics for this episode
     
-    for i_episode in range(1, total_episodes + 1):
-        rewardsum = 0
+        # Save the collected statistics to a CSV file after all episodes
+    save_stats_to_csv(all_stats, total_episodes)
+
+
+    # Record metrics from dicts
+    latency_history.append(dicts['average_packet_latency'])
+    CPU_delay_history.append(dicts['total_average_write_hit_time'])
+    cache_messages_history.append(dicts['total_cache_level_messages'])
+    packet_delay_history.append(dicts['average_packet_delay'])
+
+    if epsilon > eps_min:
+        epsilon *= eps_decay
+
+    # Every transition cost a gem5 run: keep them for the next training run
+    if replay is not None:
+        replay.save(replay_path)
+    normalizer.save(normalizer_path)
+
+# Everything the agent has learned and the run's book-keeping, for save_checkpoint
+def agent_state():
+    return {
+        "q_network": q_network.state_dict(),
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "optimizer2": optimizer2.state_dict(),
+        "target_network": None if target_network is None else target_network.state_dict(),
+        "q_updates": q_updates,
+        "normalizer": normalizer,
+        "Q": Q,
+        "replay": replay,
+        "epsilon": epsilon,
+        "best_reward": best_reward,
+        "histories": [list(history) for history in histories],
+        "rng": rng_state(),
+    }
+
+# Put the agent back as agent_state found it
+def restore_agent(state):
+    global q_updates, normalizer, Q, replay, epsilon, best_reward
+
+    q_network.load_state_dict(state["q_network"])
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    optimizer2.load_state_dict(state["optimizer2"])
+    if target_network is not None:
+        target_network.load_state_dict(state["target_network"] or state["q_network"])
+    q_updates = state["q_updates"]
+    normalizer = state["normalizer"]
+    Q = state["Q"]
+    if replay is not None and state["replay"] is not None:
+        replay = state["replay"]
+    epsilon = state["epsilon"]
+    best_reward = state["best_reward"]
+    for history, saved in zip(histories, state["histories"]):
+        history[:] = saved
+    set_rng_state(state["rng"])
+
+# Checkpoint the agent after `episode` (every checkpoint_every episodes and after the last one);
+# `cursor` is where the environment stands, as ICNVecEnv.cursor gives it
+def write_checkpoint(episode, total_episodes, all_stats, action_index, cursor):
+    if not checkpoint_every or (episode % checkpoint_every and episode != total_episodes):
+        return
+    state = agent_state()
+    state.update(episode=episode, all_stats=all_stats, action_index=action_index, cursor=cursor,
+                 elapsed=time.time() - start_time)
+    save_checkpoint(checkpoint_path, state)
+    print(f"? Checkpoint of episode {episode} written to {checkpoint_path}")
+
+# Save the trained Q-network and WeightPredictor on their own, for use outside training
+def save_final_models():
+    save_checkpoint(os.path.join(model_save_dir, 'final_q_network_4_ferret_mem_768MB.pth'), q_network.state_dict())
+    save_checkpoint(os.path.join(model_save_dir, 'weight_predictor_4_ferret_mem_768MB.pth'), model.state_dict())
 
-        for _ in range(3):  # Simulate multiple steps per episode
-            q_state = sim_state
-
-            # Step 1: Predict Q-values using the Q-network
-            q_values = q_network(q_state.unsqueeze(0))  # No .detach() here
-
-            # Step 2: Select an action using epsilon-greedy policy
-            policy_s = epsilon_greedy_probs(q_values.detach().numpy().flatten(), i_episode)
-            action_index = np.random.choice(np.arange(a_size), p=abs(policy_s))
-            action = actions[action_index]
-
-            # Step 3: Predict the weights using the WeightPredictor
-            action_tensor = torch.tensor([action_index], dtype=torch.float32)
-            predicted_weights = model(q_state.unsqueeze(0), action_tensor)  # No .detach() here
-            
-            original_weights =  torch.tensor(predicted_weights, dtype=torch.float32, requires_grad=True)
-
-            #weights_str = ','.join(map(str, predicted_weights.detach().numpy().flatten()))
-            weights_str = ','.join(map(str, predicted_weights.detach().flatten().tolist()))
-
-            # Step 4: Simulate the environment with the selected action and observe the next state and reward
-            dicts = ICN_env(actions[action_index], weights_str)
-            reward = reward_f(dicts)
-            rewardsum += reward
-
-            # Step 5: Observe the next state
-            next_sim_state = preprocess_state(dicts)
-
-            # Step 6: Update the Q-value for the state-action pair
-            next_q_values = q_network(next_sim_state.unsqueeze(0)).max(1)[0].item()  # No .detach() here
-            target = reward + 0.99 * next_q_values  # Discount factor gamma=0.99
-
-            optimizer.zero_grad()
-            current_q_value = q_network(q_state.unsqueeze(0))[0, action_index]
-            loss_q_network = criterion(current_q_value, torch.tensor([target], dtype=torch.float32))
-            loss_q_network.backward()
-            optimizer.step()
-            
-                        
-            # Update the Q-table using the `update_Q` function
-            Q[q_state][action_index] = update_Q(
-                Q[q_state][action_index],
-                np.max(Q[next_sim_state]),
-                reward,
-                .01,  # Learning rate (alpha)
-                0.80  # Discount factor (gamma)
-            )
-
-            # Train the WeightPredictor model
-            optimizer2.zero_grad()
-            loss_weight_predictor = -reward * original_weights.mean()  # Ensure predicted_weights is a floating-point tensor
-            loss_weight_predictor.backward()
-            optimizer2.step()
-
-            sim_state = next_sim_state
+# Function to simulate RL
+# The environment steps num_parallel sub-environments at once (gym_env.py),
+# each following its own trajectory; the agent learns from every finished run
+# and the best run of the last step is recorded for the episode.
+# `resume` is a checkpoint to continue from, after its last episode.
+def simulate_rl(initial_dicts, total_episodes=3, num_parallel=1, resume=None):
+    env = make_env(actions, state_features, preprocess_states, reward_f, num_envs=num_parallel, base_outdir=sim_outdir,
+                   checkpoints=checkpoints, results=results, monitor_factory=new_monitor, scheduler=scheduler, backend=backend)
+    if resume is None:
+        states = env.reset(initial_dicts)
+        all_stats = []  # List to collect statistics for each episode
+        first_episode, action_index = 1, 0
+    else:
+        states = env.restore(resume["cursor"])
+        all_stats = resume["all_stats"]
+        first_episode, action_index = resume["episode"] + 1, resume["action_index"]
+    start_time = time.time()
+    
+    for i_episode in range(first_episode, total_episodes + 1):
+        rewardsum = 0
+        dicts = None  # stats of the episode's best run, if any run succeeded
+        dones = np.zeros(env.num_envs, dtype=bool)
+
+        while not dones.all():  # Simulate multiple steps per episode
+            choices = select_actions_batch(states, i_episode)
+
+            # Step 4: Simulate the environments with the selected actions and observe the next states and rewards
+            next_states, rewards, dones, infos = env.step([(a, w) for a, _, w in choices])
+            for i, ((a, predicted_weights, _), info) in enumerate(zip(choices, infos)):
+                if "error" in info:
+                    continue
+                learn_from_step(states[i], a, predicted_weights, rewards[i], next_states[i], info["dicts"])
+            states = next_states
+
+            if np.isnan(rewards).all():
+                continue
+            rewardsum += float(np.nanmean(rewards))
+            best = int(np.nanargmax(rewards))
+            action_index, dicts = choices[best][0], infos[best]["dicts"]
            
 
-        rew_history.append(rewardsum)
-        all_stats.append(dicts)  # Collect the statistics for this episode
-        
-            # Save the collected statistics to a CSV file after all episodes
-        save_stats_to_csv(all_stats, total_episodes)
+        if dicts is None:
+            print(f"?? Every run of episode {i_episode} failed; nothing to record")
+            continue
+        record_episode(rewardsum, dicts, all_stats, total_episodes)
+        write_checkpoint(i_episode, total_episodes, all_stats, action_index, env.cursor())
 
+    total_time = time.time() - start_time
+    print(f"? {env.throughput.summary()}; agent {total_time - env.throughput.seconds:.1f} s")
+    print(f"? {scheduler.summary()}")
 
-        # Record metrics from dicts
-        latency_history.append(dicts['average_packet_latency'])
-        CPU_delay_history.append(dicts['total_average_write_hit_time'])
-        cache_messages_history.append(dicts['total_cache_level_messages'])
-        packet_delay_history.append(dicts['average_packet_delay'])
+    final_action = actions[action_index]
+    write_final_action_to_file(final_action, os.path.join(final_action_dir, 'final_action_4_ferret_mem_768MB.txt'))
+    plot_and_save_statistics(latency_history, CPU_delay_history, cache_messages_history, packet_delay_history, total_episodes)
+    save_final_models()
+
+# Asyncio variant of simulate_rl: up to max_in_flight gem5 runs stay in flight
+# while finished ones are parsed (in a process pool) and learned from. All
+# torch work runs on one learner thread so the networks are never updated
+# concurrently and the event loop only schedules.
+# Runs in flight when a checkpoint is written are launched again on --resume.
+async def simulate_rl_async(initial_dicts, total_episodes=3, max_in_flight=4, resume=None):
+    loop = asyncio.get_running_loop()
+    pool = Gem5Pool(max_instances=max_in_flight, base_outdir=sim_outdir, checkpoints=checkpoints, results=results,
+                    monitor_factory=new_monitor, scheduler=scheduler, backend=backend)
+    all_stats = []  # List to collect statistics for each episode
+    total_steps = total_episodes * 3  # 3 steps per episode as in simulate_rl
 
-        if epsilon > eps_min:
-            epsilon *= eps_decay
+    with ThreadPoolExecutor(max_workers=1) as learner, ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as parser:
+        in_flight = {}  # task -> (q_state, action_index, predicted_weights)
+        rewardsum = 0
+        if resume is None:
+            sim_state = await loop.run_in_executor(learner, preprocess_state, initial_dicts)
+            launched = finished = 0
+            dicts = None
+            action_index = 0
+        else:
+            dicts, sim_state, _ = resume["cursor"][0]
+            all_stats = resume["all_stats"]
+            launched = finished = resume["episode"] * 3
+            action_index = resume["action_index"]
+
+        while finished < total_steps:
+            # Keep the simulators busy: launch from the newest state we have
+            while launched < total_steps and len(in_flight) < max_in_flight:
+                i_episode = launched // 3 + 1
+                q_state = sim_state
+                (choice,) = await loop.run_in_executor(learner, select_actions, q_state, i_episode)
+                a, predicted_weights, weights_str = choice
+                task = asyncio.create_task(pool.run_async(actions[a], weights_str, parser))
+                in_flight[task] = (q_state, a, predicted_weights)
+                launched += 1
+
+            done, _ = await asyncio.wait(set(in_flight), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                q_state, a, predicted_weights = in_flight.pop(task)
+                instance = task.result()
+                finished += 1
+                if instance.dicts is not None:
+                    reward, sim_state = await loop.run_in_executor(
+                        learner, learn_from_run, q_state, a, predicted_weights, instance.dicts)
+                    rewardsum += reward
+                    dicts = instance.dicts
+                    action_index = a
+                if finished % 3 == 0 and dicts is not None:
+                    record_episode(rewardsum, dicts, all_stats, total_episodes)
+                    write_checkpoint(finished // 3, total_episodes, all_stats, action_index, [(dicts, sim_state, 0)])
+                    rewardsum = 0
 
     final_action = actions[action_index]
     write_final_action_to_file(final_action, os.path.join(final_action_dir, 'final_action_4_ferret_mem_768MB.txt'))
     plot_and_save_statistics(latency_history, CPU_delay_history, cache_messages_history, packet_delay_history, total_episodes)
-    
+    save_final_models()
+
+
+
+
+
+# Main script to run the simulation. The parse workers of simulate_rl_async
+# import this file again (spawn), so training and everything that starts
+# threads or gem5 only happens when it is run as a script.
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Learn the topology and link weights of the ICN with gem5 in the loop")
+    arg_parser.add_argument("--resume", nargs="?", const="", metavar="CHECKPOINT",
+                            help="continue the training run saved in CHECKPOINT (default: the last checkpoint "
+                                 "under the output root)")
+    arg_parser.add_argument("--output-root", default=output_root,
+                            help=f"directory of the tables, figures, models and checkpoints (default {output_root})")
+    arg_parser.add_argument("--sim-outdir", default=sim_outdir,
+                            help=f"directory the simulations write into (default {sim_outdir})")
+    arg_parser.add_argument("--standin", action="store_true",
+                            help="synthesize stats.txt instead of running gem5 (standin_backend.py), as use_standin")
+    cli_args = arg_parser.parse_args()
+    output_root, sim_outdir = cli_args.output_root, cli_args.sim_outdir
+    if cli_args.standin and backend is None:
+        backend = SyntheticBackend()
+
+    # A stand-in neither boots nor restores anything, so it needs no checkpoint library
+    checkpoints = CheckpointLibrary() if use_checkpoints and backend is None else None
+    results = ResultCache(GEM5_BINARY, PROTOCOL_DIR) if use_result_cache else None
+    scheduler = Gem5Scheduler()  # Every gem5 run is queued here and started when cores and memory allow (gem5_scheduler.py)
+
+    table_save_dir = os.path.join(output_root, 'Tables')
+    os.makedirs(table_save_dir, exist_ok=True)
+
+    figure_dir = os.path.join(output_root, 'Figures')
+    os.makedirs(figure_dir, exist_ok=True)
+
+    final_action_dir = os.path.join(output_root, 'final_action')
+    os.makedirs(final_action_dir, exist_ok=True)
+
+    duration_dir = os.path.join(output_root, 'Duration')
+    os.makedirs(duration_dir, exist_ok=True)
+
+    q_table_dir = os.path.join(output_root, 'Q_Table')
+    os.makedirs(q_table_dir, exist_ok=True)
+
+    q_table_path = os.path.join(q_table_dir, 'q_table_4_ferret_mem_768MB.bin')
+    if os.path.exists(q_table_path):
+        restored = QTable.load(q_table_path, q_table_capacity)
+        # A table saved with another state layout (e.g. use_core_features toggled) does not fit
+        if (restored.state_dim, restored.num_actions) == (input_size, a_size):
+            Q = restored
+            print(f"? Restored {len(Q)} Q-table states from {q_table_path}")
+        else:
+            print(f"?? Ignoring the Q-table in {q_table_path}: it has {restored.state_dim} state values and "
+                  f"{restored.num_actions} actions, not {input_size} and {a_size}")
+
+    reward_history_dir = os.path.join(output_root, 'reward')
+    os.makedirs(reward_history_dir, exist_ok=True)
+
+    model_save_dir = os.path.join(output_root, 'model')
+    os.makedirs(model_save_dir, exist_ok=True)
+
+    replay_path = os.path.join(model_save_dir, 'replay_4_ferret_mem_768MB.npz')
+    if replay is not None and os.path.exists(replay_path):
+        restored = ReplayBuffer.load(replay_path, replay_capacity)
+        if (restored.states.shape[1], restored.weights.shape[1]) == (input_size, weight_dim):
+            replay = restored
+            print(f"? Restored {len(replay)} transitions from {replay_path}")
+        else:
+            print(f"?? Ignoring the replay memory in {replay_path}: its states have {restored.states.shape[1]} "
+                  f"values and its weights {restored.weights.shape[1]}, not {input_size} and {weight_dim}")
+
+    # Resumed runs keep normalizing states as the runs before them did
+    normalizer_path = os.path.join(model_save_dir, 'state_normalizer_4_ferret_mem_768MB.npz')
+    if os.path.exists(normalizer_path):
+        restored = RunningNormalizer.load(normalizer_path)
+        if restored.state_dim == input_size:
+            normalizer = restored
+            print(f"? Restored state normalization over {normalizer.count} states from {normalizer_path}")
+
+    checkpoint_path = os.path.join(model_save_dir, 'agent_4_ferret_mem_768MB.ckpt')
+    resume = None
+    if cli_args.resume is not None:
+        resume_path = cli_args.resume or checkpoint_path
+        resume = load_checkpoint(resume_path)
+        restore_agent(resume)
+        print(f"? Resuming after episode {resume['episode']} from {resume_path}")
+
+    # The time of the runs before a resume counts towards the total duration
+    start_time = time.time() - (resume["elapsed"] if resume else 0.0)
+    # A resumed run starts from the environment state in its checkpoint instead
+    initial_dicts = None if resume else ICN_env(action=actions[0], weights='2,1,2,2', outdir=sim_outdir,
+                                                    scheduler=scheduler, backend=backend)
+
     """
-    # Save the final Q-network model
-    model_save_path = os.path.join(model_save_dir, 'final_q_network_16_vips.pth')
-    torch.save(q_network.state_dict(), model_save_path)
-    
-    # Save Q-network and history
-    model_save_path = os.path.join(model_save_dir, 'mix_weight_predictor_model_64_ferret.pth')
-    torch.save(model.state_dict(), model_save_path)
+    def read_dicts_from_file(file_path):
+        dicts = {}
+        with open(file_path, 'r') as f:
+            for line in f:
+                key, value = line.strip().split(':')
+                dicts[key] = float(value)  # Convert value to float, assuming all values are numeric
+        return dicts
+
+    file_path = "/data/guochu/gem5/2paper/16c_routing/vips/network_stats.txt"
+
+    # Extract initial_dicts from the file
+    initial_dicts = read_dicts_from_file(file_path)
     """
+    if use_async:
+        asyncio.run(simulate_rl_async(initial_dicts=initial_dicts, total_episodes=3, max_in_flight=num_parallel,
+                                      resume=resume))
+    else:
+        simulate_rl(initial_dicts=initial_dicts, total_episodes=3, num_parallel=num_parallel, resume=resume)  ##change 45 to 2
 
+    end_time = time.time()
+    total_duration = end_time - start_time
 
+    duration_file_path = os.path.join(duration_dir, '4_ferret_time_mem_768MB.txt')
+    with open(duration_file_path, 'w') as duration_file:
+        duration_file.write(f"Total learning process duration: {total_duration:.2f} seconds")
 
 
-# Main script to run the simulation
-table_save_dir = '/home/guochu/gem5/output/RL_routing_2_paper/Tables/'
-os.makedirs(table_save_dir, exist_ok=True)
-
-
-final_action_dir = '/home/guochu/gem5/output/RL_routing_2_paper/final_action/'
-os.makedirs(final_action_dir, exist_ok=True)
-
-duration_dir = '/home/guochu/gem5/output/RL_routing_2_paper/Duration/'
-os.makedirs(duration_dir, exist_ok=True)
-
-q_table_dir = '/home/guochu/gem5/output/RL_routing_2_paper/Q_Table/'
-os.makedirs(q_table_dir, exist_ok=True)
-
-reward_history_dir = '/home/guochu/gem5/output/RL_routing_2_paper/reward/'
-os.makedirs(reward_history_dir, exist_ok=True)
-
-model_save_dir = '/home/guochu/gem5/output/RL_routing_2_paper/model/'
-os.makedirs(model_save_dir, exist_ok=True)
-
-start_time = time.time()
-initial_dicts = ICN_env(action=actions[0], weights='2,1,2,2')
 
-"""
-def read_dicts_from_file(file_path):
-    dicts = {}
-    with open(file_path, 'r') as f:
-        for line in f:
-            key, value = line.strip().split(':')
-            dicts[key] = float(value)  # Convert value to float, assuming all values are numeric
-    return dicts
-    
-file_path = "/data/guochu/gem5/2paper/16c_routing/vips/network_stats.txt"
+    def write_q_table_to_file(Q, filename=os.path.join(q_table_dir, 'q_table_4_ferret_mem_768MB.txt')):
+        with open(filename, 'w') as file:
+            file.write('Q-Table:\n')
+            for state, actions in Q.items():
+                if isinstance(actions, (list, np.ndarray)):
+                    file.write(f"State {state}: {' '.join(map(str, actions))}\n")
+                else:
+                    file.write(f"State {state}: {actions}\n")
 
-# Extract initial_dicts from the file
-initial_dicts = read_dicts_from_file(file_path)
-"""
-simulate_rl(initial_dicts=initial_dicts, total_episodes=3)  ##change 45 to 2
+    def write_reward_history_to_file(rew_history, filename=os.path.join(reward_history_dir, 'reward_history_4_ferret_mem_768MB.txt')):
+        with open(filename, 'w') as file:
+            file.write('Reward History:\n')
+            for reward in rew_history:
+                file.write(str(reward) + '\n')
 
-end_time = time.time()
-total_duration = end_time - start_time
+    total_episodes = 3
 
-duration_file_path = os.path.join(duration_dir, '4_ferret_time_mem_768MB.txt')
-with open(duration_file_path, 'w') as duration_file:
-    duration_file.write(f"Total learning process duration: {total_duration:.2f} seconds")
+    write_q_table_to_file(Q)
+    Q.save(q_table_path)
+    write_reward_history_to_file(rew_history)
 
+    # Plot and save reward history
+    fig, ax = plt.subplots(figsize=(10, 4))
+    plt.title('Reward Learning')
+    plt.plot(range(len(rew_history)), rew_history, label='Reward', marker="", linestyle="-")
+    plt.xlabel('Training Episodes')
+    plt.ylabel('Reward')
+    plt.savefig(os.path.join(figure_dir, f'4_ferret_mem_768MB_{total_episodes}_ICN.png'), bbox_inches='tight')
 
+    '''
+    # Save collected stats to CSV
+    csv_columns = [
+        'average_network_delay', 
+        'average_packet_network_latency', 
+        'average_packet_latency', 
+        'average_packet_queueing_latency', 
+        'average_flit_network_latency', 
+        'average_flit_latency', 
+        'average_flit_queueing_latency', 
+        'average_link_utilization', 
+        'packets_injected', 
+        'packets_received', 
+        'flits_injected', 
+        'flits_received', 
+        'external_link_utilization', 
+        'internal_link_utilization', 
+        'total_cache_level_messages', 
+        'total_average_write_hit_time', 
+        'total_average_readmiss_time'
+    ]
+    csv_file = f'/home/guochu/gem5/output/RL_routing/Tables/mix_QL_vips_{total_episodes}.csv'
 
-def write_q_table_to_file(Q, filename=os.path.join(q_table_dir, 'q_table_4_ferret_mem_768MB.txt')):
-    with open(filename, 'w') as file:
-        file.write('Q-Table:\n')
-        for state, actions in Q.items():
-            if isinstance(actions, (list, np.ndarray)):
-                file.write(f"State {state}: {' '.join(map(str, actions))}\n")
-            else:
-                file.write(f"State {state}: {actions}\n")
-
-def write_reward_history_to_file(rew_history, filename=os.path.join(reward_history_dir, 'reward_history_4_ferret_mem_768MB.txt')):
-    with open(filename, 'w') as file:
-        file.write('Reward History:\n')
-        for reward in rew_history:
-            file.write(str(reward) + '\n')
-            
-total_episodes = 3
-
-write_q_table_to_file(Q)
-write_reward_history_to_file(rew_history)
-
-# Plot and save reward history
-fig, ax = plt.subplots(figsize=(10, 4))
-plt.title('Reward Learning')
-plt.plot(range(len(rew_history)), rew_history, label='Reward', marker="", linestyle="-")
-plt.xlabel('Training Episodes')
-plt.ylabel('Reward')
-plt.savefig(f'/home/guochu/gem5/output/RL_routing_2_paper/Figures/4_ferret_mem_768MB_{total_episodes}_ICN.png', bbox_inches='tight')
-
-'''
-# Save collected stats to CSV
-csv_columns = [
-    'average_network_delay', 
-    'average_packet_network_latency', 
-    'average_packet_latency', 
-    'average_packet_queueing_latency', 
-    'average_flit_network_latency', 
-    'average_flit_latency', 
-    'average_flit_queueing_latency', 
-    'average_link_utilization', 
-    'packets_injected', 
-    'packets_received', 
-    'flits_injected', 
-    'flits_received', 
-    'external_link_utilization', 
-    'internal_link_utilization', 
-    'total_cache_level_messages', 
-    'total_average_write_hit_time', 
-    'total_average_readmiss_time'
-]
-csv_file = f'/home/guochu/gem5/output/RL_routing/Tables/mix_QL_vips_{total_episodes}.csv'
-
-try:
-    with open(csv_file, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(csv_columns)
-        for i in range(len(dicts['average_network_delay'])):
-            writer.writerow([dicts[key][i] for key, value in dicts.items()])
-except IOError:
-    print("I/O error")
-  '''  
+    try:
+        with open(csv_file, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(csv_columns)
+            for i in range(len(dicts['average_network_delay'])):
+                writer.writerow([dicts[key][i] for key, value in dicts.items()])
+    except IOError:
+        print("I/O error")
+      '''  
@@ -1,238 +1,767 @@
+import argparse
+import bisect
+import csv
+import glob
+import gzip
+import mmap
 import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from stats_schema import (INDEX, LAST, MEAN, METRICS, SAMPLE_WEIGHTED, SCHEMA, SERIES_METRICS, SERIES_SCHEMA,
+                          counter_keys, metric_keys)
+
 
 def parse_stats(file_path, num_cores):
-    # Initialize variables to accumulate sums and count the number of dumps
-    sums = {
-        "packets_injected": 0.0,
-        "packets_received": 0.0,
-        "flits_injected": 0.0,
-        "flits_received": 0.0,
-        "external_link_utilization": 0.0,
-        "internal_link_utilization": 0.0,
-        "total_cache_level_messages": 0.0,
-        "total_NoCWriteHitDuration": 0.0,
-        "total_NoCReadMissDuration": 0.0,
-        "cache_level_messages" : 0,
-        "average_packet_delay":0.0,
-        "vnet_0_delay": 0.0,
-        "vnet_0_samples": 0,
-        "vnet_0_total_delay": 0.0,
-        "vnet_1_delay": 0.0,
-        "vnet_1_samples": 0,
-        "vnet_1_total_delay": 0.0,
-        "vnet_2_delay": 0.0,
-        "vnet_2_samples": 0,
-        "vnet_2_total_delay": 0.0
-        #"total_energy": 0.0,
-        #"total_power": 0.0
-        #"total_writehit_counter":0,
-        #"total_readmiss_counter":0
-        #"network_delay":0.0
-        
-    }
-    latencies = {
-        "average_packet_queueing_latency": 0.0,
-        "average_packet_network_latency": 0.0,
-        "average_packet_latency": 0.0,
-        "average_flit_queueing_latency": 0.0,
-        "average_flit_network_latency": 0.0,
-        "average_flit_latency": 0.0,
-        "average_hops": 0.0,
-        "average_link_utilization": 0.0,
-        "average_network_delay":0.0
-    }
-    
-    
-    dump_count = 0  # To track the number of dumps
-
-    total_writehit_counter = 0
-    total_readmiss_counter = 0
-
-    # Temporary variables to hold the counters
-    writehit_counters = {}
-    readmiss_counters = {}
-
-
-    
+    """Averages of the stats that reward_f and preprocess_state use.
+
+    `file_path` is a text stats.txt (possibly compressed, see
+    read_stats_lines), or an HDF5 stats file (a ".h5" path or
+    an "h5://" URL as given to gem5's --stats-file) that is read with
+    parse_stats_h5 and falls back to the stats.txt next to it when h5py is
+    not installed.
+    """
+    if is_h5_stats(file_path):
+        h5_path = h5_stats_path(file_path)
+        if _h5py() is not None:
+            return parse_stats_h5(h5_path, num_cores)
+        file_path = os.path.join(os.path.dirname(h5_path), "stats.txt")
+        print(f"?? h5py is not installed, parsing {file_path} instead")
+    return parse_stats_lines(read_stats_lines(file_path), num_cores)
+
+def parse_stats_lines(lines, num_cores):
+    """parse_stats on any iterable of stats.txt lines (e.g. a single dump block).
+
+    Every line is split once and its stat name looked up in the columns of
+    stats_schema.SCHEMA, or, for per-core stats, the controller index is
+    read from the name and the rest looked up. Gives the same dict as the
+    original parser (parse_stats_lines_substring, now only kept in
+    bench_parse_stats.py) except that l1_cntrl1 no longer also
+    matches l1_cntrl10..19 (which made that version double count from 11
+    controllers on) and that the never-written average_network_delay is gone.
+    """
+    return _accumulate(lines, num_cores).result()
+
+
+def _rounded(value, digits):
+    if digits is None:
+        return value
+    return int(round(value)) if digits == 0 else round(value, digits)
+
+
+def _added(values):
+    """Sums over the dumps (axis 0), added one dump after the other as merging per-dump totals would."""
+    if len(values) == 0:
+        return np.zeros(values.shape[1:])
+    return np.cumsum(values, axis=0)[-1]
+
+
+class MetricTotals:
+    """Totals of every metric of a CompiledSchema over some dumps, in arrays that merge by addition.
+
+    `totals[key]` has one entry per instance of the metric (one per core for
+    per-core metrics), `weights[key]` the added sample counts of
+    SAMPLE_WEIGHTED metrics and `extra[key]` what the controllers at or
+    above num_cores added to `all_controllers` metrics. LAST totals stay NaN until a dump writes them.
+    """
+
+    def __init__(self, num_cores, schema=SCHEMA):
+        self.num_cores = num_cores
+        self.schema = schema
+        self.dump_count = 0
+        self.totals = {}
+        self.weights = {}
+        self.extra = {}
+        for key, plan in schema.plans.items():
+            metric = plan.metric
+            size = num_cores if metric.is_per_core else len(plan.value)
+            self.totals[key] = np.full(size, np.nan) if metric.aggregation == LAST else np.zeros(size)
+            if metric.aggregation == SAMPLE_WEIGHTED:
+                self.weights[key] = np.zeros(size)
+            self.extra[key] = 0.0
+
+    @classmethod
+    def from_dumps(cls, num_cores, schema, dump_count, values, core_values, extra):
+        """Totals of per-dump values, NaN where not written.
+
+        `values` is a (dumps, len(schema.columns)) array, `core_values` a
+        (dumps, len(schema.core_names), num_cores) one, and `extra` holds the
+        added values of the controllers at or above num_cores per core column.
+        """
+        totals = cls(num_cores, schema)
+        totals.dump_count = dump_count
+        for key, plan in schema.plans.items():
+            metric = plan.metric
+            table = core_values if metric.is_per_core else values
+            value = table[:, plan.value]
+            if plan.scale is not None:
+                value = value * table[:, plan.scale]
+            if plan.only_if is not None:
+                value = np.where(table[:, plan.only_if] > 0, value, np.nan)
+            if metric.aggregation == SAMPLE_WEIGHTED:
+                weight = table[:, plan.weight]
+                counted = (value > 0) & ~np.isnan(weight)
+                totals.totals[key] = _added(np.where(counted, value, 0.0))
+                totals.weights[key] = _added(np.where(counted, weight, 0.0))
+            elif metric.aggregation == LAST:
+                written = ~np.isnan(value)
+                if len(value):
+                    last = len(value) - 1 - np.argmax(written[::-1], axis=0)
+                    totals.totals[key] = np.where(written.any(axis=0), value[last, np.arange(value.shape[1])], np.nan)
+            else:
+                totals.totals[key] = _added(np.where(np.isnan(value), 0.0, value))
+                if metric.all_controllers:
+                    totals.extra[key] = float(extra[plan.value])
+        return totals
+
+    def merge(self, other):
+        """Add the totals of `other` (same schema and core count), which come after these."""
+        self.dump_count += other.dump_count
+        for key, total in other.totals.items():
+            if self.schema.plans[key].metric.aggregation == LAST:
+                np.copyto(self.totals[key], total, where=~np.isnan(total))
+            else:
+                self.totals[key] += total
+        for key, weight in other.weights.items():
+            self.weights[key] += weight
+        for key, extra in other.extra.items():
+            self.extra[key] += extra
+
+    def result(self):
+        """The parse_stats dict: every metric key in schema order, then the per-core lists."""
+        averages = {}
+        per_core = {}
+        for key, plan in self.schema.plans.items():
+            metric = plan.metric
+            total = self.totals[key]
+            if metric.aggregation == SAMPLE_WEIGHTED:
+                weight = self.weights[key]
+                values = np.divide(total, weight, out=np.zeros_like(total), where=weight > 0)
+                pooled_weight = float(weight.sum())
+                pooled = float(total.sum()) / pooled_weight if pooled_weight > 0 else None
+            elif metric.aggregation == LAST:
+                values = np.where(np.isnan(total), 0.0, total)
+                pooled = float(values.sum())
+            else:
+                values = total
+                pooled = float(total.sum()) + self.extra[key]
+                if metric.aggregation == MEAN:
+                    values = values / self.dump_count if self.dump_count > 0 else np.zeros_like(values)
+                    pooled = pooled / self.dump_count if self.dump_count > 0 else None
+            if INDEX in key:
+                for name, value in zip(metric.keys(), values):
+                    averages[name] = _rounded(float(value), metric.digits)
+            else:
+                averages[key] = 0 if pooled is None else _rounded(pooled, metric.digits)
+            if metric.per_core:
+                per_core[metric.per_core] = (values if metric.digits is None else np.round(values, metric.digits)).tolist()
+        averages.update(per_core)
+        return averages
+
+
+def _accumulate(lines, num_cores, schema=SCHEMA):
+    """MetricTotals of `lines`.
+
+    The values of each dump go into a row with a NaN (not written) per
+    schema column, and the per-core ones into a [column][core] row, so the
+    order of the lines within a dump does not matter; the rows are reduced
+    with NumPy at the end.
+    """
+    columns = schema.columns
+    core_columns = schema.core_columns
+    core_prefixes = tuple(core_columns)
+    width = len(columns)
+    core_width = len(schema.core_names)
+    rows = []
+    core_rows = []
+    row = None
+    core_row = None
+    extra = [0.0] * core_width
+    nan = float("nan")
+    dump_count = 0
+
+    for line in lines:
+        parts = line.split(None, 2)
+        if len(parts) < 2:
+            continue
+        name = parts[0]
+        column = columns.get(name)
+        if column is not None:
+            if row is None:
+                row = [nan] * width
+            row[column] = float(parts[1])
+        elif name.startswith(core_prefixes):
+            for prefix, rests in core_columns.items():
+                if not name.startswith(prefix):
+                    continue
+                dot = name.find(".", len(prefix))
+                column = rests.get(name[dot:]) if dot > 0 else None
+                index = name[len(prefix):dot]
+                if column is None or not index.isdigit():
+                    continue
+                core = int(index)
+                if core >= num_cores:
+                    extra[column] += float(parts[1])
+                    break
+                if core_row is None:
+                    core_row = [[nan] * num_cores for _ in range(core_width)]
+                core_row[column][core] = float(parts[1])
+                break
+        elif name[0] == "-" and "Begin Simulation Statistics" in line:
+            dump_count += 1
+            if row is not None:
+                rows.append(row)
+                row = None
+            if core_row is not None:
+                core_rows.append(core_row)
+                core_row = None
+
+    if row is not None:
+        rows.append(row)
+    if core_row is not None:
+        core_rows.append(core_row)
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), width)
+    core_values = np.array(core_rows, dtype=np.float64).reshape(len(core_rows), core_width, num_cores)
+    return MetricTotals.from_dumps(num_cores, schema, dump_count, values, core_values, extra)
+
+
+class DumpAggregate:
+    """parse_stats built up one dump (or one run of dumps) at a time.
+
+    `add` parses some stats.txt lines and folds them into the running
+    totals, so `result()` is always the dict parse_stats would give for all
+    the lines added so far, in the order they were added. Lines should be
+    split at dump boundaries (a dump's counter and duration lines together).
+    """
+
+    def __init__(self, num_cores, schema=SCHEMA):
+        self.num_cores = num_cores
+        self.schema = schema
+        self.totals = MetricTotals(num_cores, schema)
+
+    @property
+    def dump_count(self):
+        return self.totals.dump_count
+
+    def add(self, lines):
+        """Fold `lines` into the totals; returns the parse_stats dict of `lines` alone."""
+        parts = _accumulate(lines, self.num_cores, self.schema)
+        self.merge(parts)
+        return parts.result()
+
+    def merge(self, parts):
+        """Fold in the MetricTotals of lines that come after those already added."""
+        self.totals.merge(parts)
+
+    def result(self):
+        return self.totals.result()
+
+
+def iter_dump_blocks(lines):
+    """Yield the lines of each dump, from its "Begin Simulation Statistics" line up to the next one."""
+    block = None
+    for line in lines:
+        if line[:1] == "-" and "Begin Simulation Statistics" in line:
+            if block is not None:
+                yield block
+            block = [line]
+        elif block is not None:
+            block.append(line)
+    if block is not None:
+        yield block
+
+
+def parse_stats_lines_series(lines, num_cores):
+    """Per-dump time series of stats.txt lines: one NumPy column per metric, one row per dump.
+
+    Every column of parse_stats is there, with the values of each dump on
+    its own (latencies are not averaged over dumps), plus the
+    stats_schema.SERIES_METRICS: the vnet mean delays and the raw CCTA
+    counters and durations. The per-core columns are (dumps, cores)
+    arrays. gem5 resets the stats after each periodic dump, so a row covers
+    its own dump interval; running_totals turns the counters into totals
+    since the start of the run.
+    """
+    rows = [_accumulate(block, num_cores, SERIES_SCHEMA).result() for block in iter_dump_blocks(lines)]
+    return _series_columns(rows)
+
+
+def _series_columns(rows):
+    if not rows:
+        return {}
+    return {key: np.array([row[key] for row in rows], dtype=np.float64) for key in rows[0]}
+
+
+def parse_stats_series(file_path, num_cores):
+    """parse_stats_lines_series of a (possibly compressed) stats.txt file."""
+    return parse_stats_lines_series(read_stats_lines(file_path), num_cores)
+
+
+# Keys of the parse_stats dict (the SERIES_SCHEMA totals have these and more)
+PARSE_STATS_KEYS = frozenset(metric_keys(METRICS) + [metric.per_core for metric in METRICS if metric.per_core])
+
+
+def parse_stats_lines_with_series(lines, num_cores):
+    """(parse_stats dict, parse_stats_lines_series columns) of stats.txt lines, in one pass.
+
+    Each dump is reduced once with SERIES_SCHEMA; its totals are the dump's
+    series row and are folded into a DumpAggregate, whose result, cut down
+    to the parse_stats keys, is the averages.
+    """
+    aggregate = DumpAggregate(num_cores, SERIES_SCHEMA)
+    rows = []
+    for block in iter_dump_blocks(lines):
+        totals = _accumulate(block, num_cores, SERIES_SCHEMA)
+        rows.append(totals.result())
+        aggregate.merge(totals)
+    averages = {key: value for key, value in aggregate.result().items() if key in PARSE_STATS_KEYS}
+    return averages, _series_columns(rows)
+
+
+def parse_stats_with_series(file_path, num_cores):
+    """parse_stats_lines_with_series of a (possibly compressed) stats.txt file: parse_stats and parse_stats_series together."""
+    return parse_stats_lines_with_series(read_stats_lines(file_path), num_cores)
+
+
+# Series columns that count events of a dump interval (the rest are averages or ratios)
+COUNTER_COLUMNS = tuple(counter_keys(METRICS + SERIES_METRICS))
+
+
+def running_totals(series):
+    """Copy of `series` with the COUNTER_COLUMNS turned into totals from the start of the run to each dump."""
+    totals = dict(series)
+    for key in COUNTER_COLUMNS:
+        if key in series:
+            totals[key] = np.cumsum(series[key], axis=0)
+    return totals
+
+
+def _open_zstd(path):
+    import zstandard  # only needed for .zst files
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+
+
+# Suffix of compressed text stats -> opener of the decompressed binary stream.
+# gem5 writes gzip itself (--stats-file=stats.txt.gz); zstd is for archived runs
+COMPRESSED_OPENERS = {".gz": gzip.open, ".zst": _open_zstd}
+TEXT_STATS_NAMES = ("stats.txt", "stats.txt.gz", "stats.txt.zst")
+
+
+def is_compressed(file_path):
+    return file_path.endswith(tuple(COMPRESSED_OPENERS))
+
+
+def text_stats_path(outdir):
+    """The text stats file of a gem5 outdir, compressed or not (stats.txt if there is none yet)."""
+    for name in TEXT_STATS_NAMES:
+        path = os.path.join(outdir, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(outdir, "stats.txt")
 
+
+def _decompress(file_path, chunks, stop, chunk_size):
+    """Thread body: put the decompressed chunks of `file_path` into `chunks`, then None (or the exception)."""
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        with COMPRESSED_OPENERS[os.path.splitext(file_path)[1]](file_path) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk or not put(chunk):
+                    break
+        put(None)
+    except Exception as e:
+        put(e)
+
+
+def decompressed_lines(file_path, chunk_size=1 << 20, depth=8):
+    """Lines of a compressed text stats file, decompressed by a background thread.
+
+    The thread inflates up to `depth` chunks of `chunk_size` bytes ahead
+    while the caller parses (zlib and zstd release the GIL), and nothing is
+    written to disk.
+    """
+    chunks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    thread = threading.Thread(target=_decompress, args=(file_path, chunks, stop, chunk_size),
+                              name="stats-decompress", daemon=True)
+    thread.start()
+    partial = b""
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            data = partial + chunk
+            end = data.rfind(b"\n") + 1
+            partial = data[end:]
+            yield from data[:end].decode().splitlines(True)
+        if partial:
+            yield partial.decode()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read_stats_lines(file_path):
+    """Lines of a text stats file, decompressed on the fly if it is .gz or .zst."""
+    if is_compressed(file_path):
+        yield from decompressed_lines(file_path)
+        return
     with open(file_path, 'r') as f:
-        for line in f:
-                if "Begin Simulation Statistics" in line:
-                    dump_count += 1  # Increment the dump count
-            
-                # Sum the values for each metric
-                if "system.ruby.network.packets_injected::total" in line:
-                    sums["packets_injected"] += float(line.split()[1])
-                elif "system.ruby.network.packets_received::total" in line:
-                    sums["packets_received"] += float(line.split()[1])
-                elif "system.ruby.network.flits_injected::total" in line:
-                    sums["flits_injected"] += float(line.split()[1])
-                elif "system.ruby.network.flits_received::total" in line:
-                    sums["flits_received"] += float(line.split()[1])
-                elif "system.ruby.network.ext_in_link_utilization" in line:
-                    sums["external_link_utilization"] += float(line.split()[1])
-                elif "system.ruby.network.int_link_utilization" in line:
-                    sums["internal_link_utilization"] += float(line.split()[1])
-                elif "L1Dcache.total_cache_level_messages" in line:
-                    sums["cache_level_messages"] +=int(line.split()[1])
-                
-                        
-
-                    
-                #calculate the network delay
-                '''
-                elif ("system.ruby.delayVCHist.vnet_0::mean" in line or "system.ruby.delayVCHist.vnet_1::mean" in line or "system.ruby.delayVCHist.vnet_2::mean" in line):
-                    latencies["average_network_delay"] += float(line.split()[1])  
-                '''
-                if "system.ruby.delayVCHist.vnet_0::mean" in line:
-                    sums["vnet_0_delay"] = float(line.split()[1])
-                elif "system.ruby.delayVCHist.vnet_0::total " in line:
-                    sums["vnet_0_samples"] = int(line.split()[1])
-                    sums["vnet_0_total_delay"] = sums["vnet_0_delay"] * sums["vnet_0_samples"]
-
-                elif "system.ruby.delayVCHist.vnet_1::mean" in line:
-                    sums["vnet_1_delay"] = float(line.split()[1])
-                elif "system.ruby.delayVCHist.vnet_1::total " in line:
-                    sums["vnet_1_samples"] = int(line.split()[1])
-                    sums["vnet_1_total_delay"] = sums["vnet_1_delay"] * sums["vnet_1_samples"]
-
-                elif "system.ruby.delayVCHist.vnet_2::mean" in line:
-                    sums["vnet_2_delay"] = float(line.split()[1])
-                elif "system.ruby.delayVCHist.vnet_2::total " in line:
-                    sums["vnet_2_samples"] = int(line.split()[1])
-                    sums["vnet_2_total_delay"] = sums["vnet_2_delay"] * sums["vnet_2_samples"]
-                    
-                    
-                                        
-                elif "system.ruby.network.average_packet_queueing_latency" in line:
-                    latencies["average_packet_queueing_latency"] += float(line.split()[1])
-                elif "system.ruby.network.average_packet_network_latency" in line:
-                    latencies["average_packet_network_latency"] += float(line.split()[1])
-                elif "system.ruby.network.average_packet_latency" in line:
-                    latencies["average_packet_latency"] += float(line.split()[1])
-                    
-                elif "system.ruby.network.average_flit_queueing_latency" in line:
-                    latencies["average_flit_queueing_latency"] += float(line.split()[1])
-                elif "system.ruby.network.average_flit_network_latency" in line:
-                    latencies["average_flit_network_latency"] += float(line.split()[1])
-                elif "system.ruby.network.average_flit_latency" in line:
-                    latencies["average_flit_latency"] += float(line.split()[1])
-                elif "system.ruby.network.average_hops" in line:
-                    latencies["average_hops"] += float(line.split()[1])
-                elif "system.ruby.network.avg_link_utilization" in line:
-                    latencies["average_link_utilization"] += float(line.split()[1])
-
-                    
-                    
-                #for i in range(num_cores):  # Assuming 4 cores, you can adjust this as needed
-                    #if f"system.ruby.l1_cntrl{i}" in line:
-                        #if "L1Dcache.totalNoCWriteHitDuration" in line:
-                            #duration = float(line.split()[1])
-                            #if duration > 0:
-                                #sums["total_NoCWriteHitDuration"] += duration
-                                # Fetch the next lines to find the corresponding counter
-
-                                #next_line = next(f)
-                                #if f"system.ruby.l1_cntrl{i}" in next_line and "L1Dcache.NoCwriteHitCounter" in next_line:
-                                #if "L1Dcache.NoCwriteHitCounter" in next_line:
-                                    #sums["total_writehit_counter"] += int(next_line.split()[1])
-                                    #sums["total_writehit_counter"] += int(line.split()[1])
-                                    #total_writehit_counter += int(next_line.split()[1])
-                                
-
-                            #print(f"Core {i}: WriteHit Duration = {duration}, Counter = {sums['total_writehit_counter']}")
-
-                        
-                        #elif "L1Dcache.totalNoCReadMissDuration" in line:
-                            #duration = float(line.split()[1])
-                            #if duration > 0:
-                                #sums["total_NoCReadMissDuration"] += duration
-                                
-                                #print(f"Core {i}: WriteMiss Duration = {duration}")
-                                # Fetch the next lines to find the corresponding counter
-
-                                #next_line = next(f)
-                                #if f"system.ruby.l1_cntrl{i}" in next_line and "L1Dcache.NoCreadMissCounter" in next_line:
-                                #if f"system.ruby.l1_cntrl{i}" in line and "L1Dcache.NoCreadMissCounter" in line:
-                                    #sums["total_readmiss_counter"] += int(next_line.split()[1])
-                                    #sums["total_readmiss_counter"] += int(line.split()[1])
-                                    #total_readmiss_counter += int(line.split()[1])
-
-
-                                #print(f"Core {i}: WriteHit Duration = {duration}, Counter = {sums['total_writehit_counter']}")
-
-                for i in range(num_cores):
-                    if f"system.ruby.l1_cntrl{i}" in line:
-                        if "L1Dcache.NoCwriteHitCounter" in line:
-                            writehit_counters[i] = int(line.split()[1])
-                        elif "L1Dcache.NoCreadMissCounter" in line:
-                            readmiss_counters[i] = int(line.split()[1])
-
-
-                        # Process durations
-                        elif "L1Dcache.totalNoCWriteHitDuration" in line:
-                            duration = float(line.split()[1])
-                            if duration > 0 and i in writehit_counters:
-                                sums["total_NoCWriteHitDuration"] += duration
-                                total_writehit_counter += writehit_counters[i]
-                        elif "L1Dcache.totalNoCReadMissDuration" in line:
-                            duration = float(line.split()[1])
-                            if duration > 0 and i in readmiss_counters:
-                                sums["total_NoCReadMissDuration"] += duration
-                                total_readmiss_counter += readmiss_counters[i]
-                                
-                                
-  
-
-    # Calculate the average for each latency metric using the total dump count
-    sums["average_packet_delay"] = (sums["vnet_0_total_delay"] + sums["vnet_1_total_delay"] + sums["vnet_2_total_delay"]) #/sums["packets_received"]
-    averages = {}
-    for key in latencies:
-       averages[key] = latencies[key] / dump_count if dump_count > 0 else 0
-    '''
-        if key == "average_network_delay":
-            averages[key] = latencies[key] / (3 * dump_count) if dump_count > 0 else 0
+        yield from f
+
+
+H5_STATS_NAME = "stats.h5"
+
+
+def _h5py():
+    """The h5py module, or None when it is not installed."""
+    try:
+        import h5py
+    except ImportError:
+        return None
+    return h5py
+
+
+def is_h5_stats(file_path):
+    return file_path.startswith("h5://") or h5_stats_path(file_path).endswith((".h5", ".hdf5"))
+
+
+def h5_stats_path(file_path):
+    """File of an "h5://path?options" stats URL (a plain path is returned as it is)."""
+    if file_path.startswith("h5://"):
+        file_path = file_path[len("h5://"):].split("?", 1)[0]
+    return file_path
+
+
+def stats_source(outdir):
+    """The stats file of a gem5 outdir to parse: stats.h5 if gem5 wrote one and h5py is there, else the text stats."""
+    h5_path = os.path.join(outdir, H5_STATS_NAME)
+    if os.path.exists(h5_path) and _h5py() is not None:
+        return h5_path
+    return text_stats_path(outdir)
+
+
+def _h5_columns(group, name):
+    """Every dump of one stat as a (dumps, size) array, read in one call; None if gem5 did not write it."""
+    if name not in group:
+        return None
+    data = group[name][()]
+    return data.reshape(len(data), -1)
+
+
+def _h5_values(f, name):
+    """Every dump of the stat `name` as a (dumps,) array, or None if gem5 did not write it to the HDF5 file.
+
+    "a.b.c::total" is dataset a/b/c summed over its elements (the total of
+    a vector stat); other "::" stats are distributions, which the HDF5
+    writer skips.
+    """
+    path, _, suffix = name.partition("::")
+    if suffix not in ("", "total"):
+        return None
+    group_path, _, stat = path.replace(".", "/").rpartition("/")
+    columns = _h5_columns(f[group_path], stat) if group_path in f else None
+    if columns is None:
+        return None
+    return columns.sum(axis=1) if suffix else columns[:, 0]
+
+
+def _scan_text_stats(text_file, names):
+    """(dumps, len(names)) array of the stats `names` in a text stats file, NaN where a dump did not write one.
+
+    This is for the stats the HDF5 output lacks, like the delayVCHist
+    histograms; the lines are found with mmap.find (from the prefix the
+    names share) instead of parsing the file.
+    """
+    wanted = {name.encode(): i for i, name in enumerate(names)}
+    common = os.path.commonprefix(list(wanted))
+    try:
+        with open(text_file, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # no text output, or an empty one
+        return np.empty((0, len(names)))
+    with mapped:
+        begins = [0] if mapped[:len(BEGIN_MARKER) - 1] == BEGIN_MARKER[1:] else []
+        pos = mapped.find(BEGIN_MARKER)
+        while pos >= 0:
+            begins.append(pos + 1)
+            pos = mapped.find(BEGIN_MARKER, pos + 1)
+        values = np.full((len(begins), len(names)), np.nan)
+        for prefix in [common] if common else wanted:
+            pos = mapped.find(prefix)
+            while pos >= 0:
+                end = mapped.find(b"\n", pos)
+                end = len(mapped) if end < 0 else end
+                if pos == 0 or mapped[pos - 1] == ord("\n"):
+                    parts = mapped[pos:end].split(None, 2)
+                    column = wanted.get(parts[0]) if len(parts) >= 2 else None
+                    dump = bisect.bisect(begins, pos) - 1
+                    if column is not None and dump >= 0:
+                        values[dump, column] = float(parts[1])
+                pos = mapped.find(prefix, end)
+    return values
+
+
+def parse_stats_h5(file_path, num_cores, text_file=None, schema=SCHEMA):
+    """parse_stats of an HDF5 stats file written by gem5 (--stats-file=h5://stats.h5).
+
+    Every stat is one dataset with a row per dump, so each schema column is
+    read over all dumps in one call; the per-controller stats are stacked
+    into a dense (dumps, columns, cores) array. Stats the HDF5 output does
+    not have (the delayVCHist histograms) are taken from `text_file` (by
+    default the stats.txt next to it, which fs.py keeps writing).
+    """
+    h5py = _h5py()
+    if h5py is None:
+        raise ImportError("parse_stats_h5 needs h5py")
+    names = schema.names
+    with h5py.File(file_path, 'r') as f:
+        found = {}
+        for column, name in enumerate(names):
+            data = _h5_values(f, name)
+            if data is not None:
+                found[column] = data
+        core_found = {}
+        extra = np.zeros(len(schema.core_names))
+        for column, (prefix, rest) in enumerate(schema.core_names):
+            parent, _, stem = prefix.rpartition(".")
+            group_path = parent.replace(".", "/")
+            for child in (f[group_path] if group_path in f else ()):
+                index = child[len(stem):]
+                if not child.startswith(stem) or not index.isdigit():
+                    continue
+                data = _h5_values(f, prefix + index + rest)
+                if data is None:
+                    continue
+                if int(index) < num_cores:
+                    core_found[column, int(index)] = data
+                else:
+                    extra[column] += float(data.sum())
+    dump_count = max((len(data) for data in list(found.values()) + list(core_found.values())), default=0)
+
+    missing = [name for column, name in enumerate(names) if column not in found]
+    if missing:
+        if text_file is None:
+            text_file = os.path.join(os.path.dirname(file_path), "stats.txt")
+        text_values = _scan_text_stats(text_file, missing)
+    else:
+        text_values = np.empty((0, 0))
+    values = np.full((max(dump_count, len(text_values)), len(names)), np.nan)
+    for column, data in found.items():
+        values[:len(data), column] = data
+    for i, name in enumerate(missing):
+        values[:len(text_values), schema.columns[name]] = text_values[:, i]
+    core_values = np.full((dump_count, len(schema.core_names), num_cores), np.nan)
+    for (column, core), data in core_found.items():
+        core_values[:len(data), column, core] = data
+    return MetricTotals.from_dumps(num_cores, schema, dump_count, values, core_values, extra).result()
+
+
+BEGIN_MARKER = b"\n---------- Begin Simulation Statistics"
+
+
+def dump_chunks(file_path, chunks):
+    """About `chunks` (start, end) byte ranges of a text stats file, each starting at a dump's Begin line."""
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            bounds = [0]
+            for i in range(1, chunks):
+                start = mapped.find(BEGIN_MARKER, max(bounds[-1], size * i // chunks))
+                if start < 0:
+                    break
+                bounds.append(start + 1)  # the Begin line itself opens the next chunk
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_chunk(args):
+    """_accumulate results of every dump in one byte range of a stats file; runs in a pool worker.
+
+    The dumps are kept apart (the bytes before the first Begin line make
+    their own part), so merging them in order repeats the additions of a
+    sequential parse.
+    """
+    file_path, start, end, num_cores = args
+    parts = []
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            while start < end:
+                # The dump ends where the newline before the next Begin line does
+                found = mapped.find(BEGIN_MARKER, start, end)
+                stop = end if found < 0 else found + 1
+                parts.append(_accumulate(mapped[start:stop].decode().splitlines(True), num_cores))
+                start = stop
+    return parts
+
+
+def parse_stats_parallel(file_path, num_cores, max_workers=None, chunks_per_worker=4, chunk_bytes=64 << 20):
+    """parse_stats of one large text stats file, split at dump boundaries and parsed in a process pool.
+
+    The file is memory-mapped and cut into ranges that each start at a
+    "Begin Simulation Statistics" line: about `chunks_per_worker` per
+    worker, and more if needed to keep them near `chunk_bytes`. Every
+    worker returns the MetricTotals of each dump in its range;
+    DumpAggregate merges them in file order, so the result is that of
+    parse_stats (vnet delays still last-wins). Compressed files cannot be
+    split and are parsed in one go.
+    """
+    if is_compressed(file_path) or is_h5_stats(file_path):
+        return parse_stats(file_path, num_cores)
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = max(max_workers * chunks_per_worker, -(-os.path.getsize(file_path) // chunk_bytes))
+    tasks = [(file_path, start, end, num_cores) for start, end in dump_chunks(file_path, chunks)]
+    aggregate = DumpAggregate(num_cores)
+
+    def merge_all(results):
+        for parts in results:
+            for part in parts:
+                aggregate.merge(part)
+
+    if max_workers == 1 or len(tasks) < 2:
+        merge_all(map(_parse_chunk, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            merge_all(executor.map(_parse_chunk, tasks))
+    return aggregate.result()
+
+
+def flat_stats(averages):
+    """`averages` with every per-core list spread over one key per core.
+
+    "core_average_write_hit_time" becomes "core_0_average_write_hit_time",
+    "core_1_average_write_hit_time" and so on, so that writers keep one
+    number per key.
+    """
+    flat = {}
+    for key, value in averages.items():
+        if isinstance(value, (list, tuple, np.ndarray)):
+            for core, core_value in enumerate(value):
+                flat[key.replace("core_", f"core_{core}_", 1) if key.startswith("core_") else f"{key}_{core}"] = core_value
         else:
-    '''
-        
-
-    # Adjust average network delay calculation by dividing by (3 * dump_count)
-    #averages["average_network_delay"] /= (3 * dump_count) 
-    
-    
-    # Add the sums directly for metrics that don't need averaging
-    averages.update({
-        "packets_injected": sums["packets_injected"],
-        "packets_received": sums["packets_received"],
-        "flits_injected": sums["flits_injected"],
-        "flits_received": sums["flits_received"],
-        "external_link_utilization": sums["external_link_utilization"],
-        "internal_link_utilization": sums["internal_link_utilization"],
-        "total_cache_level_messages": sums["cache_level_messages"],
-        #"total_NoCWriteHitDuration": sums["total_NoCWriteHitDuration"],
-        #"total_NoCWriteMissDuration": sums["total_NoCWriteMissDuration"],
-        #"total_NoCReadMissDuration": sums["total_NoCReadMissDuration"]
-        "total_average_write_hit_time": (round(sums["total_NoCWriteHitDuration"]/total_writehit_counter,2) if total_writehit_counter > 0 else 0),
-        "total_average_readmiss_time": (round(sums["total_NoCReadMissDuration"]/total_readmiss_counter,2) if total_readmiss_counter > 0 else 0),
-        "average_packet_delay": sums["average_packet_delay"],
-        #"total_energy (pJ)": sums["total_energy"],
-        #"average_power (mW)": sums["total_power"] / (num_cores * 2) if num_cores > 0 else 0,
-    })
-
-    return averages
-
-# Example usage:
-stats_file_path = "/data/guochu/gem5/mesh_mesi_vips/stats.txt"
-averages = parse_stats(stats_file_path, num_cores=16)
-
-# Now you can print the averages or use them as needed
-#for key, avg in averages.items():
-    #print(f"{key}: {avg}")
+            flat[key] = value
+    return flat
 
 def write_dicts_to_file(averages, output_file):
     with open(output_file, 'w') as f:
-        for key, avg in averages.items():
+        for key, avg in flat_stats(averages).items():
             f.write(f"{key}: {avg}\n")
 
-output_file = "/data/guochu/gem5/2paper/16c_routing/vips/network_stats.txt"
-write_dicts_to_file(averages, output_file)
\ No newline at end of file
+
+def _parse_outdir(args):
+    """(outdir, parse_stats dict or None, error or None) of one outdir; runs in a pool worker."""
+    outdir, num_cores, use_cache = args
+    stats_file = text_stats_path(outdir)
+    try:
+        if use_cache:
+            from stats_cache import cached_parse_stats
+            return outdir, cached_parse_stats(stats_file, num_cores), None
+        return outdir, parse_stats(stats_file, num_cores), None
+    except Exception as e:
+        return outdir, None, f"{type(e).__name__}: {e}"
+
+
+def _parse_large_outdir(outdir, num_cores, max_workers, use_cache):
+    """_parse_outdir of an outdir whose stats.txt is split over `max_workers` processes (parse_stats_parallel)."""
+    stats_file = text_stats_path(outdir)
+    try:
+        if use_cache:
+            from stats_cache import load_cached
+            cached = load_cached(stats_file, num_cores)
+            if cached is not None:
+                return outdir, cached[0], None
+        return outdir, parse_stats_parallel(stats_file, num_cores, max_workers), None
+    except Exception as e:
+        return outdir, None, f"{type(e).__name__}: {e}"
+
+
+def _is_large(outdir, parallel_bytes):
+    stats_file = text_stats_path(outdir)
+    try:
+        return not is_compressed(stats_file) and os.path.getsize(stats_file) >= parallel_bytes
+    except OSError:
+        return False
+
+
+# An uncompressed stats.txt this large is parsed by all the workers together
+PARALLEL_PARSE_BYTES = 1 << 30
+
+
+def parse_outdirs(outdirs, num_cores, max_workers=None, use_cache=False, parallel_bytes=PARALLEL_PARSE_BYTES):
+    """Parse the stats.txt of many gem5 outdirs in a process pool.
+
+    Returns (outdir, dict, error) tuples in the order of `outdirs`; a run
+    whose stats.txt is missing or unreadable has dict None and the error.
+    With `use_cache` the results are read from (and saved to) the
+    stats_cache file of each outdir. An uncompressed stats.txt of at least
+    `parallel_bytes` (None for no limit) is parsed after the others with
+    parse_stats_parallel on all `max_workers`; its cache is read but not
+    written, since that would need a second, sequential series parse.
+    """
+    outdirs = list(outdirs)
+    large = {outdir for outdir in outdirs if parallel_bytes is not None and _is_large(outdir, parallel_bytes)}
+    small = [outdir for outdir in outdirs if outdir not in large]
+    if max_workers == 1 or len(small) < 2:
+        parsed = [_parse_outdir((outdir, num_cores, use_cache)) for outdir in small]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed = list(executor.map(_parse_outdir, [(outdir, num_cores, use_cache) for outdir in small],
+                                       chunksize=4))
+    parsed += [_parse_large_outdir(outdir, num_cores, max_workers, use_cache) for outdir in large]
+    results = {result[0]: result for result in parsed}
+    return [results[outdir] for outdir in outdirs]
+
+
+def write_table(results, output_file, delimiter="\t"):
+    """Write parse_outdirs results as one table: a row per outdir, a column per metric (per core for the per-core lists), then the error."""
+    results = [(outdir, flat_stats(averages or {}), error) for outdir, averages, error in results]
+    keys = []
+    for _, averages, _ in results:
+        for key in averages:
+            if key not in keys:
+                keys.append(key)
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(["outdir"] + keys + ["error"])
+        for outdir, averages, error in results:
+            writer.writerow([outdir] + [averages.get(key, "") for key in keys] + [error or ""])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse the stats.txt of many gem5 outdirs into one table")
+    parser.add_argument("outdirs", nargs="+", help="gem5 outdirs or globs of them")
+    parser.add_argument("-o", "--output", default="network_stats.tsv", help="table to write (.csv for commas, tabs otherwise)")
+    parser.add_argument("--num-cores", type=int, default=16)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--no-cache", action="store_true", help="always parse stats.txt, ignoring stats_cache files")
+    parser.add_argument("--parallel-mb", type=float, default=PARALLEL_PARSE_BYTES / 2**20,
+                        help="split an uncompressed stats.txt of at least this many MB over all the workers "
+                             "(default %(default)g; 0 to never)")
+    cli_args = parser.parse_args()
+
+    outdirs = sorted({path for pattern in cli_args.outdirs for path in glob.glob(pattern)
+                      if os.path.isdir(path)})
+    parallel_bytes = int(cli_args.parallel_mb * 2**20) if cli_args.parallel_mb > 0 else None
+    results = parse_outdirs(outdirs, cli_args.num_cores, cli_args.jobs, not cli_args.no_cache, parallel_bytes)
+    write_table(results, cli_args.output, "," if cli_args.output.endswith(".csv") else "\t")
+    failed = [(outdir, error) for outdir, _, error in results if error]
+    for outdir, error in failed:
+        print(f"?? {outdir}: {error}")
+    print(f"? {len(results) - len(failed)} of {len(results)} outdirs written to {cli_args.output}")
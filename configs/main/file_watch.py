@@ -0,0 +1,102 @@
+##this file is to wake up on file-system events (inotify on Linux) instead of sleeping in poll loops
+import ctypes
+import ctypes.util
+import functools
+import os
+import select
+import struct
+import sys
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+@functools.lru_cache(maxsize=None)
+def _load_libc():
+    """Return libc if it provides inotify, otherwise None (looked up once; find_library runs ldconfig)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """Wait for files in one directory to be created, moved in or closed after writing.
+
+    Uses inotify when it is available; elsewhere `wait` degrades to a short
+    sleep of `poll_interval` seconds so callers can keep the same loop.
+    """
+
+    DEFAULT_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE
+
+    def __init__(self, directory, mask=DEFAULT_MASK, poll_interval=0.05):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._fd = None
+
+        libc = _load_libc()
+        if libc is None:
+            return
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return
+        self._fd = fd
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def fileno(self):
+        """inotify descriptor (for loop.add_reader); only valid when uses_inotify."""
+        return self._fd
+
+    def wait(self, timeout=None):
+        """Block until an event arrives or `timeout` seconds pass.
+
+        Returns the names of the files the events were about (empty on timeout
+        or when falling back to polling).
+        """
+        if self._fd is None:
+            time.sleep(self.poll_interval if timeout is None else min(self.poll_interval, timeout))
+            return []
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        names = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
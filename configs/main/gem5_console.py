@@ -0,0 +1,115 @@
+##this file is to attach to the gem5 terminal port without tmux/telnet and follow the benchmark phase
+import asyncio
+import threading
+import time
+
+# Guest console lines that mark a benchmark phase; the PARSEC hooks print the
+# ROI lines and the rcS scripts echo "Done :D" right before `m5 exit`
+CONSOLE_MARKERS = {
+    "boot_done": b"loading script",
+    "roi_begin": b"[HOOKS] Entering ROI",
+    "roi_end": b"[HOOKS] Leaving ROI",
+    "script_exit": b"Done :D",
+}
+
+# Phase the guest is in once a marker has been seen
+MARKER_PHASES = {
+    "boot_done": "script",
+    "roi_begin": "roi",
+    "roi_end": "post_roi",
+    "script_exit": "exited",
+}
+
+
+class Gem5Console:
+    """Asyncio client for the pc.com_1 terminal of one gem5 instance.
+
+    Streams everything the guest prints to `log_path` and records the time
+    each of `markers` was first seen, so the driver can tell whether the
+    guest is booting, inside the ROI or done.
+    """
+
+    def __init__(self, port, log_path, host='localhost', markers=CONSOLE_MARKERS):
+        self.host = host
+        self.port = port
+        self.log_path = log_path
+        self.markers = markers
+        self.phase = "connecting"
+        self.connected_time = None
+        self.seen = {}  # marker name -> time.time() it was first seen
+        self._events = None
+
+    def _scan(self, line):
+        for name, pattern in self.markers.items():
+            if name not in self.seen and pattern in line:
+                self.seen[name] = time.time()
+                self.phase = MARKER_PHASES.get(name, self.phase)
+                print(f"? Console {self.port}: {name}")
+                if self._events is not None:
+                    self._events[name].set()
+
+    async def _connect(self, timeout, alive):
+        deadline = time.time() + timeout
+        interval = 0.05
+        while True:
+            try:
+                return await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                if time.time() >= deadline or (alive is not None and not alive()):
+                    return None
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, 1.0)
+
+    async def run(self, connect_timeout=300, alive=None):
+        """Connect once gem5 listens and follow the console until gem5 closes it.
+
+        `alive` is an optional callable; connecting is abandoned as soon as it
+        returns False (e.g. gem5 died before opening the port).
+
+        Returns:
+            bool: False if the port never opened, True otherwise.
+        """
+        self._events = {name: asyncio.Event() for name in self.markers}
+        for name in self.seen:
+            self._events[name].set()
+
+        streams = await self._connect(connect_timeout, alive)
+        if streams is None:
+            print(f"? Console port {self.port} did not open.")
+            return False
+        reader, writer = streams
+        self.connected_time = time.time()
+        self.phase = "boot"
+
+        pending = b""
+        with open(self.log_path, 'wb') as log:
+            while True:
+                try:
+                    chunk = await reader.read(4096)
+                except ConnectionError:
+                    chunk = b""  # gem5 went away without closing cleanly
+                if not chunk:
+                    break
+                log.write(chunk)
+                log.flush()
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    self._scan(line)
+            if pending:
+                self._scan(pending)
+
+        writer.close()
+        return True
+
+    async def wait_for(self, marker):
+        """Wait until `marker` has been printed by the guest (call while `run` is active)."""
+        await self._events[marker].wait()
+
+    def start_in_thread(self, connect_timeout=300, alive=None):
+        """Run the client on its own event loop in a daemon thread (for the blocking ICN_env)."""
+        thread = threading.Thread(target=asyncio.run,
+                                  args=(self.run(connect_timeout, alive),),
+                                  name=f"gem5-console-{self.port}", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,141 @@
+##this file is to run several gem5 simulations at once, each with its own outdir and console port
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from icn_gym_drl_2 import ICN_env, ICN_env_async, DEFAULT_OUTDIR, find_free_port
+
+
+class Gem5Instance:
+    """Bookkeeping for one gem5 run started by the pool."""
+
+    def __init__(self, instance_id, action, weights, outdir, port, job_index=None):
+        self.instance_id = instance_id
+        self.job_index = job_index
+        self.action = action
+        self.weights = weights
+        self.outdir = outdir
+        self.port = port
+        self.start_time = None
+        self.end_time = None
+        self.dicts = None
+        self.error = None
+        self.timing = {}
+
+    @property
+    def duration(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def __repr__(self):
+        return (f"Gem5Instance(id={self.instance_id}, action={self.action}, "
+                f"weights={self.weights}, port={self.port}, outdir={self.outdir})")
+
+
+class Gem5Pool:
+    """Run up to `max_instances` gem5 simulations concurrently.
+
+    Every instance gets a fresh sub-directory of `base_outdir` and a console
+    port that no other live instance of this pool holds, so the runs do not
+    overwrite each other's stats.txt or collide on the terminal. With a
+    CheckpointLibrary in `checkpoints` every instance restores post-boot,
+    with a ResultCache in `results` repeated configurations are not rerun.
+    `monitor_factory`, if given, returns a fresh ConvergenceMonitor for
+    every instance so that runs can be stopped early. With a Gem5Scheduler in
+    `scheduler` the runs are admitted by it, so the host budget rather than
+    `max_instances` decides how many simulate at once. A stand-in `backend`
+    (standin_backend.py) replaces gem5 in every instance.
+    """
+
+    def __init__(self, max_instances=None, base_outdir=DEFAULT_OUTDIR, checkpoints=None, results=None,
+                 monitor_factory=None, scheduler=None, backend=None):
+        self.max_instances = max_instances or os.cpu_count() or 1
+        self.base_outdir = base_outdir
+        self.checkpoints = checkpoints  # optional CheckpointLibrary shared by all instances
+        self.results = results  # optional ResultCache shared by all instances
+        self.monitor_factory = monitor_factory
+        self.scheduler = scheduler  # optional Gem5Scheduler shared by all instances
+        self.backend = backend
+        self.instances = []
+        self._lock = threading.Lock()
+        self._ports_in_use = set()
+        self._next_id = 0
+
+    def _new_instance(self, action, weights, job_index=None):
+        with self._lock:
+            instance_id = self._next_id
+            self._next_id += 1
+            port = find_free_port(exclude=self._ports_in_use)
+            self._ports_in_use.add(port)
+        outdir = os.path.join(self.base_outdir, f"run_{instance_id}")
+        instance = Gem5Instance(instance_id, action, weights, outdir, port, job_index)
+        self.instances.append(instance)
+        return instance
+
+    def _new_monitor(self):
+        return self.monitor_factory() if self.monitor_factory is not None else None
+
+    def _release(self, instance):
+        with self._lock:
+            self._ports_in_use.discard(instance.port)
+
+    def _run_instance(self, instance):
+        instance.start_time = time.time()
+        try:
+            instance.dicts = ICN_env(instance.action, instance.weights,
+                                     outdir=instance.outdir, port=instance.port,
+                                     timing=instance.timing,
+                                     checkpoints=self.checkpoints,
+                                     results=self.results,
+                                     monitor=self._new_monitor(),
+                                     scheduler=self.scheduler,
+                                     backend=self.backend)
+        except Exception as e:
+            instance.error = e
+            print(f"?? gem5 instance {instance.instance_id} failed: {e}")
+        finally:
+            instance.end_time = time.time()
+            self._release(instance)
+        return instance
+
+    def run(self, jobs):
+        """Simulate every (action, weights) pair in `jobs`.
+
+        Yields the finished Gem5Instance objects in completion order; the
+        parsed stats dict is in `instance.dicts` (None if the run failed) and
+        `instance.job_index` is the position of the pair in `jobs`.
+        """
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=min(self.max_instances, len(jobs) or 1)) as executor:
+            futures = [executor.submit(self._run_instance, self._new_instance(action, weights, i))
+                       for i, (action, weights) in enumerate(jobs)]
+            for future in as_completed(futures):
+                yield future.result()
+
+    async def run_async(self, action, weights, parse_executor=None):
+        """Simulate one (action, weights) pair with ICN_env_async.
+
+        Awaiting it returns the finished Gem5Instance; any number of these
+        can be in flight on one event loop, the caller bounds concurrency.
+        """
+        instance = self._new_instance(action, weights)
+        instance.start_time = time.time()
+        try:
+            instance.dicts = await ICN_env_async(instance.action, instance.weights,
+                                                 outdir=instance.outdir, port=instance.port,
+                                                 timing=instance.timing,
+                                                 parse_executor=parse_executor,
+                                                 checkpoints=self.checkpoints,
+                                                 results=self.results,
+                                                 monitor=self._new_monitor(),
+                                                 scheduler=self.scheduler,
+                                                 backend=self.backend)
+        except Exception as e:
+            instance.error = e
+            print(f"?? gem5 instance {instance.instance_id} failed: {e}")
+        finally:
+            instance.end_time = time.time()
+            self._release(instance)
+        return instance
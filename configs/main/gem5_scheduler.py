@@ -0,0 +1,342 @@
+##this file is to admit gem5 runs only while the host has cores and memory for them, and to retry the ones that crash or hang
+import heapq
+import itertools
+import os
+import re
+import signal
+import threading
+import time
+
+from icn_gym_drl_2 import (run_gem5_simulation, wait_for_stats, terminate_simulation, signal_simulation,
+                           MEM_SIZE)
+
+# Host memory gem5 needs beyond the guest's --mem-size (Ruby, garnet, the
+# Python config and the simulator itself)
+GEM5_OVERHEAD_BYTES = 1 * 2**30
+
+_SIZE_UNITS = {"": 1, "B": 1, "kB": 2**10, "KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
+
+
+def size_bytes(size):
+    """Bytes of a gem5 size string such as "768MB" (binary multiples, as gem5 reads them)."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKMGT]?B?)\s*", str(size))
+    if match is None:
+        raise ValueError(f"Cannot read size {size!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def host_memory_bytes():
+    """Physical memory of the host."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _group_stats(pgid):
+    """Yield (pid, /proc/<pid>/stat fields after the command name) of every process in process group `pgid`."""
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                # The command name may hold blanks; fields after it are fixed
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) == pgid:
+                yield pid, fields
+        except (OSError, IndexError, ValueError):
+            continue
+
+
+def group_rss_bytes(pgid):
+    """Resident memory of every process in process group `pgid` (0 where /proc is unavailable)."""
+    total = 0
+    for pid, _ in _group_stats(pgid):
+        try:
+            with open(f"/proc/{pid}/statm", 'r') as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def group_cpu_seconds(pgid):
+    """User plus system CPU time of every process in process group `pgid` (0 where /proc is unavailable)."""
+    ticks = sum(int(fields[11]) + int(fields[12]) for _, fields in _group_stats(pgid))
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+class SimulationHung(Exception):
+    """gem5 used no CPU time and wrote nothing into its outdir for longer than the hang timeout."""
+
+
+class SimulationJob:
+    """One gem5 run submitted to a Gem5Scheduler.
+
+    `process` is the Popen of the current attempt. `on_start(job)` is called
+    right after every launch and may return a callback that is invoked on
+    each file event in the outdir (see wait_for_stats).
+    """
+
+    def __init__(self, job_id, priority, action, mesh_rows, weights, outdir, port, command_args, on_start=None):
+        self.job_id = job_id
+        self.priority = priority
+        self.action = action
+        self.mesh_rows = mesh_rows
+        self.weights = weights
+        self.outdir = outdir
+        self.port = port
+        self.command_args = command_args
+        self.on_start = on_start
+        self.state = "queued"
+        self.process = None
+        self.attempts = 0
+        self.completed = None
+        self.stopped = False
+        self.error = None
+        self.peak_rss = 0
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def stop(self, sig=signal.SIGTERM):
+        """Stop the run on purpose (e.g. early stopping); it is not retried."""
+        self.stopped = True
+        if self.process is not None:
+            signal_simulation(self.process, sig)
+
+    def result(self, timeout=None):
+        """Block until the job is finished; True if gem5 completed and wrote the sentinel."""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"gem5 job {self.job_id} not finished within {timeout} seconds")
+        return self.completed
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, fn):
+        """Call `fn(job)` once the job is finished, on the thread that finishes it (right away if it is)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def __repr__(self):
+        return (f"SimulationJob(id={self.job_id}, action={self.action}, weights={self.weights}, "
+                f"state={self.state}, attempts={self.attempts})")
+
+
+class Gem5Scheduler:
+    """Local scheduler that starts gem5 runs within a CPU and memory budget.
+
+    Every run takes one core (gem5 simulates on a single thread) and
+    `job_memory` bytes, by default the guest's --mem-size plus
+    GEM5_OVERHEAD_BYTES; a running job is charged its measured RSS instead
+    once that is larger. Jobs wait in a priority queue (lower `priority`
+    first, then submission order) until both fit. A run that crashes (no
+    sentinel and a non-zero exit code) or hangs (its process group used no
+    CPU time and wrote no file in its outdir for `hang_timeout` seconds; a
+    run without periodic dumps writes nothing for hours while it simulates)
+    is started again after
+    `retry_backoff` * 2**(attempt - 1) seconds, at most `max_retries` times.
+    """
+
+    def __init__(self, max_cpus=None, max_memory=None, job_memory=None, max_retries=2,
+                 retry_backoff=30.0, hang_timeout=7200.0, rss_interval=5.0):
+        self.max_cpus = max_cpus or max(1, (os.cpu_count() or 2) - 1)  # one core stays with the driver
+        self.max_memory = max_memory or int(0.9 * host_memory_bytes())
+        self.job_memory = job_memory or size_bytes(MEM_SIZE) + GEM5_OVERHEAD_BYTES
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.hang_timeout = hang_timeout
+        self.rss_interval = rss_interval
+        self.jobs = []
+        self.retries = 0
+        self._queue = []  # heap of (priority, sequence, job)
+        self._sequence = itertools.count()
+        self._running = {}  # job_id -> job
+        self._cond = threading.Condition()
+        self._next_id = 0
+        self._dispatcher = threading.Thread(target=self._dispatch, name="gem5-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, action, mesh_rows, weights, outdir, port, priority=0, on_start=None, **command_args):
+        """Queue one run of run_gem5_simulation; `command_args` are passed on to it. Returns the SimulationJob."""
+        with self._cond:
+            job = SimulationJob(self._next_id, priority, action, mesh_rows, weights, outdir, port,
+                                command_args, on_start)
+            self._next_id += 1
+            self.jobs.append(job)
+            heapq.heappush(self._queue, (priority, next(self._sequence), job))
+            self._cond.notify_all()
+        return job
+
+    @property
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    @property
+    def running(self):
+        with self._cond:
+            return len(self._running)
+
+    def _charged_memory(self, job):
+        return max(self.job_memory, job.peak_rss)
+
+    def memory_in_use(self):
+        """Bytes charged to the running jobs."""
+        with self._cond:
+            return sum(self._charged_memory(job) for job in self._running.values())
+
+    def _fits(self):
+        """True if one more job fits the budget (lock held); one job always runs."""
+        if not self._running:
+            return True
+        memory = sum(self._charged_memory(job) for job in self._running.values())
+        return len(self._running) < self.max_cpus and memory + self.job_memory <= self.max_memory
+
+    def _update_rss(self):
+        with self._cond:
+            running = list(self._running.values())
+        for job in running:
+            if job.process is None:
+                continue
+            try:
+                rss = group_rss_bytes(os.getpgid(job.process.pid))
+            except ProcessLookupError:
+                continue
+            job.peak_rss = max(job.peak_rss, rss)
+
+    def _dispatch(self):
+        last_rss = 0.0
+        while True:
+            if time.time() - last_rss >= self.rss_interval:
+                self._update_rss()
+                last_rss = time.time()
+            with self._cond:
+                if not self._queue or not self._fits():
+                    # Woken by submissions and finished jobs; the timeout
+                    # keeps the RSS figures fresh while jobs run
+                    self._cond.wait(timeout=self.rss_interval)
+                    continue
+                _, _, job = heapq.heappop(self._queue)
+                if job.stopped:  # cancelled while queued
+                    job.state, job.completed = "done", False
+                    job._finish()
+                    continue
+                job.state = "running"
+                self._running[job.job_id] = job
+            threading.Thread(target=self._supervise, args=(job,), name=f"gem5-job-{job.job_id}",
+                             daemon=True).start()
+
+    def _hang_check(self, job, on_wake):
+        # CPU time of the job at the last time it was seen to advance; /proc
+        # is only read once the outdir has been quiet for hang_timeout
+        progress = {"time": job.start_time, "cpu": 0.0}
+
+        def check():
+            if on_wake is not None:
+                on_wake()
+            if self.hang_timeout is None:
+                return
+            if time.time() - max(progress["time"], self._last_write(job)) <= self.hang_timeout:
+                return
+            try:
+                cpu = group_cpu_seconds(os.getpgid(job.process.pid))
+            except ProcessLookupError:
+                return  # exited; wait_for_stats sees it next
+            if cpu > progress["cpu"]:
+                progress["time"], progress["cpu"] = time.time(), cpu
+                return
+            raise SimulationHung(f"gem5 job {job.job_id} used no CPU time and wrote nothing "
+                                 f"for {self.hang_timeout:.0f} seconds")
+        return check
+
+    def _last_write(self, job):
+        latest = job.start_time
+        try:
+            for entry in os.scandir(job.outdir):
+                if entry.is_file():
+                    latest = max(latest, entry.stat().st_mtime)
+        except OSError:
+            pass
+        return latest
+
+    def _supervise(self, job):
+        job.attempts += 1
+        job.start_time = time.time()
+        hung = False
+        try:
+            job.process = run_gem5_simulation(job.action, job.mesh_rows, job.weights, job.outdir, job.port,
+                                              **job.command_args)
+            on_wake = job.on_start(job) if job.on_start is not None else None
+            job.completed = wait_for_stats(job.outdir, job.process, on_wake=self._hang_check(job, on_wake))
+        except SimulationHung as e:
+            print(f"?? {e}, terminating it.")
+            terminate_simulation(job.process)
+            job.completed, hung = False, True
+        except Exception as e:
+            print(f"?? gem5 job {job.job_id} failed: {e}")
+            if job.process is not None:
+                terminate_simulation(job.process)
+            job.completed, job.error = False, e
+        job.end_time = time.time()
+
+        returncode = job.process.returncode if job.process is not None else None
+        crashed = hung or (not job.completed and not job.stopped and returncode != 0)
+        retry = crashed and job.attempts <= self.max_retries
+        with self._cond:
+            del self._running[job.job_id]
+            if retry:
+                self.retries += 1
+            self._cond.notify_all()
+
+        if retry:
+            delay = self.retry_backoff * 2 ** (job.attempts - 1)
+            job.state = "retrying"
+            print(f"?? gem5 job {job.job_id} {'hung' if hung else f'crashed (exit code {returncode})'}, "
+                  f"retrying in {delay:.0f} s (attempt {job.attempts + 1} of {self.max_retries + 1}).")
+            timer = threading.Timer(delay, self._requeue, args=(job,))
+            timer.daemon = True
+            timer.start()
+            return
+        job.state = "failed" if crashed else "done"
+        job._finish()
+
+    def _requeue(self, job):
+        with self._cond:
+            job.state = "queued"
+            heapq.heappush(self._queue, (job.priority, next(self._sequence), job))
+            self._cond.notify_all()
+
+    def utilization(self):
+        """Queue depth, running jobs and the share of the CPU and memory budget in use."""
+        with self._cond:
+            running = list(self._running.values())
+            queued = len(self._queue)
+        return {
+            "queue_depth": queued,
+            "running": len(running),
+            "cpu": len(running) / self.max_cpus,
+            "memory": sum(self._charged_memory(job) for job in running) / self.max_memory,
+            "rss_bytes": sum(job.peak_rss for job in running),
+            "retries": self.retries,
+        }
+
+    def summary(self):
+        u = self.utilization()
+        return (f"scheduler: {u['running']} running, {u['queue_depth']} queued, "
+                f"{u['cpu']:.0%} of {self.max_cpus} cores, {u['memory']:.0%} of "
+                f"{self.max_memory / 2**30:.1f} GiB, {u['retries']} retries")
@@ -0,0 +1,205 @@
+##this file is to drive gem5 through a gym-style reset()/step() interface, one instance or several at once
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from icn_gym_drl_2 import ICN_env, DEFAULT_OUTDIR, DEFAULT_TERMINAL_PORT, find_free_port
+
+DEFAULT_INITIAL_WEIGHTS = "2,1,2,2"
+
+
+class EnvThroughput:
+    """Environment steps and the wall time spent producing them, apart from the agent's time."""
+
+    def __init__(self):
+        self.steps = 0
+        self.seconds = 0.0
+
+    def record(self, steps, seconds):
+        self.steps += steps
+        self.seconds += seconds
+
+    @property
+    def steps_per_hour(self):
+        return self.steps * 3600 / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self):
+        return f"environment: {self.steps} steps in {self.seconds:.1f} s ({self.steps_per_hour:.1f} steps/hour)"
+
+
+class ICNEnv:
+    """Gym-style environment around ICN_env.
+
+    An action is an (action_index, weights) pair: the index into `actions`
+    (the topology) and the link-weight string passed to gem5. The observation
+    is `preprocess(features(dicts))` of the simulated stats: `features` gives
+    the raw state vector and `preprocess` turns one vector or an (N, d)
+    batch of them into the normalized state tensor(s). The reward is
+    `reward_fn(dicts)`. `done` marks the end of an episode every
+    `steps_per_episode` steps; the stats carry over, so the driver does not
+    have to reset between episodes. `checkpoints`, `results`,
+    `monitor_factory`, `scheduler` and `backend` are passed on as in Gem5Pool.
+    """
+
+    def __init__(self, actions, features, preprocess, reward_fn, steps_per_episode=3, outdir=DEFAULT_OUTDIR,
+                 port=DEFAULT_TERMINAL_PORT, checkpoints=None, results=None, monitor_factory=None, scheduler=None,
+                 backend=None):
+        self.actions = actions
+        self.features = features
+        self.preprocess = preprocess
+        self.reward_fn = reward_fn
+        self.steps_per_episode = steps_per_episode
+        self.outdir = outdir
+        self.port = port
+        self.checkpoints = checkpoints
+        self.results = results
+        self.monitor_factory = monitor_factory
+        self.scheduler = scheduler
+        self.backend = backend
+        self.throughput = EnvThroughput()
+        self.state = None
+        self.dicts = None
+        self.steps = 0
+
+    def simulate(self, action, weights, timing=None):
+        """Run gem5 for one topology name and weight string and return the parsed stats."""
+        monitor = self.monitor_factory() if self.monitor_factory is not None else None
+        return ICN_env(action, weights, outdir=self.outdir, port=self.port, timing=timing,
+                       checkpoints=self.checkpoints, results=self.results, monitor=monitor,
+                       scheduler=self.scheduler, backend=self.backend)
+
+    def observe(self, dicts, state=None):
+        """Turn simulated stats into (state, reward, done) and advance the step count.
+
+        `state` is given if the stats were already preprocessed in a batch.
+        """
+        self.dicts = dicts
+        self.state = self.preprocess(self.features(dicts)) if state is None else state
+        self.steps += 1
+        return self.state, self.reward_fn(dicts), self.steps % self.steps_per_episode == 0
+
+    def reset(self, initial_dicts=None, action_index=0, weights=DEFAULT_INITIAL_WEIGHTS):
+        """Return the initial state, simulating `action_index` with `weights` unless stats are given."""
+        if initial_dicts is None:
+            initial_dicts = self.simulate(self.actions[action_index], weights)
+        self.dicts = initial_dicts
+        self.state = self.preprocess(self.features(initial_dicts))
+        self.steps = 0
+        return self.state
+
+    def step(self, action):
+        """Simulate one (action_index, weights) action.
+
+        Returns:
+            tuple: (state, reward, done, info) with the stats in info["dicts"]
+            and the episode timing of ICN_env in info["timing"].
+        """
+        action_index, weights = action
+        timing = {}
+        start_time = time.time()
+        dicts = self.simulate(self.actions[action_index], weights, timing)
+        self.throughput.record(1, time.time() - start_time)
+        state, reward, done = self.observe(dicts)
+        return state, reward, done, {"dicts": dicts, "timing": timing}
+
+
+class ICNVecEnv:
+    """Step several ICNEnv sub-environments concurrently.
+
+    States come back stacked into one (num_envs, state_size) tensor, rewards
+    and done flags as NumPy arrays, so a learner can work on the whole batch.
+    The simulations run in parallel threads; the features of all the stats
+    that came back are then stacked into one (N, d) array and preprocessed
+    in a single call on the calling thread, so the running normalization is
+    updated and applied once per step. A sub-environment whose simulation fails keeps its state,
+    gets a NaN reward and the exception in info["error"].
+    """
+
+    def __init__(self, envs):
+        self.envs = list(envs)
+        self.throughput = EnvThroughput()
+
+    @property
+    def num_envs(self):
+        return len(self.envs)
+
+    @property
+    def states(self):
+        return torch.stack([env.state for env in self.envs])
+
+    def reset(self, initial_dicts=None, action_index=0, weights=DEFAULT_INITIAL_WEIGHTS):
+        """Start every sub-environment from the same initial stats (simulated once if not given)."""
+        first = self.envs[0]
+        first.reset(initial_dicts, action_index, weights)
+        for env in self.envs[1:]:
+            env.dicts, env.state, env.steps = first.dicts, first.state, 0
+        return self.states
+
+    def cursor(self):
+        """(stats, state, step count) of every sub-environment, for an agent checkpoint."""
+        return [(env.dicts, env.state, env.steps) for env in self.envs]
+
+    def restore(self, cursor):
+        """Put the sub-environments back where `cursor` found them; returns the batched states."""
+        if len(cursor) != self.num_envs:
+            raise ValueError(f"the cursor is of {len(cursor)} sub-environments, not {self.num_envs}")
+        for env, (dicts, state, steps) in zip(self.envs, cursor):
+            env.dicts, env.state, env.steps = dicts, state, steps
+        return self.states
+
+    def step(self, actions):
+        """Simulate one (action_index, weights) action per sub-environment.
+
+        Returns:
+            tuple: (states, rewards, dones, infos) batched over the sub-environments.
+        """
+        start_time = time.time()
+        timings = [{} for _ in self.envs]
+        with ThreadPoolExecutor(max_workers=self.num_envs) as executor:
+            futures = [executor.submit(env.simulate, env.actions[action_index], weights, timing)
+                       for env, (action_index, weights), timing in zip(self.envs, actions, timings)]
+        self.throughput.record(self.num_envs, time.time() - start_time)
+
+        rewards = np.full(self.num_envs, np.nan)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        simulated = []  # (index, stats) of the sub-environments whose simulation succeeded
+        for i, (env, future, timing) in enumerate(zip(self.envs, futures, timings)):
+            try:
+                dicts = future.result()
+            except Exception as e:
+                print(f"?? Sub-environment {i} failed: {e}")
+                env.steps += 1
+                dones[i] = env.steps % env.steps_per_episode == 0
+                infos.append({"error": e, "timing": timing})
+                continue
+            simulated.append((i, dicts))
+            infos.append({"dicts": dicts, "timing": timing})
+
+        if simulated:
+            first = self.envs[0]
+            states = first.preprocess(np.stack([first.features(dicts) for _, dicts in simulated]))
+            for (i, dicts), state in zip(simulated, states):
+                _, rewards[i], dones[i] = self.envs[i].observe(dicts, state)
+        return self.states, rewards, dones, infos
+
+
+def make_env(actions, features, preprocess, reward_fn, num_envs=1, base_outdir=DEFAULT_OUTDIR, **env_args):
+    """A vectorized environment of `num_envs` ICNEnv.
+
+    A single sub-environment keeps the default outdir and console port; with
+    more, each gets its own sub-directory of `base_outdir` and a free port.
+    """
+    if num_envs == 1:
+        return ICNVecEnv([ICNEnv(actions, features, preprocess, reward_fn, outdir=base_outdir, **env_args)])
+    ports = set()
+    envs = []
+    for i in range(num_envs):
+        port = find_free_port(exclude=ports)
+        ports.add(port)
+        envs.append(ICNEnv(actions, features, preprocess, reward_fn, outdir=os.path.join(base_outdir, f"env_{i}"),
+                           port=port, **env_args))
+    return ICNVecEnv(envs)
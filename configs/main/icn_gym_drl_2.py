@@ -9,7 +9,8 @@ import matplotlib.pyplot as plt
 #import csv
 # import time as ti
 # import pandas as pd
-from extract_network_stats import parse_stats, write_dicts_to_file
+from extract_network_stats import (parse_stats, write_dicts_to_file, stats_source, text_stats_path, H5_STATS_NAME,
+                                   TEXT_STATS_NAMES)
 
 ##add this to integrate with custom routing
 #def get_action(state, i_episode):
@@ -25,9 +26,17 @@ from extract_network_stats import parse_stats, write_dicts_to_file
 
 ##add these to make fs.py run
 import subprocess
-import telnetlib
 import time
 import socket
+import math
+import asyncio
+import signal
+
+from file_watch import FileWatcher, IN_MODIFY
+from gem5_console import Gem5Console
+from checkpoint_library import checkpoint_key
+from result_cache import canonical_weights
+from convergence_monitor import StatsFollower
 
 def is_port_open(host, port):
     """Check if the specified port is open."""
@@ -74,82 +83,463 @@ def is_file_stable(file_path, wait_time=10, min_size=100):
     
     return is_stable
 
-def wait_for_port(host, port, timeout=300):
-    """Wait up to `timeout` seconds for `port` to become available."""
+def wait_for_port(host, port, timeout=300, sim_process=None):
+    """Wait up to `timeout` seconds for `port` to become available.
+
+    Probes start every 50 ms and back off to once a second; if `sim_process`
+    is given, give up as soon as it has exited.
+    """
     start_time = time.time()
+    interval = 0.05
     while time.time() - start_time < timeout:
         if is_port_open(host, port):
             print(f"? Port {port} is now open!")
             return True
-        print(f"? Waiting for port {port} to open...")
-        time.sleep(180)
+        if sim_process is not None and sim_process.poll() is not None:
+            print(f"? gem5 exited before port {port} opened.")
+            return False
+        time.sleep(interval)
+        interval = min(interval * 2, 1.0)
     print(f"? Port {port} did not open within {timeout} seconds.")
     return False
 
-def run_gem5_simulation(action, mesh_rows, weights):
-    """Run the gem5 simulation with the given topology and mesh_rows."""
-    
-    os_command = (
-        f"bash -l -c '/home/guochu/gem5/build/X86_MESI_Two_Level/gem5.opt "
-        f"--outdir=/data/guochu/gem5/2paper/4c_routing/ferret/mem_768MB "
-        f"/home/guochu/gem5/configs/deprecated/example/fs_drl_attention.py "
-        f"--kernel=/home/guochu/gem5/parsec_full_system_images/binaries/x86_64-vmlinux-2.6.28.4-smp "
-        f"--disk=/home/guochu/gem5/parsec_full_system_images/disks/x86root-parsec.img "
-        f"--script=/home/guochu/gem5/parsec_full_system_images/benchmarks/ferret_4c_simsmall.rcS "
-        f"--network=garnet --num-cpus=4 --num-dirs=4 --ruby --num-l2caches=4 "
-        f"--l1d_size=64kB --l2_size=2MB  --mem-size=768MB --topology={action} {mesh_rows} --link-weight={weights}'"
+# Default locations of the single-instance run; parallel runs place one
+# sub-directory per instance under DEFAULT_OUTDIR (see gem5_pool.py)
+GEM5_BINARY = "/home/guochu/gem5/build/X86_MESI_Two_Level/gem5.opt"
+# The fs.py of this tree (configs/example/fs.py), which has the --terminal-port,
+# --stats-dump-period and stats_dumped hooks the driver relies on
+CONFIGS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FS_SCRIPT = os.path.join(CONFIGS_DIR, "example", "fs.py")
+DEFAULT_OUTDIR = "/data/guochu/gem5/2paper/4c_routing/ferret/mem_768MB"
+KERNEL = "/home/guochu/gem5/parsec_full_system_images/binaries/x86_64-vmlinux-2.6.28.4-smp"
+DISK_IMAGE = "/home/guochu/gem5/parsec_full_system_images/disks/x86root-parsec.img"
+BENCHMARK_DIR = "/home/guochu/gem5/parsec_full_system_images/benchmarks"
+# SLICC protocol sources the binary was built from; a change invalidates cached results
+PROTOCOL_DIR = "/home/guochu/gem5/src/mem/ruby/protocol"
+# Boots, takes one checkpoint and then runs whatever --script the restore passes (m5 readfile)
+BOOT_CHECKPOINT_SCRIPT = f"{BENCHMARK_DIR}/hack_back_ckpt.rcS"
+# Simulated system of every episode
+BENCHMARK = "ferret"
+NUM_CPUS = 4
+CPU_TYPE = "X86TimingSimpleCPU"  # default Ruby sets in Network.define_options
+L1D_SIZE = "64kB"
+L2_SIZE = "2MB"
+MEM_SIZE = "768MB"
+# Ticks between the periodic stats dumps a ConvergenceMonitor watches (1 ms simulated)
+STATS_DUMP_PERIOD = 1000000000
+DEFAULT_TERMINAL_PORT = 3462
+# Written by fs.py into the outdir once Simulation.run returns; gem5 dumps
+# the final statistics while it exits right after that
+STATS_SENTINEL = "stats_dumped"
+# "h5": gem5 writes stats.h5 next to stats.txt and parse_stats reads that one (needs h5py);
+# "gz": gem5 writes stats.txt.gz, which parse_stats decompresses as it reads
+STATS_FORMAT = "text"
+
+def find_free_port(host='localhost', exclude=()):
+    """Ask the OS for a free TCP port that is not in `exclude`."""
+    while True:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+        finally:
+            s.close()
+        if port not in exclude:
+            return port
+
+def benchmark_script(benchmark=BENCHMARK, num_cpus=NUM_CPUS):
+    """Path of the rcS script that runs `benchmark` (simsmall) on `num_cpus` cores."""
+    return f"{BENCHMARK_DIR}/{benchmark}_{num_cpus}c_simsmall.rcS"
+
+def build_gem5_command(action, mesh_rows, weights, outdir=DEFAULT_OUTDIR, port=DEFAULT_TERMINAL_PORT,
+                       script=None, checkpoint_dir=None, stats_dump_period=0, extra_args="",
+                       stats_format=STATS_FORMAT):
+    """Build the shell command that runs one gem5 full-system simulation.
+
+    With `checkpoint_dir` the run restores the first checkpoint in it instead
+    of booting the kernel (see checkpoint_library.py); a `stats_dump_period`
+    makes fs.py dump stats every that many ticks. `stats_format` "h5" has
+    gem5 write stats.h5 as well as stats.txt, "gz" stats.txt.gz instead.
+    """
+    script = script or benchmark_script()
+    restore = ""
+    if checkpoint_dir is not None:
+        # Ruby cannot run in atomic mode, so restore straight into the timing CPU
+        restore = (f"--checkpoint-dir={checkpoint_dir} --checkpoint-restore=1 "
+                   f"--restore-with-cpu={CPU_TYPE} ")
+    if stats_dump_period:
+        extra_args = f"--stats-dump-period={stats_dump_period} {extra_args}"
+    stats_file = ""
+    if stats_format == "h5":
+        stats_file = f"--stats-file=h5://{H5_STATS_NAME} "
+    elif stats_format == "gz":
+        stats_file = f"--stats-file={text_stats_name(stats_format)} "
+    return (
+        f"bash -l -c '{GEM5_BINARY} "
+        f"--outdir={outdir} {stats_file}"
+        f"{FS_SCRIPT} "
+        f"--kernel={KERNEL} "
+        f"--disk={DISK_IMAGE} "
+        f"--script={script} "
+        f"--cpu-type={CPU_TYPE} {restore}"
+        f"--network=garnet --num-cpus={NUM_CPUS} --num-dirs={NUM_CPUS} --ruby --num-l2caches={NUM_CPUS} "
+        f"--l1d_size={L1D_SIZE} --l2_size={L2_SIZE}  --mem-size={MEM_SIZE} --terminal-port={port} "
+        f"--topology={action} {mesh_rows} --link-weight={weights} {extra_args}'"
     )
 
+def text_stats_name(stats_format=STATS_FORMAT):
+    """Name of the text stats file gem5 writes with `stats_format`."""
+    return "stats.txt.gz" if stats_format == "gz" else "stats.txt"
+
+def clear_outdir(outdir):
+    """Remove the sentinel and stats files an earlier run left in `outdir`, so none of them is taken for the next."""
+    for name in (STATS_SENTINEL, H5_STATS_NAME) + TEXT_STATS_NAMES:
+        path = os.path.join(outdir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def prepare_gem5_run(action, mesh_rows, weights, outdir, port, **command_args):
+    """Create `outdir`, clear what an earlier run left in it and return the gem5 command."""
+    os.makedirs(outdir, exist_ok=True)
+    clear_outdir(outdir)
+    os_command = build_gem5_command(action, mesh_rows, weights, outdir, port, **command_args)
+
     print(f"?? Running gem5 with command:\n{os_command}")
+    return os_command
 
-    sim_process = subprocess.Popen(os_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+def run_gem5_simulation(action, mesh_rows, weights, outdir=DEFAULT_OUTDIR, port=DEFAULT_TERMINAL_PORT, **command_args):
+    """Run the gem5 simulation with the given topology and mesh_rows.
+
+    Each simulation writes into its own `outdir` and listens on its own
+    console `port`, so several of them can run side by side. gem5's own
+    stdout/stderr go to files in `outdir` instead of unread pipes.
+    `command_args` are passed on to build_gem5_command.
+    """
+    os_command = prepare_gem5_run(action, mesh_rows, weights, outdir, port, **command_args)
+
+    with open(os.path.join(outdir, "gem5.stdout"), "w") as out, \
+            open(os.path.join(outdir, "gem5.stderr"), "w") as err:
+        # Own process group, so that terminating it also stops gem5 below `bash -l -c`
+        sim_process = subprocess.Popen(os_command, shell=True, stdout=out, stderr=err, start_new_session=True)
 
     return sim_process
 
-def connect_to_telnet():
-    """Connect to gem5 via telnet in tmux session."""
-    
-    # Ensure tmux session exists
-    subprocess.run("tmux new-session -d -s 15", shell=True)
+def create_boot_checkpoint(checkpoint_dir):
+    """Boot the kernel once and leave a post-boot checkpoint (cpt.*) in `checkpoint_dir`.
+
+    Used as the `create` callback of CheckpointLibrary.acquire. The boot
+    script checkpoints right after boot; --max-checkpoints=1 ends the run there.
+    """
+    outdir = os.path.join(checkpoint_dir, "boot_m5out")
+    sim_process = run_gem5_simulation("Crossbar", "", "2,1,2,2", outdir, find_free_port(),
+                                      script=BOOT_CHECKPOINT_SCRIPT,
+                                      extra_args=f"--checkpoint-dir={checkpoint_dir} --max-checkpoints=1")
+    sim_process.wait()
+
+def current_checkpoint_key():
+    """CheckpointLibrary key of the system every episode simulates."""
+    return checkpoint_key(BENCHMARK, NUM_CPUS, L1D_SIZE, L2_SIZE, MEM_SIZE)
+
+def result_key_command(action, mesh_rows, weights, checkpoints=None, stats_dump_period=0):
+    """The gem5 command of an episode with the per-instance outdir and port left out.
+
+    Identical commands simulate identical systems, so this is what
+    ResultCache hashes; restoring a checkpoint changes the result (no boot
+    phase in stats.txt) and is part of it as well.
+    """
+    checkpoint_dir = f"<checkpoint:{current_checkpoint_key()}>" if checkpoints is not None else None
+    # The stats formats hold the same results, so they share cache entries
+    return build_gem5_command(action, mesh_rows, canonical_weights(weights), "<outdir>", "<port>",
+                              checkpoint_dir=checkpoint_dir, stats_dump_period=stats_dump_period,
+                              stats_format="text")
 
-    # Wait until port 3456 is available
-    if wait_for_port('localhost', 3462):
-        tmux_command = "tmux send-keys -t 15 'telnet localhost 3462' C-m"
-        subprocess.run(tmux_command, shell=True)
-        print("? Telnet connection initiated in tmux session.")
+def lookup_cached_result(results, command, outdir, timing):
+    """Return (key, cached stats dict or None) for `command` from ResultCache `results`."""
+    cache_key = results.key(command)
+    dicts = results.get(cache_key, outdir)
+    timing["result_cache_hit"] = dicts is not None
+    if dicts is not None:
+        print(f"? Reusing cached result {cache_key[:12]} ({results.summary()}).")
+        write_dicts_to_file(dicts, os.path.join(outdir, "network_stats.txt"))
+    return cache_key, dicts
+
+def checkpoint_restored(outdir):
+    """True if gem5 in `outdir` got past instantiating (and so restoring) the system."""
+    try:
+        with open(os.path.join(outdir, "gem5.stdout"), 'r', errors='replace') as f:
+            return any("**** REAL SIMULATION ****" in line for line in f)
+    except OSError:
+        return False
+
+def wait_for_stats(outdir, sim_process, timeout=None, on_wake=None):
+    """Block until gem5 has finished and stats.txt in `outdir` is complete.
+
+    Wakes up on the fs.py sentinel (via inotify where available) and on the
+    process exit instead of sleeping between size checks.
+
+    Returns:
+        bool: True if fs.py wrote the sentinel, False if gem5 exited without
+        it (crash, early stop or an fs.py without the sentinel); stats.txt
+        may then be incomplete.
+
+    `on_wake`, if given, is called after every file event in `outdir`
+    (including writes to stats.txt), e.g. to follow the periodic dumps.
+    """
+    sentinel = os.path.join(outdir, STATS_SENTINEL)
+    deadline = None if timeout is None else time.time() + timeout
+    # Setting up and tearing down a watcher costs milliseconds, so skip it
+    # for runs that are already over (e.g. stand-in runs)
+    if not os.path.exists(sentinel) and sim_process.poll() is None:
+        mask = FileWatcher.DEFAULT_MASK if on_wake is None else FileWatcher.DEFAULT_MASK | IN_MODIFY
+        with FileWatcher(outdir, mask=mask) as watcher:
+            while not os.path.exists(sentinel) and sim_process.poll() is None:
+                if deadline is not None and time.time() >= deadline:
+                    raise TimeoutError(f"gem5 in {outdir} did not finish within {timeout} seconds")
+                # An event wakes us up at once; the cap only bounds how late a
+                # crash without sentinel is noticed
+                watcher.wait(timeout=1.0)
+                if on_wake is not None:
+                    on_wake()
+    sim_process.wait()
+    return os.path.exists(sentinel)
+
+def legacy_wait_estimate(port_wait):
+    """Time the old sleep/poll loops would have spent waiting in one episode.
+
+    The old wait_for_port slept 180 s between probes and ICN_env always paid
+    at least one 10 s is_file_stable check after gem5 had exited.
+    """
+    return math.ceil(port_wait / 180) * 180 + 10
+
+def check_stats_file(outdir, completed, returncode):
+    """Return the path of the text stats in `outdir` (stats.txt or stats.txt.gz), raising if gem5 left none behind."""
+    stats_file = text_stats_path(outdir)
+    if not completed:
+        print(f"?? gem5 exited with code {returncode} without writing {STATS_SENTINEL}.")
+    if not os.path.exists(stats_file):
+        raise RuntimeError(f"gem5 exited with code {returncode} and no {stats_file}")
+    return stats_file
+
+def update_episode_timing(timing, outdir, console, launch_time, exit_time, stats_ready_time, completed):
+    """Fill `timing` with the wait and benchmark phase times of one episode."""
+    port_wait = (console.connected_time or exit_time) - launch_time
+    # fs.py wrote the sentinel when the simulation loop ended
+    sim_end_time = os.path.getmtime(os.path.join(outdir, STATS_SENTINEL)) if completed else exit_time
+    timing.update({
+        "port_wait": port_wait,
+        "simulation_time": exit_time - launch_time,
+        "completion_latency": stats_ready_time - sim_end_time,
+        "saved_time": legacy_wait_estimate(port_wait) - port_wait - (stats_ready_time - exit_time),
+        "guest_phase": console.phase,
+    })
+    # Benchmark phase times relative to the launch of gem5
+    timing.update({f"{marker}_time": seen - launch_time for marker, seen in console.seen.items()})
+    return timing
+
+def report_episode_timing(timing, outdir):
+    """Print the wait/saved times of one episode and keep them next to its stats."""
+    print(f"? Episode in {outdir}: simulation {timing['simulation_time']:.2f} s, "
+          f"stats ready {timing['completion_latency'] * 1000:.1f} ms after the simulation ended, "
+          f"~{timing['saved_time']:.2f} s saved versus sleep/poll waiting.")
+    with open(os.path.join(outdir, "episode_timing.txt"), 'w') as f:
+        for key, value in timing.items():
+            f.write(f"{key}: {value}\n")
+
+def signal_simulation(sim_process, sig=signal.SIGTERM):
+    """Send `sig` to gem5 and its `bash -l -c` wrapper (they share a process group)."""
+    if sim_process.returncode is not None:
+        return  # already reaped (or a finished stand-in run), its group may be gone or reused
+    try:
+        os.killpg(os.getpgid(sim_process.pid), sig)
+    except ProcessLookupError:
+        pass
 
 def terminate_simulation(sim_process):
     """Terminate the gem5 simulation process."""
     try:
-        sim_process.terminate()
+        signal_simulation(sim_process, signal.SIGTERM)
         sim_process.wait(timeout=10)
         print("? gem5 simulation terminated successfully.")
     except subprocess.TimeoutExpired:
         print("?? gem5 simulation did not terminate in time, force killing it.")
-        os.kill(sim_process.pid, 9)
+        signal_simulation(sim_process, signal.SIGKILL)
 
-def ICN_env(action, weights):
-    """Run gem5 simulation and connect to telnet."""
-    mesh_rows = "--mesh-rows=2" if action in ["Mesh_westfirst", "Torus", "FlattenedButterfly"] else ""
+def convergence_check(outdir, sim_process, monitor, stop=None):
+    """Return a callback that feeds new stats dumps to `monitor` and stops gem5 once it says so.
 
+    `stop` replaces the SIGTERM to gem5 (e.g. SimulationJob.stop, so the
+    scheduler does not retry the run).
+    """
+    follower = StatsFollower(os.path.join(outdir, text_stats_name()), num_cores=NUM_CPUS)
 
-    # Start gem5
-    sim_process = run_gem5_simulation(action, mesh_rows, weights)
+    def check():
+        for block_dicts in follower.poll():
+            if monitor.update(block_dicts, follower.aggregate.result()) and sim_process.returncode is None:
+                print(f"? Stopping {outdir} early ({monitor.reason}) after {monitor.dumps} dumps.")
+                if stop is not None:
+                    stop()
+                else:
+                    signal_simulation(sim_process, signal.SIGTERM)
+                break
+    return check
 
-    # Wait for gem5 to open port 3456
-    if wait_for_port('localhost', 3462):
-        connect_to_telnet()
-    
-    # Wait for gem5 to finish
-    sim_process.wait()
+def submit_simulation(scheduler, action, mesh_rows, weights, outdir, port, monitor=None, **command_args):
+    """Queue one run on a gem5_scheduler.Gem5Scheduler instead of starting gem5 here.
+
+    The console client (and the convergence check of `monitor`) is attached
+    to every attempt the scheduler starts. Returns the SimulationJob and the
+    list of (console, console thread, check) per attempt.
+    """
+    attempts = []
+
+    def on_start(job):
+        process = job.process
+        console = Gem5Console(port, os.path.join(outdir, "console.log"))
+        console_thread = console.start_in_thread(alive=lambda: process.poll() is None)
+        check = None
+        if monitor is not None:
+            monitor.reset()  # dumps of a crashed attempt do not count
+            check = convergence_check(outdir, process, monitor, stop=job.stop)
+        attempts.append((console, console_thread, check))
+        return check
+
+    job = scheduler.submit(action, mesh_rows, weights, outdir, port, on_start=on_start, **command_args)
+    return job, attempts
+
+def scheduled_attempt(job, attempts):
+    """Process, console, console thread and check of the last attempt of a finished SimulationJob."""
+    if not attempts:
+        raise RuntimeError(f"gem5 job {job.job_id} in {job.outdir} could not be started: {job.error}")
+    return (job.process,) + attempts[-1]
+
+def monitored_result(monitor):
+    """Stats of a monitored run: parse_stats of all the dumps it wrote (each covers one period), tagged."""
+    return monitor.tag(dict(monitor.totals))
+
+class Episode:
+    """The parts of one ICN_env/ICN_env_async episode around the gem5 run, which only differ in how it is awaited.
+
+    Constructing it looks the configuration up in `results`; `cached` holds
+    the stats of a hit, and the episode is over. Otherwise the caller pins
+    the checkpoint with acquire_checkpoint, launches and waits for gem5,
+    calls release_checkpoint, then collect and, with the parsed stats if
+    collect had none, finish.
+    """
+
+    def __init__(self, action, weights, outdir, timing, checkpoints, results, monitor, backend):
+        self.mesh_rows = "--mesh-rows=2" if action in ["Mesh_westfirst", "Torus", "FlattenedButterfly"] else ""
+        self.outdir = outdir
+        self.timing = {} if timing is None else timing
+        self.results = results
+        self.monitor = monitor
+        self.stats_dump_period = STATS_DUMP_PERIOD if monitor is not None else 0
+        # A stand-in boots nothing, so there is no checkpoint to restore
+        self.checkpoints = checkpoints if backend is None else None
+        self.cached = None
+        if results is not None:
+            self.command = result_key_command(action, self.mesh_rows, weights, self.checkpoints,
+                                              self.stats_dump_period)
+            self.cache_key, self.cached = lookup_cached_result(results, self.command, outdir, self.timing)
+
+    def acquire_checkpoint(self):
+        """Directory of the post-boot checkpoint to restore, pinned until release_checkpoint, or None."""
+        if self.checkpoints is None:
+            return None
+        return self.checkpoints.acquire(current_checkpoint_key(), create_boot_checkpoint)
+
+    def release_checkpoint(self):
+        if self.checkpoints is not None:
+            self.timing["checkpoint_restored"] = checkpoint_restored(self.outdir)
+            self.checkpoints.release(current_checkpoint_key(), self.timing["checkpoint_restored"])
+
+    def collect(self, sim_process, completed, check):
+        """Check stats.txt once gem5 has exited; returns the monitored stats, or None if stats.txt is to be parsed."""
+        self.completed = completed
+        self.stats_file = check_stats_file(self.outdir, completed, sim_process.returncode)
+        self.stats_ready_time = time.time()
+        if self.monitor is None:
+            return None
+        check()  # dumps written while gem5 exited
+        return monitored_result(self.monitor) if self.monitor.totals is not None else None
+
+    def finish(self, dicts, console, launch_time, exit_time):
+        """Write and cache the stats `dicts` and report the episode timing."""
+        write_dicts_to_file(dicts, os.path.join(self.outdir, "network_stats.txt"))
+        if self.results is not None and self.completed:
+            self.results.put(self.cache_key, self.command, dicts, self.stats_file)
+
+        update_episode_timing(self.timing, self.outdir, console, launch_time, exit_time, self.stats_ready_time,
+                              self.completed)
+        if self.monitor is not None:
+            self.timing["early_stop"] = self.monitor.reason or ""
+        report_episode_timing(self.timing, self.outdir)
+        return dicts
+
+def ICN_env(action, weights, outdir=DEFAULT_OUTDIR, port=DEFAULT_TERMINAL_PORT, timing=None, checkpoints=None,
+            results=None, monitor=None, scheduler=None, backend=None):
+    """Run gem5 simulation and follow its console.
+
+    `outdir` and `port` default to the original single-instance setup;
+    gem5_pool.Gem5Pool passes a distinct pair per instance so that
+    simulations can run concurrently. The guest console is streamed to
+    console.log in `outdir`. If `timing` is a dict it is filled with the
+    wait times and benchmark phase times of this episode. With a
+    CheckpointLibrary in `checkpoints` the episode restores the post-boot
+    checkpoint of the current system instead of booting Linux. With a
+    ResultCache in `results` an already simulated configuration is
+    answered from the cache without starting gem5. With a
+    ConvergenceMonitor in `monitor` gem5 dumps stats periodically and is
+    stopped as soon as the monitor decides; the returned stats are then
+    those of all its dumps (monitored_result), tagged with `early_stop`. With a Gem5Scheduler
+    in `scheduler` the run is queued there, started once the host has room
+    and retried if it crashes. A stand-in `backend` (standin_backend.py)
+    writes the outdir instead of gem5; it needs neither a scheduler nor a
+    console, and `checkpoints` is ignored with it.
+    """
+    episode = Episode(action, weights, outdir, timing, checkpoints, results, monitor, backend)
+    if episode.cached is not None:
+        return episode.cached
+    mesh_rows, stats_dump_period, timing = episode.mesh_rows, episode.stats_dump_period, episode.timing
+
+    checkpoint_dir = episode.acquire_checkpoint()
+
+    # The checkpoint stays pinned until gem5 is done with it, whatever happens meanwhile
+    try:
+        # Start gem5
+        launch_time = time.time()
+        if backend is not None:
+            sim_process = backend.launch(action, mesh_rows, weights, outdir, port, stats_dump_period=stats_dump_period)
+            console, console_thread = Gem5Console(port, os.path.join(outdir, "console.log")), None
+            check = convergence_check(outdir, sim_process, monitor) if monitor is not None else None
+            completed = wait_for_stats(outdir, sim_process, on_wake=check)
+        elif scheduler is not None:
+            job, attempts = submit_simulation(scheduler, action, mesh_rows, weights, outdir, port, monitor,
+                                              checkpoint_dir=checkpoint_dir, stats_dump_period=stats_dump_period)
+            completed = job.result()
+            sim_process, console, console_thread, check = scheduled_attempt(job, attempts)
+            launch_time = job.start_time
+            timing["queue_wait"] = job.start_time - job.submit_time
+            timing["attempts"] = job.attempts
+        else:
+            sim_process = run_gem5_simulation(action, mesh_rows, weights, outdir, port, checkpoint_dir=checkpoint_dir,
+                                              stats_dump_period=stats_dump_period)
+
+            # Attach to the console as soon as gem5 opens the port
+            console = Gem5Console(port, os.path.join(outdir, "console.log"))
+            console_thread = console.start_in_thread(alive=lambda: sim_process.poll() is None)
+
+            # Wait for gem5 to finish and for the final stats dump
+            check = convergence_check(outdir, sim_process, monitor) if monitor is not None else None
+            completed = wait_for_stats(outdir, sim_process, on_wake=check)
+        exit_time = time.time()
+        if console_thread is not None:
+            console_thread.join(timeout=5)
+    finally:
+        episode.release_checkpoint()
 
 
     # (Proceed with extracting stats, etc.)
-    stats_file = "/data/guochu/gem5/2paper/4c_routing/ferret/mem_768MB/stats.txt"
-    while not os.path.exists(stats_file) or not is_file_stable(stats_file):
-        time.sleep(30)
-    
-    output_file = "/data/guochu/gem5/2paper/4c_routing/ferret/mem_768MB/network_stats.txt"
+    dicts = episode.collect(sim_process, completed, check)
   
     #os_command2 = "/home/guochu/gem5/configs/RL_routing/extract_network_stats.sh"
     
@@ -184,8 +574,9 @@ def ICN_env(action, weights):
                 #val = my_line[2]
                 #dicts[key].append(val)
     # print(dicts)
-    dicts = parse_stats(stats_file,num_cores=4)
-    write_dicts_to_file(dicts, output_file)
+    if dicts is None:
+        dicts = parse_stats(stats_source(outdir),num_cores=4)
+    episode.finish(dicts, console, launch_time, exit_time)
     
     # After collecting data, terminate the simulation
     terminate_simulation(sim_process)
@@ -194,5 +585,138 @@ def ICN_env(action, weights):
 
     return dicts
     
+async def follow_stats_async(outdir, sim_process, on_wake):
+    """Call `on_wake` whenever gem5 writes into `outdir`, until the process exits (asyncio version of the wait_for_stats hook)."""
+    loop = asyncio.get_running_loop()
+    with FileWatcher(outdir, mask=FileWatcher.DEFAULT_MASK | IN_MODIFY) as watcher:
+        wake = asyncio.Event()
+        if watcher.uses_inotify:
+            loop.add_reader(watcher.fileno(), wake.set)
+        try:
+            while sim_process.returncode is None:
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                watcher.wait(timeout=0)  # drain the queued events
+                on_wake()
+        finally:
+            if watcher.uses_inotify:
+                loop.remove_reader(watcher.fileno())
+
+async def run_gem5_async(outdir, port, monitor, os_command):
+    """Run `os_command` as an asyncio subprocess with its console task until gem5 exits.
+
+    Returns (process, console, convergence check or None, exit time, completed).
+    """
+    with open(os.path.join(outdir, "gem5.stdout"), "w") as out, \
+            open(os.path.join(outdir, "gem5.stderr"), "w") as err:
+        sim_process = await asyncio.create_subprocess_shell(os_command, stdout=out, stderr=err,
+                                                            start_new_session=True)
+
+    # Follow the console while gem5 runs; the final stats dump is written
+    # before the process exits
+    console = Gem5Console(port, os.path.join(outdir, "console.log"))
+    console_task = asyncio.create_task(console.run(alive=lambda: sim_process.returncode is None))
+    check = convergence_check(outdir, sim_process, monitor) if monitor is not None else None
+    monitor_task = asyncio.create_task(follow_stats_async(outdir, sim_process, check)) if check else None
+    try:
+        await sim_process.wait()
+    except asyncio.CancelledError:
+        signal_simulation(sim_process, signal.SIGKILL)
+        console_task.cancel()
+        raise
+    finally:
+        if monitor_task is not None:
+            monitor_task.cancel()
+    exit_time = time.time()
+    completed = os.path.exists(os.path.join(outdir, STATS_SENTINEL))
+    try:
+        await asyncio.wait_for(console_task, timeout=5)
+    except asyncio.TimeoutError:
+        pass
+    return sim_process, console, check, exit_time, completed
+
+def job_finished(job):
+    """Future of a scheduled job's result, completed from the scheduler thread that finishes the job.
+
+    Unlike awaiting job.result in an executor, this holds no thread while gem5 runs.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(job):
+        if not future.done():
+            future.set_result(job.completed)
+
+    def on_done(job):
+        try:
+            loop.call_soon_threadsafe(resolve, job)
+        except RuntimeError:  # the event loop is closed; nobody is waiting anymore
+            pass
+
+    job.add_done_callback(on_done)
+    return future
+
+async def ICN_env_async(action, weights, outdir=DEFAULT_OUTDIR, port=DEFAULT_TERMINAL_PORT, timing=None, parse_executor=None,
+                        checkpoints=None, results=None, monitor=None, scheduler=None, backend=None):
+    """Awaitable version of ICN_env for running many episodes on one event loop.
+
+    gem5 runs as an asyncio subprocess and the console client as a task on
+    the same loop, so awaiting this only suspends the caller. parse_stats is
+    CPU-bound and runs in `parse_executor` (a ProcessPoolExecutor keeps it
+    off the GIL; None uses the loop's default thread pool). `checkpoints`,
+    `results`, `monitor`, `scheduler` and `backend` work as in ICN_env; a missing
+    checkpoint is created off the loop and a scheduled run is awaited as a
+    future that the scheduler completes (job_finished).
+    """
+    loop = asyncio.get_running_loop()
+    episode = Episode(action, weights, outdir, timing, checkpoints, results, monitor, backend)
+    if episode.cached is not None:
+        return episode.cached
+    mesh_rows, stats_dump_period, timing = episode.mesh_rows, episode.stats_dump_period, episode.timing
+
+    checkpoint_dir = None
+    if episode.checkpoints is not None:
+        checkpoint_dir = await loop.run_in_executor(None, episode.acquire_checkpoint)
+
+    # The checkpoint stays pinned until gem5 is done with it, whatever happens meanwhile
+    try:
+        # Start gem5
+        launch_time = time.time()
+        if backend is not None:
+            sim_process = backend.launch(action, mesh_rows, weights, outdir, port, stats_dump_period=stats_dump_period)
+            exit_time = time.time()
+            console = Gem5Console(port, os.path.join(outdir, "console.log"))
+            check = convergence_check(outdir, sim_process, monitor) if monitor is not None else None
+            completed = os.path.exists(os.path.join(outdir, STATS_SENTINEL))
+        elif scheduler is not None:
+            job, attempts = submit_simulation(scheduler, action, mesh_rows, weights, outdir, port, monitor,
+                                              checkpoint_dir=checkpoint_dir, stats_dump_period=stats_dump_period)
+            try:
+                completed = await job_finished(job)
+            except asyncio.CancelledError:
+                job.stop(signal.SIGKILL)
+                raise
+            exit_time = time.time()
+            sim_process, console, console_thread, check = scheduled_attempt(job, attempts)
+            launch_time = job.start_time
+            timing["queue_wait"] = job.start_time - job.submit_time
+            timing["attempts"] = job.attempts
+            await loop.run_in_executor(None, console_thread.join, 5)
+        else:
+            sim_process, console, check, exit_time, completed = await run_gem5_async(
+                outdir, port, monitor,
+                prepare_gem5_run(action, mesh_rows, weights, outdir, port, checkpoint_dir=checkpoint_dir,
+                                 stats_dump_period=stats_dump_period))
+    finally:
+        episode.release_checkpoint()
+
+    dicts = episode.collect(sim_process, completed, check)
+    if dicts is None:
+        dicts = await loop.run_in_executor(parse_executor, parse_stats, stats_source(outdir), 4)
+    return episode.finish(dicts, console, launch_time, exit_time)
+
 # Example Usage
 #dicts= ICN_env("Mesh_westfirst", "2,1,2,2")
\ No newline at end of file
@@ -0,0 +1,124 @@
+##this file is to keep a tabular Q-function over discretized states in fixed-size arrays, with eviction and a binary file format
+import struct
+
+import numpy as np
+
+from atomic_file import atomic_write
+
+MAGIC = b"ICNQTB01"
+
+# magic, actions, state size, capacity, entries, clock, resolution, eviction (b"lru" or b"visits")
+_HEADER = struct.Struct("<8sIIIIqd8s")
+
+EVICTION_POLICIES = ("lru", "visits")
+
+
+class QTable:
+    """Q-values of discretized states in dense arrays, at most `capacity` states.
+
+    A state vector is divided by `resolution` and rounded to integer
+    cells; states in the same cells share a row of `values`, found through
+    the `index` map (cells bytes -> row). When the table is full, a new
+    state takes the row of the least recently used state ("lru") or of the
+    least visited one ("visits", the older one on ties).
+    """
+
+    def __init__(self, num_actions, state_dim, capacity=50000, resolution=0.25, eviction="lru"):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"eviction must be one of {EVICTION_POLICIES}, not {eviction!r}")
+        self.num_actions = num_actions
+        self.state_dim = state_dim
+        self.capacity = capacity
+        self.resolution = resolution
+        self.eviction = eviction
+        self.cells = np.zeros((capacity, state_dim), dtype=np.int32)
+        self.values = np.zeros((capacity, num_actions), dtype=np.float64)
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.index = {}
+        self.clock = 0  # number of lookups so far, the LRU time
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def discretize(self, state):
+        return np.round(np.asarray(state, dtype=np.float64).ravel() / self.resolution).astype(np.int32)
+
+    def get(self, state):
+        """Q-values of `state` (zeros for an unknown state), without adding or touching an entry."""
+        row = self.index.get(self.discretize(state).tobytes())
+        return np.zeros(self.num_actions) if row is None else self.values[row].copy()
+
+    def __getitem__(self, state):
+        """The row of Q-values of `state`, added if needed; updates through the returned view are kept."""
+        cells = self.discretize(state)
+        key = cells.tobytes()
+        row = self.index.get(key)
+        if row is None:
+            row = self._free_row()
+            self.index[key] = row
+            self.cells[row] = cells
+            self.values[row] = 0.0
+            self.visits[row] = 0
+        self.clock += 1
+        self.visits[row] += 1
+        self.last_used[row] = self.clock
+        return self.values[row]
+
+    def _free_row(self):
+        size = len(self.index)
+        if size < self.capacity:
+            return size
+        if self.eviction == "lru":
+            row = int(np.argmin(self.last_used))
+        else:
+            row = int(np.lexsort((self.last_used, self.visits))[0])
+        del self.index[self.cells[row].tobytes()]
+        self.evictions += 1
+        return row
+
+    def items(self):
+        """(cells tuple, Q-values) of every state, for text dumps."""
+        for row in self.index.values():
+            yield tuple(self.cells[row].tolist()), self.values[row]
+
+    def save(self, path):
+        """Write the table to `path` in the binary format (atomic_write).
+
+        The header is followed by the cells (int32), Q-values (float64),
+        visit counts and last-use times (int64) of the stored states only.
+        """
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        with atomic_write(path) as f:
+            f.write(_HEADER.pack(MAGIC, self.num_actions, self.state_dim, self.capacity, len(rows), self.clock,
+                                 self.resolution, self.eviction.encode()))
+            for array in (self.cells, self.values, self.visits, self.last_used):
+                f.write(np.ascontiguousarray(array[rows]).tobytes())
+
+    @classmethod
+    def load(cls, path, capacity=None):
+        """The table saved at `path`; a smaller `capacity` keeps the most recently used states."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, num_actions, state_dim, saved_capacity, size, clock, resolution, eviction = \
+            _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Q-table file")
+        table = cls(num_actions, state_dim, capacity or saved_capacity, resolution, eviction.rstrip(b"\0").decode())
+        offset = _HEADER.size
+        arrays = []
+        for dtype, width in ((np.int32, state_dim), (np.float64, num_actions), (np.int64, 1), (np.int64, 1)):
+            count = size * width
+            arrays.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(size, width))
+            offset += count * np.dtype(dtype).itemsize
+        cells, values, visits, last_used = arrays
+        keep = np.argsort(last_used[:, 0], kind="stable")[-table.capacity:] if size else np.arange(0)
+        n = len(keep)
+        table.cells[:n] = cells[keep]
+        table.values[:n] = values[keep]
+        table.visits[:n] = visits[keep, 0]
+        table.last_used[:n] = last_used[keep, 0]
+        table.index = {table.cells[row].tobytes(): row for row in range(n)}
+        table.clock = clock
+        return table
@@ -0,0 +1,86 @@
+##this file is to keep past (state, action, weights, reward, next state) transitions in preallocated arrays for minibatch DQN updates
+import numpy as np
+
+from atomic_file import atomic_write
+
+
+class ReplayBuffer:
+    """Ring buffer of transitions in NumPy arrays allocated once for `capacity` entries.
+
+    The link weights of a transition are stored padded to `weight_dim`
+    with their length alongside, since each topology has its own number of
+    weights. `step_weight` scales a transition's loss (runs stopped early
+    count less). Once full, the oldest transition is overwritten.
+    """
+
+    FIELDS = ("states", "actions", "weights", "weight_lengths", "rewards", "next_states", "step_weights")
+
+    def __init__(self, capacity, state_dim, weight_dim, seed=None):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.weights = np.zeros((capacity, weight_dim), dtype=np.float32)
+        self.weight_lengths = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.step_weights = np.ones(capacity, dtype=np.float32)
+        self.position = 0  # where the next transition goes
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, weights, reward, next_state, step_weight=1.0):
+        """Store one transition; the states and weights may be tensors or arrays."""
+        i = self.position
+        weights = np.asarray(weights, dtype=np.float32).ravel()
+        self.states[i] = np.asarray(state, dtype=np.float32)
+        self.actions[i] = action
+        self.weights[i, :len(weights)] = weights
+        self.weights[i, len(weights):] = 0.0
+        self.weight_lengths[i] = len(weights)
+        self.rewards[i] = reward
+        self.next_states[i] = np.asarray(next_state, dtype=np.float32)
+        self.step_weights[i] = step_weight
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """A uniform minibatch (with replacement) as a dict of arrays, batch_size rows each."""
+        if self.size == 0:
+            raise ValueError("cannot sample from an empty replay buffer")
+        index = self.rng.integers(0, self.size, size=batch_size)
+        return {
+            "states": self.states[index],
+            "actions": self.actions[index],
+            "weights": self.weights[index],
+            "weight_lengths": self.weight_lengths[index],
+            "rewards": self.rewards[index],
+            "next_states": self.next_states[index],
+            "step_weights": self.step_weights[index],
+        }
+
+    def _ordered(self, array):
+        """The stored rows of `array`, oldest first."""
+        if self.size < self.capacity:
+            return array[:self.size]
+        return np.concatenate((array[self.position:], array[:self.position]))
+
+    def save(self, path):
+        """Write the stored transitions (oldest first) to an .npz file (atomic_write)."""
+        with atomic_write(path) as f:
+            np.savez(f, capacity=self.capacity, **{name: self._ordered(getattr(self, name)) for name in self.FIELDS})
+
+    @classmethod
+    def load(cls, path, capacity=None, seed=None):
+        """A buffer with the transitions of `path`; a smaller `capacity` keeps only the newest ones."""
+        with np.load(path) as data:
+            capacity = int(data["capacity"]) if capacity is None else capacity
+            buffer = cls(capacity, data["states"].shape[1], data["weights"].shape[1], seed)
+            size = min(len(data["states"]), capacity)
+            for name in cls.FIELDS:
+                getattr(buffer, name)[:size] = data[name][len(data[name]) - size:]
+        buffer.size = size
+        buffer.position = size % capacity
+        return buffer
@@ -0,0 +1,156 @@
+##this file is to reuse the stats of (topology, weights) configurations that were already simulated
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from atomic_file import atomic_write
+
+DEFAULT_RESULT_CACHE_ROOT = "/data/guochu/gem5/result_cache"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha256 of the content of `path`."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tree_digest(directory):
+    """sha256 over the relative names and contents of every file below `directory`."""
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            h.update(os.path.relpath(path, directory).encode())
+            h.update(file_digest(path).encode())
+    return h.hexdigest()
+
+
+def canonical_weights(weights):
+    """Link-weight string with integral values written as ints and no blanks ("2.0, 1" -> "2,1")."""
+    values = []
+    for w in str(weights).split(","):
+        value = float(w)
+        values.append(str(int(value)) if value.is_integer() else repr(value))
+    return ",".join(values)
+
+
+def _write_json(path, data):
+    with atomic_write(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+class ResultCache:
+    """Persistent store of parsed stats, addressed by the hash of the gem5 command.
+
+    The key also covers a build fingerprint made of the gem5 binary and the
+    SLICC protocol files; when either changes, every stored result is
+    dropped on open, since the same command would now simulate different
+    hardware. Each entry holds the parse_stats dict and the raw stats.txt
+    (or stats.txt.gz, as gem5 wrote it).
+    """
+
+    def __init__(self, gem5_binary, protocol_dir, root=DEFAULT_RESULT_CACHE_ROOT):
+        self.root = root
+        self.entries_dir = os.path.join(root, "entries")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fingerprint = self._build_fingerprint(gem5_binary, protocol_dir)
+        self._invalidate_stale()
+        counters_path = os.path.join(root, "counters.json")
+        if os.path.exists(counters_path):
+            with open(counters_path, 'r') as f:
+                counters = json.load(f)
+            self.hits, self.misses = counters["hits"], counters["misses"]
+
+    def _build_fingerprint(self, gem5_binary, protocol_dir):
+        # Hashing a gem5.opt of several hundred MB takes seconds, so reuse the
+        # digest while the binary keeps its size and mtime
+        digests_path = os.path.join(self.root, "binary_digests.json")
+        digests = {}
+        if os.path.exists(digests_path):
+            with open(digests_path, 'r') as f:
+                digests = json.load(f)
+        st = os.stat(gem5_binary)
+        stamp = f"{os.path.abspath(gem5_binary)}:{st.st_size}:{st.st_mtime_ns}"
+        if stamp not in digests:
+            digests = {stamp: file_digest(gem5_binary)}
+            _write_json(digests_path, digests)
+        protocol = tree_digest(protocol_dir) if os.path.isdir(protocol_dir) else "no-protocol-dir"
+        return hashlib.sha256(f"{digests[stamp]}\n{protocol}".encode()).hexdigest()
+
+    def _invalidate_stale(self):
+        fingerprint_path = os.path.join(self.root, "fingerprint")
+        old = None
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path, 'r') as f:
+                old = f.read().strip()
+        if old is not None and old != self.fingerprint:
+            print("? gem5 binary or protocol files changed, dropping cached simulation results.")
+            shutil.rmtree(self.entries_dir, ignore_errors=True)
+            os.makedirs(self.entries_dir, exist_ok=True)
+            if os.path.exists(os.path.join(self.root, "counters.json")):
+                os.remove(os.path.join(self.root, "counters.json"))
+        with open(fingerprint_path, 'w') as f:
+            f.write(self.fingerprint + "\n")
+
+    def key(self, command):
+        """Cache key of the gem5 `command` (outdir/port already replaced by placeholders)."""
+        return hashlib.sha256(f"{self.fingerprint}\n{command}".encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.entries_dir, key[:2], key)
+
+    def get(self, key, outdir=None):
+        """Return the cached stats dict of `key` or None; on a hit the raw stats.txt is copied into `outdir`."""
+        result_path = os.path.join(self._entry_dir(key), "result.json")
+        try:
+            with open(result_path, 'r') as f:
+                dicts = json.load(f)["dicts"]
+        except (OSError, ValueError, KeyError):
+            dicts = None
+        with self._lock:
+            if dicts is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._save_counters()
+        if dicts is not None and outdir is not None:
+            os.makedirs(outdir, exist_ok=True)
+            stats_file = self.stats_file(key)
+            shutil.copyfile(stats_file, os.path.join(outdir, os.path.basename(stats_file)))
+        return dicts
+
+    def stats_file(self, key):
+        """The raw text stats file stored with `key`."""
+        entry_dir = self._entry_dir(key)
+        for name in ("stats.txt.gz", "stats.txt.zst"):
+            if os.path.exists(os.path.join(entry_dir, name)):
+                return os.path.join(entry_dir, name)
+        return os.path.join(entry_dir, "stats.txt")
+
+    def put(self, key, command, dicts, stats_file):
+        """Store the parsed `dicts` and a copy of `stats_file` under `key`."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}_{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        shutil.copyfile(stats_file, os.path.join(tmp_dir, os.path.basename(stats_file)))
+        _write_json(os.path.join(tmp_dir, "result.json"),
+                    {"command": command, "fingerprint": self.fingerprint, "dicts": dicts})
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+    def _save_counters(self):
+        _write_json(os.path.join(self.root, "counters.json"), {"hits": self.hits, "misses": self.misses})
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return f"result cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
@@ -0,0 +1,253 @@
+##this file is to stand in for gem5: replay recorded stats.txt files or synthesize them, in milliseconds
+import abc
+import glob
+import json
+import math
+import os
+import random
+import re
+import shutil
+import time
+
+from extract_network_stats import COMPRESSED_OPENERS, is_compressed
+from icn_gym_drl_2 import ICN_env, STATS_SENTINEL, clear_outdir
+from result_cache import canonical_weights
+
+TICKS_PER_CYCLE = 500  # 2 GHz Ruby clock at gem5's 1 ps tick
+
+# Average packet latency in cycles of each topology for the synthetic model
+DEFAULT_BASE_LATENCY = {
+    "Mesh_westfirst": 30.0,
+    "Pt2Pt": 18.0,
+    "Crossbar": 22.0,
+    "Torus": 26.0,
+    "FatTree": 28.0,
+    "FlattenedButterfly": 24.0,
+}
+
+
+class StandInProcess:
+    """Popen look-alike of a stand-in run; the run is already over when it is handed out."""
+
+    pid = None
+
+    def __init__(self, returncode=0):
+        self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+def _stat_line(name, value, description):
+    return f"{name:<60} {value:>20} # {description}\n"
+
+
+def render_stats(dumps):
+    """stats.txt text of one dump block per dict of stat name -> value in `dumps`."""
+    out = []
+    for stats in dumps:
+        out.append("\n---------- Begin Simulation Statistics ----------\n")
+        for name, value in stats.items():
+            out.append(_stat_line(name, value, "stand-in"))
+        out.append("\n---------- End Simulation Statistics   ----------\n")
+    return "".join(out)
+
+
+class StandInBackend(abc.ABC):
+    """Base of the stand-in simulators: write what gem5 and fs.py leave in an outdir.
+
+    `launch` has the signature of icn_gym_drl_2.run_gem5_simulation and
+    returns a finished StandInProcess, so ICN_env follows the same
+    sentinel/stats.txt/parse_stats path as for a real run. A stand-in boots
+    nothing, so ICN_env never hands it a checkpoint.
+    """
+
+    def launch(self, action, mesh_rows, weights, outdir, port, stats_dump_period=0, **_):
+        os.makedirs(outdir, exist_ok=True)
+        clear_outdir(outdir)
+        sentinel = os.path.join(outdir, STATS_SENTINEL)
+        ticks = self.write_stats(action, weights, os.path.join(outdir, "stats.txt"), stats_dump_period)
+        with open(os.path.join(outdir, "gem5.stdout"), 'w') as f:
+            f.write(f"stand-in for gem5: --topology={action} {mesh_rows} --link-weight={weights}\n")
+        open(os.path.join(outdir, "gem5.stderr"), 'w').close()
+        with open(sentinel + ".tmp", 'w') as f:
+            f.write(f"{ticks}\n")
+        os.replace(sentinel + ".tmp", sentinel)
+        return StandInProcess()
+
+    @abc.abstractmethod
+    def write_stats(self, action, weights, stats_file, stats_dump_period):
+        """Write stats.txt for one run and return the simulated ticks."""
+
+
+class SyntheticBackend(StandInBackend):
+    """Synthesize stats.txt from a parametric model of the network.
+
+    The packet latency is the topology's base latency, raised by how far the
+    link weights stray from `preferred_weight` (scaled by
+    `weight_sensitivity`) and by multiplicative noise; the cache-side delays
+    and message counts follow it, so reward_f responds to both the topology
+    and the weights. With a stats dump period, `dumps` dumps are written,
+    each holding only the stats of its own interval as gem5's do (it resets
+    the stats after a periodic dump), so parse_stats adds them up to a run
+    of the same size as with a single dump.
+    """
+
+    def __init__(self, num_cores=4, base_latency=None, preferred_weight=2.0, weight_sensitivity=0.05,
+                 noise=0.02, dumps=8, seed=None):
+        self.num_cores = num_cores
+        self.base_latency = dict(DEFAULT_BASE_LATENCY if base_latency is None else base_latency)
+        self.preferred_weight = preferred_weight
+        self.weight_sensitivity = weight_sensitivity
+        self.noise = noise
+        self.dumps = dumps
+        self.rng = random.Random(seed)
+
+    def latency_cycles(self, action, weights):
+        """Noise-free average packet latency of `action` with `weights` (cycles)."""
+        values = [float(w) for w in str(weights).split(",") if w.strip()]
+        stray = sum(abs(w - self.preferred_weight) for w in values) / len(values) if values else 0.0
+        base = self.base_latency.get(action, max(self.base_latency.values()))
+        return base * (1.0 + self.weight_sensitivity * stray)
+
+    def _dump(self, start, end, latency, packets):
+        """Stats of the interval from `start` to `end` (fractions of the run); averages are those of the interval."""
+        r = self.rng
+        share = end - start
+
+        def jitter():
+            return 1.0 + r.gauss(0.0, self.noise) / math.sqrt(share * self.dumps)
+
+        packet_latency = latency * TICKS_PER_CYCLE * jitter()
+        queueing = 0.2 * packet_latency
+        injected = int(packets * end) - int(packets * start)
+        received = injected - r.randint(0, max(1, injected // 1000))
+        stats = {
+            "simSeconds": f"{share * 0.05:.6f}",
+            "simTicks": int(end * 5e10) - int(start * 5e10),
+            "system.ruby.network.packets_injected::total": injected,
+            "system.ruby.network.packets_received::total": received,
+            "system.ruby.network.flits_injected::total": injected * 3,
+            "system.ruby.network.flits_received::total": received * 3,
+            "system.ruby.network.ext_in_link_utilization": injected * 2,
+            "system.ruby.network.int_link_utilization": injected * 4,
+            "system.ruby.network.average_packet_queueing_latency": f"{queueing:.6f}",
+            "system.ruby.network.average_packet_network_latency": f"{packet_latency - queueing:.6f}",
+            "system.ruby.network.average_packet_latency": f"{packet_latency:.6f}",
+            "system.ruby.network.average_flit_queueing_latency": f"{queueing:.6f}",
+            "system.ruby.network.average_flit_network_latency": f"{packet_latency - queueing + TICKS_PER_CYCLE:.6f}",
+            "system.ruby.network.average_flit_latency": f"{packet_latency + TICKS_PER_CYCLE:.6f}",
+            "system.ruby.network.average_hops": f"{latency / 10:.6f}",
+            "system.ruby.network.avg_link_utilization": f"{min(1.0, 0.02 * latency / 30) * jitter():.6f}",
+        }
+        for vnet in range(3):
+            samples = max(1, injected // 3)
+            stats[f"system.ruby.delayVCHist.vnet_{vnet}::mean"] = f"{latency / 6 * jitter():.6f}"
+            stats[f"system.ruby.delayVCHist.vnet_{vnet}::total"] = samples
+        for core in range(self.num_cores):
+            prefix = f"system.ruby.l1_cntrl{core}.L1Dcache"
+            write_hits = max(1, int(injected / self.num_cores / 8))
+            read_misses = max(1, int(injected / self.num_cores / 4))
+            stats[f"{prefix}.total_cache_level_messages"] = int(injected / self.num_cores * 2)
+            stats[f"{prefix}.NoCwriteHitCounter"] = write_hits
+            stats[f"{prefix}.totalNoCWriteHitDuration"] = int(write_hits * packet_latency * 1000 * jitter())
+            stats[f"{prefix}.NoCreadMissCounter"] = read_misses
+            stats[f"{prefix}.totalNoCReadMissDuration"] = int(read_misses * packet_latency * 80 * jitter())
+        return stats
+
+    def write_stats(self, action, weights, stats_file, stats_dump_period):
+        latency = self.latency_cycles(action, weights)
+        packets = 500000 * (1.0 + self.rng.gauss(0.0, self.noise))
+        dumps = self.dumps if stats_dump_period else 1
+        with open(stats_file, 'w') as f:
+            f.write(render_stats(self._dump(i / dumps, (i + 1) / dumps, latency, packets) for i in range(dumps)))
+        return int(5e10)
+
+
+class ReplayBackend(StandInBackend):
+    """Replay recorded stats.txt files.
+
+    `recordings` is a list of (action, weights, stats_file) with action or
+    weights None where unknown. A launch replays a recording of the same
+    topology and weights if there is one, else one of the same topology,
+    else any, picking at random among equally good matches.
+    """
+
+    def __init__(self, recordings, seed=None):
+        self.recordings = [(action, canonical_weights(weights) if weights else None, path)
+                           for action, weights, path in recordings]
+        if not self.recordings:
+            raise ValueError("ReplayBackend needs at least one recorded stats.txt")
+        self.rng = random.Random(seed)
+
+    @classmethod
+    def from_result_cache(cls, root, seed=None):
+        """Recordings from the entries of a result_cache.ResultCache, with their topology and weights."""
+        recordings = []
+        for result_path in glob.glob(os.path.join(root, "entries", "*", "*", "result.json")):
+            with open(result_path, 'r') as f:
+                command = json.load(f)["command"]
+            topology = re.search(r"--topology=(\S+)", command)
+            weights = re.search(r"--link-weight=([^\s']+)", command)
+            entry_dir = os.path.dirname(result_path)
+            recordings.append((topology.group(1) if topology else None,
+                               weights.group(1) if weights else None,
+                               glob.glob(os.path.join(entry_dir, "stats.txt*"))[0]))
+        return cls(recordings, seed)
+
+    @classmethod
+    def from_outdirs(cls, outdirs, seed=None):
+        """Recordings from gem5 outdirs (or globs of them) whose topology is unknown."""
+        paths = [path for pattern in outdirs for path in glob.glob(os.path.join(pattern, "stats.txt"))
+                 + glob.glob(os.path.join(pattern, "stats.txt.gz")) + glob.glob(os.path.join(pattern, "stats.txt.zst"))]
+        return cls([(None, None, path) for path in sorted(paths)], seed)
+
+    def pick(self, action, weights):
+        weights = canonical_weights(weights)
+        for match in (lambda a, w: a == action and w == weights, lambda a, w: a == action, lambda a, w: True):
+            candidates = [path for a, w, path in self.recordings if match(a, w)]
+            if candidates:
+                return self.rng.choice(candidates)
+
+    def write_stats(self, action, weights, stats_file, stats_dump_period):
+        recording = self.pick(action, weights)
+        if is_compressed(recording):
+            with COMPRESSED_OPENERS[os.path.splitext(recording)[1]](recording) as src, open(stats_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            shutil.copyfile(recording, stats_file)
+        return 0  # not recorded
+
+
+def benchmark(backend, episodes=1000, outdir="/tmp/standin_outdir"):
+    """Episodes per second of ICN_env on `backend`, including the stats.txt parse."""
+    actions = list(DEFAULT_BASE_LATENCY)
+    start_time = time.time()
+    for i in range(episodes):
+        ICN_env(actions[i % len(actions)], "2,1,2,2", outdir=outdir, backend=backend)
+    elapsed = time.time() - start_time
+    print(f"? {episodes} stand-in episodes in {elapsed:.2f} s "
+          f"({episodes / elapsed:.1f} episodes/s, {elapsed / episodes * 1000:.2f} ms each)")
+    return episodes / elapsed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time ICN_env on a stand-in backend instead of gem5")
+    parser.add_argument("--episodes", type=int, default=1000)
+    parser.add_argument("--outdir", default="/tmp/standin_outdir")
+    parser.add_argument("--replay-cache", help="replay the entries of this result cache root")
+    parser.add_argument("--replay-outdirs", nargs="+", help="replay the stats.txt of these gem5 outdirs")
+    parser.add_argument("--seed", type=int, default=0)
+    cli_args = parser.parse_args()
+    if cli_args.replay_cache:
+        chosen = ReplayBackend.from_result_cache(cli_args.replay_cache, cli_args.seed)
+    elif cli_args.replay_outdirs:
+        chosen = ReplayBackend.from_outdirs(cli_args.replay_outdirs, cli_args.seed)
+    else:
+        chosen = SyntheticBackend(seed=cli_args.seed)
+    benchmark(chosen, cli_args.episodes, cli_args.outdir)
@@ -0,0 +1,69 @@
+##this file is to keep the running mean and variance of the agent's states and normalize states with them
+import numpy as np
+
+from atomic_file import atomic_write
+
+
+class RunningNormalizer:
+    """Running mean and variance of `state_dim`-sized states (Welford's algorithm, by batches).
+
+    `mean` and `m2` (the summed squared deviations) are float64. A batch is
+    folded in with the parallel form of the update (Chan et al.), which is
+    also how `merge` combines the statistics of two normalizers, e.g. of
+    parallel workers, as if one had seen all their states.
+    """
+
+    def __init__(self, state_dim, epsilon=1e-5):
+        self.state_dim = state_dim
+        self.epsilon = epsilon  # added to the standard deviation to avoid dividing by 0
+        self.count = 0
+        self.mean = np.zeros(state_dim)
+        self.m2 = np.zeros(state_dim)
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta * delta * (self.count * count / total)
+        self.count = total
+
+    def update(self, states):
+        """Fold a (batch, state_dim) array of states (or one state) into the statistics."""
+        states = np.asarray(states, dtype=np.float64).reshape(-1, self.state_dim)
+        if len(states) == 0:
+            return
+        mean = states.mean(axis=0)
+        self._combine(len(states), mean, ((states - mean) ** 2).sum(axis=0))
+
+    def merge(self, other):
+        """Fold in the statistics of another normalizer."""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+
+    @property
+    def std(self):
+        """Sample standard deviation, zeros until two states were seen."""
+        if self.count < 2:
+            return np.zeros(self.state_dim)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def normalize(self, states):
+        """`states` (one or a batch) standardized by the statistics; unchanged until two states were seen."""
+        states = np.asarray(states, dtype=np.float64)
+        if self.count < 2:
+            return states
+        return (states - self.mean) / (self.std + self.epsilon)
+
+    def save(self, path):
+        """Write the statistics to an .npz file (atomic_write)."""
+        with atomic_write(path) as f:
+            np.savez(f, count=self.count, mean=self.mean, m2=self.m2, epsilon=self.epsilon)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            normalizer = cls(len(data["mean"]), float(data["epsilon"]))
+            normalizer.count = int(data["count"])
+            normalizer.mean = data["mean"].copy()
+            normalizer.m2 = data["m2"].copy()
+        return normalizer
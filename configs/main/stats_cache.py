@@ -0,0 +1,94 @@
+##this file is to keep the parsed stats of a gem5 outdir in a binary columnar file next to its stats.txt
+import json
+import math
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from atomic_file import atomic_write
+from extract_network_stats import parse_stats_with_series
+
+CACHE_NAME = "stats.columns"
+MAGIC = b"ICNCOL03"
+
+# magic, num_cores, dumps, stats.txt size, stats.txt mtime (ns), metadata length
+_HEADER = struct.Struct("<8sIIqqI4x")
+
+
+def cache_path(stats_file):
+    """The cache file of `stats_file` (in the same outdir)."""
+    return os.path.join(os.path.dirname(os.path.abspath(stats_file)), CACHE_NAME)
+
+
+def _padded(length):
+    return (length + 7) & ~7
+
+
+def load_cached(stats_file, num_cores):
+    """(averages, series) of `stats_file` from its cache, or None if there is none or it is stale.
+
+    The cache is stale once stats.txt has another size or mtime than when
+    it was written, or was parsed for another core count. The series
+    columns are read-only float64 arrays over a memory map of the cache, so
+    loading copies nothing.
+    """
+    path = cache_path(stats_file)
+    try:
+        source = os.stat(stats_file)
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # no stats.txt, no cache, or an empty cache
+        return None
+    if len(mapped) < _HEADER.size:
+        mapped.close()
+        return None
+    magic, cores, dumps, size, mtime_ns, meta_len = _HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or cores != num_cores or size != source.st_size or mtime_ns != source.st_mtime_ns:
+        mapped.close()
+        return None
+    meta = json.loads(mapped[_HEADER.size:_HEADER.size + meta_len].decode())
+    offset = _HEADER.size + _padded(meta_len)
+    series = {}
+    for key, shape in zip(meta["columns"], meta["shapes"]):
+        count = dumps * math.prod(shape)
+        series[key] = np.frombuffer(mapped, dtype=np.float64, count=count, offset=offset).reshape([dumps] + shape)
+        offset += 8 * count
+    return meta["averages"], series
+
+
+def store(stats_file, num_cores, averages, series, source=None):
+    """Write the cache of `stats_file`; `source` is the os.stat of stats.txt the results were parsed from."""
+    source = source or os.stat(stats_file)
+    columns = list(series)
+    dumps = len(series[columns[0]]) if columns else 0
+    shapes = [list(np.shape(series[key])[1:]) for key in columns]  # e.g. [cores] of the per-core columns
+    meta = json.dumps({"columns": columns, "shapes": shapes, "averages": averages}).encode()
+    path = cache_path(stats_file)
+    with atomic_write(path) as f:  # readers never see a half-written cache
+        f.write(_HEADER.pack(MAGIC, num_cores, dumps, source.st_size, source.st_mtime_ns, len(meta)))
+        f.write(meta.ljust(_padded(len(meta)), b"\0"))
+        for key in columns:
+            f.write(np.ascontiguousarray(series[key], dtype=np.float64).tobytes())
+
+
+def cached_parse(stats_file, num_cores):
+    """(parse_stats dict, parse_stats_series columns) of `stats_file`, parsing it only if the cache is stale."""
+    cached = load_cached(stats_file, num_cores)
+    if cached is not None:
+        return cached
+    source = os.stat(stats_file)
+    averages, series = parse_stats_with_series(stats_file, num_cores)  # one read of a possibly huge file
+    after = os.stat(stats_file)
+    if (after.st_size, after.st_mtime_ns) == (source.st_size, source.st_mtime_ns):  # not appended to meanwhile
+        try:
+            store(stats_file, num_cores, averages, series, source)
+        except OSError as e:
+            print(f"?? Cannot write the stats cache of {stats_file}: {e}")
+    return averages, series
+
+
+def cached_parse_stats(stats_file, num_cores):
+    """parse_stats through the columnar cache."""
+    return cached_parse(stats_file, num_cores)[0]
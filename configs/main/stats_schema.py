@@ -0,0 +1,194 @@
+##this file is to declare which gem5 stats parse_stats reads and how each one is reduced, in one place
+SUM = "sum"  # added over the dumps
+MEAN = "mean"  # added over the dumps and divided by the dump count
+LAST = "last"  # value of the last dump that wrote it
+SAMPLE_WEIGHTED = "sample_weighted"  # added values over added sample counts
+AGGREGATIONS = (SUM, MEAN, LAST, SAMPLE_WEIGHTED)
+
+CORE = "{core}"
+INDEX = "{index}"
+
+
+class Metric:
+    """One key of the parse_stats dict: the gem5 stat it reads and how that is reduced.
+
+    `pattern` is a stat name. "{core}" in it stands for the controller
+    index, read from each stat name, and makes a per-core metric. "{index}"
+    is expanded over `indices`; the instances are added up unless the key
+    holds "{index}" as well, which gives one key per index. `aggregation`
+    reduces the dumps: SUM adds them, MEAN divides that by the dump count,
+    LAST keeps the value of the last dump that wrote it, and SAMPLE_WEIGHTED
+    divides the added values by the added `weight` stats (the value being a
+    total over `weight` samples; a dump counts only if its value is positive
+    and its weight was written). `scale` is a stat of the same dump to
+    multiply the value by, e.g. the sample count that turns a histogram
+    mean into a total, and `only_if` one that must be positive in the same
+    dump for the value to count at all.
+
+    A per-core metric is reduced over the cores the same way (SAMPLE_WEIGHTED
+    pools the samples of all cores). Controllers at or above num_cores are
+    left out, unless `all_controllers` adds them to the total of a SUM or
+    MEAN metric (not to its per-core list). `per_core` is the key of the
+    per-core list, if one is wanted. `digits` rounds the result (0 gives an
+    int).
+    """
+
+    def __init__(self, key, pattern, aggregation=SUM, weight=None, scale=None, only_if=None, indices=None,
+                 per_core=None, all_controllers=False, digits=None):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"{key}: unknown aggregation {aggregation!r}")
+        if (weight is not None) != (aggregation == SAMPLE_WEIGHTED):
+            raise ValueError(f"{key}: a weight goes with, and only with, {SAMPLE_WEIGHTED}")
+        if (INDEX in pattern) != (indices is not None):
+            raise ValueError(f"{key}: indices go with, and only with, {INDEX} in the pattern")
+        if CORE in pattern and (indices is not None or INDEX in key):
+            raise ValueError(f"{key}: a per-core metric cannot have indices")
+        if (per_core is not None or all_controllers) and CORE not in pattern:
+            raise ValueError(f"{key}: per_core and all_controllers need {CORE} in the pattern")
+        if all_controllers and aggregation not in (SUM, MEAN):
+            raise ValueError(f"{key}: only {SUM} and {MEAN} totals can take in all controllers")
+        self.key = key
+        self.pattern = pattern
+        self.aggregation = aggregation
+        self.weight = weight
+        self.scale = scale
+        self.only_if = only_if
+        self.indices = None if indices is None else list(indices)
+        self.per_core = per_core
+        self.all_controllers = all_controllers
+        self.digits = digits
+
+    @property
+    def is_per_core(self):
+        return CORE in self.pattern
+
+    def keys(self):
+        """The parse_stats keys of this metric, without the per-core list."""
+        if INDEX in self.key:
+            return [self.key.replace(INDEX, str(i)) for i in self.indices]
+        return [self.key]
+
+    def __repr__(self):
+        return f"Metric({self.key!r}, {self.pattern!r}, {self.aggregation!r})"
+
+
+NETWORK = "system.ruby.network."
+L1D = "system.ruby.l1_cntrl{core}.L1Dcache."
+VNET = "system.ruby.delayVCHist.vnet_{index}"
+
+# What parse_stats returns, in this order (the per-core lists come last)
+METRICS = [
+    Metric("average_packet_queueing_latency", NETWORK + "average_packet_queueing_latency", MEAN),
+    Metric("average_packet_network_latency", NETWORK + "average_packet_network_latency", MEAN),
+    Metric("average_packet_latency", NETWORK + "average_packet_latency", MEAN),
+    Metric("average_flit_queueing_latency", NETWORK + "average_flit_queueing_latency", MEAN),
+    Metric("average_flit_network_latency", NETWORK + "average_flit_network_latency", MEAN),
+    Metric("average_flit_latency", NETWORK + "average_flit_latency", MEAN),
+    Metric("average_hops", NETWORK + "average_hops", MEAN),
+    Metric("average_link_utilization", NETWORK + "avg_link_utilization", MEAN),
+    Metric("packets_injected", NETWORK + "packets_injected::total"),
+    Metric("packets_received", NETWORK + "packets_received::total"),
+    Metric("flits_injected", NETWORK + "flits_injected::total"),
+    Metric("flits_received", NETWORK + "flits_received::total"),
+    Metric("external_link_utilization", NETWORK + "ext_in_link_utilization"),
+    Metric("internal_link_utilization", NETWORK + "int_link_utilization"),
+    Metric("total_cache_level_messages", L1D + "total_cache_level_messages", per_core="core_cache_level_messages",
+           all_controllers=True, digits=0),
+    Metric("total_average_write_hit_time", L1D + "totalNoCWriteHitDuration", SAMPLE_WEIGHTED,
+           weight=L1D + "NoCwriteHitCounter", per_core="core_average_write_hit_time", digits=2),
+    Metric("total_average_readmiss_time", L1D + "totalNoCReadMissDuration", SAMPLE_WEIGHTED,
+           weight=L1D + "NoCreadMissCounter", per_core="core_average_readmiss_time", digits=2),
+    # Total delay of the last dump over all vnets (histogram mean times its samples)
+    Metric("average_packet_delay", VNET + "::mean", LAST, scale=VNET + "::total", indices=range(3)),
+]
+
+# Extra columns of the per-dump series (parse_stats_series)
+SERIES_METRICS = [
+    Metric("vnet_{index}_delay", VNET + "::mean", LAST, indices=range(3)),
+    # The counters of the dumps the averages count (those with a positive duration)
+    Metric("writehit_count", L1D + "NoCwriteHitCounter", only_if=L1D + "totalNoCWriteHitDuration"),
+    Metric("readmiss_count", L1D + "NoCreadMissCounter", only_if=L1D + "totalNoCReadMissDuration"),
+    Metric("total_NoCWriteHitDuration", L1D + "totalNoCWriteHitDuration"),
+    Metric("total_NoCReadMissDuration", L1D + "totalNoCReadMissDuration"),
+]
+
+
+def metric_keys(metrics=METRICS):
+    """The scalar parse_stats keys of `metrics` (e.g. the columns of a results CSV)."""
+    return [key for metric in metrics for key in metric.keys()]
+
+
+def counter_keys(metrics=METRICS):
+    """Keys (per-core lists included) of the SUM metrics, the counters that add up over the dumps of a run."""
+    keys = []
+    for metric in metrics:
+        if metric.aggregation == SUM:
+            keys += metric.keys() + ([metric.per_core] if metric.per_core else [])
+    return keys
+
+
+class MetricPlan:
+    """Where one metric finds its values in the per-dump rows of a CompiledSchema.
+
+    `value`, `scale`, `weight` and `only_if` are a list of row columns (one
+    per instance) for the other metrics, and one column of the per-core
+    rows for per-core metrics; they are None when the metric has no such stat.
+    """
+
+    def __init__(self, metric, value, scale, weight, only_if):
+        self.metric = metric
+        self.value = value
+        self.scale = scale
+        self.weight = weight
+        self.only_if = only_if
+
+
+class CompiledSchema:
+    """`metrics` turned into the lookup tables of the one-pass parser.
+
+    Every stat name a metric reads gets a column in the per-dump rows
+    (`columns`, name -> column), except per-core stats, which get a column
+    in the per-dump (columns, cores) rows: `core_columns` maps the part of
+    the name before the controller index to {rest of the name: column}.
+    A stat read by several metrics is stored once.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.columns = {}
+        self.core_columns = {}
+        self.core_names = []  # (prefix, rest) of each per-core column
+        self.plans = {}
+        for metric in self.metrics:
+            if metric.key in self.plans:
+                raise ValueError(f"{metric.key}: declared twice")
+            if metric.is_per_core:
+                columns = [None if pattern is None else self._core_column(pattern)
+                           for pattern in (metric.pattern, metric.scale, metric.weight, metric.only_if)]
+            else:
+                columns = [None if pattern is None else self._columns(pattern, metric.indices)
+                           for pattern in (metric.pattern, metric.scale, metric.weight, metric.only_if)]
+            self.plans[metric.key] = MetricPlan(metric, *columns)
+
+    @property
+    def names(self):
+        """Stat name of each row column, in column order."""
+        return list(self.columns)
+
+    def _columns(self, pattern, indices):
+        names = [pattern] if indices is None else [pattern.replace(INDEX, str(i)) for i in indices]
+        return [self.columns.setdefault(name, len(self.columns)) for name in names]
+
+    def _core_column(self, pattern):
+        prefix, _, rest = pattern.partition(CORE)
+        if not rest.startswith("."):
+            raise ValueError(f"{pattern}: the controller index must be followed by '.'")
+        rests = self.core_columns.setdefault(prefix, {})
+        if rest not in rests:
+            rests[rest] = len(self.core_names)
+            self.core_names.append((prefix, rest))
+        return rests[rest]
+
+
+SCHEMA = CompiledSchema(METRICS)
+SERIES_SCHEMA = CompiledSchema(METRICS + SERIES_METRICS)